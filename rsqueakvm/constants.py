@@ -234,6 +234,9 @@ def decode_alternate_compiled_method_header(header):
 #
 
 INTERRUPT_COUNTER_SIZE = 10000
+METHOD_CACHE_SIZE = 1024  # entries in the global method lookup cache, power of 2
+INLINE_CACHE_SIZE = 4  # classes per send site before it is considered megamorphic
+INLINE_CACHE_RETRY = 10000  # interpreted sends before a megamorphic site caches again
 CompileTime = time.time()
 
 SYSTEM_ATTRIBUTE_IMAGE_NAME_INDEX = 1
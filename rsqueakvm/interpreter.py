@@ -4,10 +4,16 @@ import sys
 sys.setrecursionlimit(1000000)
 
 from rsqueakvm.storage_contexts import ContextPartShadow, ActiveContext, InactiveContext, DirtyContext
+from rsqueakvm.storage_classes import MethodLookupCache
 from rsqueakvm import model, constants, wrapper, objspace, interpreter_bytecodes, error
 from rsqueakvm.error import MetaPrimFailed
+from rsqueakvm.util import signals
+from rsqueakvm.util.reactor import Reactor
+from rsqueakvm.util.gcstats import GcStatistics
+from rsqueakvm.util.profiler import SamplingProfiler, SAMPLE_INTERPRETED, SAMPLE_JITTED, SAMPLE_PRIMITIVE
 
 from rpython.rlib import jit, rstackovf, unroll, objectmodel, rsignal
+from rpython.rlib.rarithmetic import intmask
 
 
 class ReturnFromTopLevel(Exception):
@@ -116,7 +122,10 @@ class ProcessSwitch(ContextSwitchException):
     Triggered when switching the process."""
     type = "Process Switch"
 
-UNROLLING_BYTECODE_RANGES = unroll.unrolling_iterable(interpreter_bytecodes.BYTECODE_RANGES)
+# One entry per bytecode. The unrolled equality checks in step() are merged
+# into a single switch by the translator, instead of testing the ranges one
+# after the other. In traces the bytecode is constant, so nothing changes there.
+UNROLLING_BYTECODE_DISPATCH = unroll.unrolling_iterable(interpreter_bytecodes.BYTECODE_DISPATCH)
 
 def get_printable_location(pc, self, method):
     bc = ord(method.bytes[pc])
@@ -125,6 +134,11 @@ def get_printable_location(pc, self, method):
 
 USE_SIGUSR1 = hasattr(rsignal, 'SIGUSR1')
 
+# Longest time the idle primitive sleeps at once while waiting for a timer
+MAX_IDLE_MICROSECONDS = 1000000
+# ... and while a window is open, whose input events we have to fetch
+IDLE_DISPLAY_MICROSECONDS = 10000
+
 
 class Interpreter(object):
     _immutable_fields_ = ["space",
@@ -134,6 +148,11 @@ class Interpreter(object):
                           "interrupts",
                           "trace_important",
                           "interrupt_counter_size",
+                          "interrupt_timer",
+                          "lookup_cache",
+                          "profiler",
+                          "reactor",
+                          "gc_stats",
                           "trace"]
 
     jit_driver = jit.JitDriver(
@@ -145,7 +164,8 @@ class Interpreter(object):
     )
 
     def __init__(self, space, image=None, trace_important=False,
-                 trace=False, evented=True, interrupts=True):
+                 trace=False, evented=True, interrupts=True,
+                 interrupt_timer=0):
         # === Initialize immutable variables
         self.space = space
         self.image = image
@@ -160,7 +180,17 @@ class Interpreter(object):
             self.interrupt_counter_size = int(os.environ["SPY_ICS"])
         except KeyError:
             self.interrupt_counter_size = constants.INTERRUPT_COUNTER_SIZE
+        # Microseconds between interrupt checks, driven by a SIGALRM timer.
+        # 0 means counting sends and bytecodes instead.
+        if signals.HAS_ITIMER:
+            self.interrupt_timer = interrupt_timer
+        else:
+            self.interrupt_timer = 0
         self.trace = trace
+        self.lookup_cache = MethodLookupCache()
+        self.profiler = SamplingProfiler()
+        self.reactor = Reactor()
+        self.gc_stats = GcStatistics()
 
         # === Initialize mutable variables
         self.interrupt_check_counter = self.interrupt_counter_size
@@ -170,11 +200,23 @@ class Interpreter(object):
         self.process_switch_count = 0
         self.forced_interrupt_checks_count = 0
         self.stack_overflow_count = 0
+        self.snapshot_pid = 0
+        self.pending_external_semaphores = []
+        self.forwarders_w = []
 
         if not objectmodel.we_are_translated():
             if USE_SIGUSR1:
                 rsignal.pypysig_setflag(rsignal.SIGUSR1)
 
+    def wait_for_snapshot(self):
+        # Block until an image snapshot written by a forked child is done.
+        if self.snapshot_pid > 0:
+            try:
+                os.waitpid(self.snapshot_pid, 0)
+            except OSError:
+                pass
+            self.snapshot_pid = 0
+
     def populate_remaining_special_objects(self):
         with objspace.ForceHeadless(self.space):
             for name, idx in constants.objects_in_special_object_table.items():
@@ -337,21 +379,16 @@ class Interpreter(object):
                 self.check_sigusr(context)
 
         bytecode = context.fetch_next_bytecode()
-        for entry in UNROLLING_BYTECODE_RANGES:
-            if len(entry) == 2:
-                bc, methname = entry
-                if bytecode == bc:
-                    return getattr(context, methname)(self, bytecode)
-            else:
-                start, stop, methname = entry
-                if start <= bytecode <= stop:
-                    return getattr(context, methname)(self, bytecode)
+        for bc, methname in UNROLLING_BYTECODE_DISPATCH:
+            if bytecode == bc:
+                return getattr(context, methname)(self, bytecode)
         assert 0, "unreachable"
 
     # ============== Methods for handling user interrupts ==============
 
     def jitted_check_for_interrupt(self, s_frame):
-        if not self.interrupts:
+        self.check_for_signals(s_frame)
+        if not self.interrupts or self.interrupt_timer > 0:
             return
         # Normally, the tick counter is decremented by 1 for every message send.
         # Since we don't know how many messages are called during this trace, we
@@ -359,20 +396,93 @@ class Interpreter(object):
         trace_length = jit.current_trace_length()
         decr_by = int(trace_length // 1000)
         if decr_by > 0:
-            self.quick_check_for_interrupt(s_frame, decr_by)
+            self.count_down_interrupt_check(s_frame, decr_by)
 
     def quick_check_for_interrupt(self, s_frame, dec=1):
-        if not self.interrupts:
+        self.check_for_signals(s_frame)
+        if not self.interrupts or self.interrupt_timer > 0:
             return
+        self.count_down_interrupt_check(s_frame, dec)
+
+    def count_down_interrupt_check(self, s_frame, dec):
         self.interrupt_check_counter -= dec
         if self.interrupt_check_counter <= 0:
             self.interrupt_check_counter = self.interrupt_counter_size
             self.check_for_interrupts(s_frame)
 
+    def force_interrupt_check(self, s_frame):
+        if not self.interrupts:
+            return
+        self.interrupt_check_counter = self.interrupt_counter_size
+        self.check_for_interrupts(s_frame)
+
+    # With an interrupt timer (SIGALRM) or the sampling profiler (SIGPROF)
+    # running, signals are polled where we would otherwise only count down to
+    # the next interrupt check. The flags are constant in traces, so without
+    # either there is nothing to check.
+
+    def signals_enabled(self):
+        return self.interrupt_timer > 0 or self.profiler.is_active()
+
+    def check_for_signals(self, s_frame):
+        if self.signals_enabled() and signals.signal_pending():
+            if jit.we_are_jitted():
+                kind = SAMPLE_JITTED
+            else:
+                kind = SAMPLE_INTERPRETED
+            if self.handle_signals(s_frame.w_method(), kind, True):
+                self.check_for_interrupts(s_frame)
+
+    def check_for_signals_after_primitive(self, w_method):
+        # A sample that became due while the primitive ran is charged to it.
+        # Interrupts are left pending for the next regular check.
+        if self.signals_enabled() and signals.signal_pending():
+            self.handle_signals(w_method, SAMPLE_PRIMITIVE, False)
+
+    @jit.dont_look_inside
+    def handle_signals(self, w_method, kind, may_interrupt):
+        """Take the pending signals. Answer whether the interrupt timer
+        expired and interrupts should be checked now."""
+        signals.clear_signal_pending()
+        sample = False
+        interrupt = False
+        others = []
+        while True:
+            signum = signals.poll_signal()
+            if signum == -1:
+                break
+            elif signum == signals.SIGPROF:
+                sample = True
+            elif signum == signals.SIGALRM:
+                interrupt = True
+            else:
+                others.append(signum)
+        # leave other signals, e.g. SIGUSR1, to check_sigusr
+        for signum in others:
+            signals.pushback_signal(signum)
+        if sample and self.profiler.is_active():
+            self.profiler.record(w_method, kind)
+        if interrupt and not may_interrupt:
+            signals.pushback_signal(signals.SIGALRM)
+            return False
+        return interrupt and self.interrupts
+
+    def start_interrupt_timer(self):
+        if self.interrupt_timer > 0:
+            signals.start_interval_timer(signals.ITIMER_REAL, signals.SIGALRM,
+                                         self.interrupt_timer)
+
+    def stop_interrupt_timer(self):
+        if self.interrupt_timer > 0:
+            signals.stop_interval_timer(signals.ITIMER_REAL, signals.SIGALRM)
+
     def check_sigusr(self, s_frame):
         poll = rsignal.pypysig_poll()
         if poll == rsignal.SIGUSR1:
             print s_frame.print_stack()
+        elif poll != -1:
+            # leave the signals of the interval timers to check_for_signals
+            rsignal.pypysig_pushback(poll)
 
     def check_for_interrupts(self, s_frame):
         # parallel to Interpreter>>#checkForInterrupts
@@ -384,7 +494,8 @@ class Interpreter(object):
         self.forced_interrupt_checks_count += 1
         now = self.time_now()
 
-        # XXX the low space semaphore may be signaled here
+        if self.gc_stats.check_low_space(self.event_time_now()):
+            self.signal_low_space(s_frame)
         # TODO: Check for User Interrupt
         if not self.next_wakeup_tick == 0 and now >= self.next_wakeup_tick:
             self.next_wakeup_tick = 0
@@ -392,8 +503,62 @@ class Interpreter(object):
             if not semaphore.is_nil(self.space):
                 wrapper.SemaphoreWrapper(self.space, semaphore).signal(s_frame)
         # We have no finalization process, so far.
-        # We do not support external semaphores.
-        # In cog, the method to add such a semaphore is only called in GC.
+        # External semaphores are signalled for I/O readiness, found here or
+        # while idle.
+        self.poll_reactor()
+        if self.pending_external_semaphores:
+            self.signal_external_semaphores(s_frame)
+
+    def poll_reactor(self):
+        self.pending_external_semaphores.extend(
+            self.reactor.poll(self.event_time_now()))
+
+    @jit.dont_look_inside
+    def signal_low_space(self, s_frame):
+        if not self.image:
+            return
+        w_semaphore = self.image.special(constants.SO_LOW_SPACE_SEMAPHORE)
+        if not w_semaphore.getclass(self.space).is_same_object(self.space.w_Semaphore):
+            return
+        # the low space watcher of the image looks at the process that
+        # allocated last
+        w_active_process = wrapper.scheduler(self.space).active_process()
+        self.image.special_objects.atput0(
+            self.space, constants.SO_PROCESS_SIGNALIGN_LOW_SPACE, w_active_process)
+        wrapper.SemaphoreWrapper(self.space, w_semaphore).signal(s_frame)
+
+    def idle(self, s_frame, microseconds):
+        """Sleep until the next timer wakeup, or for the given time if none
+        is scheduled, or until a socket becomes ready."""
+        timeout = microseconds
+        if self.next_wakeup_tick != 0:
+            until_wakeup = self.next_wakeup_tick - self.time_now()
+            if until_wakeup > MAX_IDLE_MICROSECONDS:
+                until_wakeup = MAX_IDLE_MICROSECONDS
+            timeout = max(0, intmask(until_wakeup))
+        if self.space.has_display():
+            # SDL has no file descriptor to wait for, so look for input events
+            # regularly
+            timeout = min(timeout, IDLE_DISPLAY_MICROSECONDS)
+        self.pending_external_semaphores.extend(self.reactor.wait(timeout))
+        if self.pending_external_semaphores:
+            self.signal_external_semaphores(s_frame)
+
+    def signal_external_semaphores(self, s_frame):
+        # Signalling a semaphore can switch processes. The semaphores not
+        # signalled yet stay pending until the next interrupt check.
+        w_external_objects = self.space.w_nil
+        if self.image:
+            w_external_objects = self.image.special(constants.SO_EXTERNAL_OBJECTS_ARRAY)
+        while self.pending_external_semaphores:
+            index = self.pending_external_semaphores.pop(0)
+            if not isinstance(w_external_objects, model.W_PointersObject):
+                continue
+            if not 0 < index <= w_external_objects.size():
+                continue
+            w_semaphore = w_external_objects.at0(self.space, index - 1)
+            if w_semaphore.getclass(self.space).is_same_object(self.space.w_Semaphore):
+                wrapper.SemaphoreWrapper(self.space, w_semaphore).signal(s_frame)
 
     def time_now(self):
         """
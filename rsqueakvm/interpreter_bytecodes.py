@@ -292,21 +292,36 @@ class __extend__(ContextPartShadow):
     # ====== Helpers for send/return bytecodes ======
     def _sendSelfSelector(self, w_selector, argcount, interp):
         receiver = self.peek(argcount)
+        inline_cache = self.w_method().send_cache_at(self.pc(), w_selector)
         return self._sendSelector(w_selector, argcount, interp,
-                                  receiver, receiver.class_shadow(self.space))
+                                  receiver, receiver.class_shadow(self.space),
+                                  inline_cache=inline_cache)
 
     def _sendSuperSelector(self, w_selector, argcount, interp):
-        compiledin_class = self.w_method().compiled_in()
+        w_method = self.w_method()
+        compiledin_class = w_method.compiled_in()
         assert isinstance(compiledin_class, model.W_PointersObject)
         s_compiledin = compiledin_class.as_class_get_shadow(self.space)
+        inline_cache = w_method.send_cache_at(self.pc(), w_selector)
         return self._sendSelector(w_selector, argcount, interp, self.w_receiver(),
-                                  s_compiledin.s_superclass())
+                                  s_compiledin.s_superclass(),
+                                  inline_cache=inline_cache)
 
     @objectmodel.specialize.argtype(7)
     def _sendSelector(self, w_selector, argcount, interp, receiver,
-                      receiverclassshadow, w_arguments=None, s_fallback=None):
+                      receiverclassshadow, w_arguments=None, s_fallback=None,
+                      inline_cache=None):
         assert argcount >= 0
-        w_method = receiverclassshadow.lookup(w_selector)
+        if interp.space.defer_method_changes.is_set():
+            # the caches are not invalidated during a batch of method changes
+            w_method = receiverclassshadow.lookup(w_selector)
+        elif inline_cache is not None:
+            w_method = inline_cache.lookup(receiverclassshadow, w_selector,
+                                           interp.lookup_cache)
+        elif jit.we_are_jitted():
+            w_method = receiverclassshadow.lookup(w_selector)
+        else:
+            w_method = interp.lookup_cache.lookup(receiverclassshadow, w_selector)
         if w_method is None:
             if w_arguments:
                 self.push_all(w_arguments)
@@ -335,6 +350,7 @@ class __extend__(ContextPartShadow):
         s_frame = w_method.create_frame(interp.space, receiver, w_arguments,
                                         s_fallback=s_fallback)
         self.pop()  # receiver
+        self.clear_dead_stack_slots()
 
         # ######################################################################
         if interp.is_tracing():
@@ -410,14 +426,17 @@ class __extend__(ContextPartShadow):
                                     w_selector.selector_string()))
         func = primitives.prim_holder.prim_table[code]
         try:
-            # note: argcount does not include rcvr
-            # the primitive pushes the result (if any) onto the stack itself
-            return func(interp, self, argcount, w_method)
-        except error.PrimitiveFailedError, e:
-            if interp.is_tracing() and isinstance(w_method, model.W_CompiledMethod):
-                interp.print_padded("-- primitive %d FAILED\t (in %s, named %s)" % (
-                            code, w_method.safe_identifier_string(), w_selector.selector_string()))
-            raise e
+            try:
+                # note: argcount does not include rcvr
+                # the primitive pushes the result (if any) onto the stack itself
+                return func(interp, self, argcount, w_method)
+            except error.PrimitiveFailedError, e:
+                if interp.is_tracing() and isinstance(w_method, model.W_CompiledMethod):
+                    interp.print_padded("-- primitive %d FAILED\t (in %s, named %s)" % (
+                                code, w_method.safe_identifier_string(), w_selector.selector_string()))
+                raise e
+        finally:
+            interp.check_for_signals_after_primitive(w_method)
 
     def _return(self, return_value, interp, local_return=False):
         # unfortunately, this assert is not true for some tests. TODO fix this.
@@ -745,7 +764,10 @@ def initialize_bytecode_names():
 
 BYTECODE_NAMES = initialize_bytecode_names()
 
-def initialize_bytecode_table():
+def initialize_bytecode_dispatch():
+    """Answer a (bytecode, method name) pair for each of the 256 bytecodes,
+    in order. Interpreter.step dispatches over these with plain equality
+    checks, which the translator merges into a single switch."""
     result = [None] * 256
     for entry in BYTECODE_RANGES:
         if len(entry) == 2:
@@ -753,9 +775,147 @@ def initialize_bytecode_table():
         else:
             positions = range(entry[0], entry[1]+1)
         for pos in positions:
-            result[pos] = getattr(ContextPartShadow, entry[-1])
+            result[pos] = (pos, entry[-1])
     assert None not in result
     return result
 
+BYTECODE_DISPATCH = initialize_bytecode_dispatch()
+
+def initialize_bytecode_table():
+    return [getattr(ContextPartShadow, methname)
+            for _, methname in BYTECODE_DISPATCH]
+
 # this table is only used for creating named bytecodes in tests and printing
 BYTECODE_TABLE = initialize_bytecode_table()
+
+# ____________________________________________________________________________
+# Stack depth analysis
+#
+# The depth of the operand stack at a given pc is the same every time
+# execution reaches it, so we can compute it once per method. The result is
+# used to find stack slots that can no longer be read, see
+# ContextPartShadow.clear_dead_stack_slots.
+
+# Stack effect of the special selector sends 176-207.
+SPECIAL_SEND_EFFECTS = [-1] * 16 + [
+    -1, -2, 0, 0, -1, 0, -1, 0,  # at: at:put: size next nextPut: atEnd == class
+    -1, 0, -1, -1, 0, -1, 0, 0]  # blockCopy: value value: do: new new: x y
+
+def _merge_stack_depth(depths, worklist, pc, depth):
+    if pc < 0 or pc >= len(depths) or depth < 0:
+        return False
+    if depths[pc] == -1:
+        depths[pc] = depth
+        worklist.append(pc)
+        return True
+    return depths[pc] == depth
+
+def compute_stack_depths(bytes):
+    """Answer a list with the stack depth (above the temps) on entry of each
+    bytecode, or -1 where the bytecode is not reachable from pc 0. Bodies of
+    closures count as reachable, starting with an empty stack, bodies of
+    old-style blocks do not. Answer None if the bytecodes cannot be analysed,
+    e.g. because they use unknown bytecodes or jump out of the method."""
+    depths = [-1] * len(bytes)
+    worklist = []
+    if not _merge_stack_depth(depths, worklist, 0, 0):
+        return None
+    while worklist:
+        pc = worklist.pop()
+        depth = depths[pc]
+        bc = ord(bytes[pc])
+        length = 1
+        effect = 0
+        jump = -1  # target of a jump, -1 if none
+        falls_through = True
+        if bc <= 95 or 112 <= bc <= 119 or bc == 136 or bc == 137:
+            effect = 1
+        elif bc <= 111 or bc == 135:
+            effect = -1
+        elif bc <= 125:
+            falls_through = False
+        elif bc <= 127:
+            return None
+        elif bc <= 134:
+            length = 2
+            if pc + 1 >= len(bytes):
+                return None
+            b = ord(bytes[pc + 1])
+            if bc == 128:
+                effect = 1
+            elif bc == 130:
+                effect = -1
+            elif bc == 131 or bc == 133:
+                effect = -(b >> 5)
+            elif bc == 134:
+                effect = -(b >> 6)
+            elif bc == 132:
+                length = 3
+                if pc + 2 >= len(bytes):
+                    return None
+                op = b >> 5
+                if op <= 1:
+                    effect = -(b & 31)
+                elif op <= 4:
+                    effect = 1
+                elif op == 6:
+                    effect = -1
+        elif bc == 138:
+            length = 2
+            if pc + 1 >= len(bytes):
+                return None
+            b = ord(bytes[pc + 1])
+            if b > 127:
+                effect = 1 - (b & 127)
+            else:
+                effect = 1
+        elif bc <= 142:
+            length = 3
+            if bc == 140:
+                effect = 1
+            elif bc == 142:
+                effect = -1
+        elif bc == 143:
+            length = 4
+            if pc + 3 >= len(bytes):
+                return None
+            numCopied = (ord(bytes[pc + 1]) >> 4) & 0xF
+            blocksize = (ord(bytes[pc + 2]) << 8) | ord(bytes[pc + 3])
+            if not _merge_stack_depth(depths, worklist, pc + 4, 0):
+                return None
+            effect = 1 - numCopied
+            jump = pc + 4 + blocksize
+            falls_through = False
+        elif bc <= 151:
+            jump = pc + 2 + (bc & 7)
+            falls_through = False
+        elif bc <= 159:
+            effect = -1
+            jump = pc + 2 + (bc & 7)
+        elif bc <= 175:
+            length = 2
+            if pc + 1 >= len(bytes):
+                return None
+            b = ord(bytes[pc + 1])
+            if bc <= 167:
+                jump = pc + 2 + (((bc & 7) - 4) << 8) + b
+                falls_through = False
+            else:
+                effect = -1
+                jump = pc + 2 + ((bc & 3) << 8) + b
+        elif bc <= 207:
+            effect = SPECIAL_SEND_EFFECTS[bc - 176]
+        elif bc <= 223:
+            effect = 0
+        elif bc <= 239:
+            effect = -1
+        else:
+            effect = -2
+        depth += effect
+        if jump != -1:
+            if not _merge_stack_depth(depths, worklist, jump, depth):
+                return None
+        if falls_through:
+            if not _merge_stack_depth(depths, worklist, pc + length, depth):
+                return None
+    return depths
@@ -17,14 +17,19 @@ Squeak model.
 """
 import sys, math
 from rsqueakvm import constants, error
-from rsqueakvm.util.version import constant_for_version, constant_for_version_arg, VersionMixin, Version
+from rsqueakvm.util.version import constant_for_version, constant_for_version_arg, constant_for_version_arg2, VersionMixin, Version
 
 from rpython.rlib import rrandom, objectmodel, jit, signature, longlong2float
 from rpython.rlib.rarithmetic import intmask, r_uint, r_uint32, ovfcheck, r_int64
 from rpython.rlib.objectmodel import compute_hash, import_from_mixin, we_are_translated
+from rpython.rlib.buffer import Buffer
+from rpython.rlib.debug import make_sure_not_resized
 from rpython.rtyper.lltypesystem import lltype, rffi
 from rpython.rlib.rstrategies import rstrategies as rstrat
 
+# Whether words in native memory are laid out like unwrap_string answers them
+WORDS_ARE_LITTLE_ENDIAN = sys.byteorder == 'little'
+
 
 class W_Object(object):
     """Root of Squeak model, abstract."""
@@ -202,6 +207,19 @@ class W_Object(object):
     def unwrap_string(self, space):
         raise error.UnwrappingError
 
+    def unwrap_string_slice(self, space, start, stop):
+        """unwrap_string(space)[start:stop], without copying the rest of the
+        receiver where its storage allows that."""
+        assert 0 <= start <= stop
+        return self.unwrap_string(space)[start:stop]
+
+    def raw_address(self):
+        """The address of the receiver's bytes, in the order in which
+        unwrap_string answers them, if they live outside the GC heap. Answer
+        a null pointer otherwise. Callers must keep the receiver alive while
+        they use the address."""
+        return lltype.nullptr(rffi.CCHARP.TO)
+
     # Methods for printing this object
 
     def guess_classname(self):
@@ -816,6 +834,9 @@ class W_PointersObject(W_AbstractObjectWithIdentityHash):
         return False
 
     def change_class(self, space, w_class):
+        w_self = self.forwarded()
+        if w_self is not self:
+            return w_self.change_class(space, w_class)
         old_strategy = self._get_strategy()
         new_strategy = old_strategy.instantiate(self, w_class)
         self._set_strategy(new_strategy)
@@ -892,16 +913,26 @@ class W_PointersObject(W_AbstractObjectWithIdentityHash):
     def store_all(self, space, collection):
         # Be tolerant: copy over as many elements as possible, set rest to nil.
         # The size of the object cannot be changed in any case.
-        # TODO use store_all() provided by strategy?
+        # The store_all() of rstrategies cannot be used here, it keeps storing
+        # through the old strategy after a switch.
         my_length = self.size()
         incoming_length = min(my_length, len(collection))
         i = 0
         while i < incoming_length:
             self.store(space, i, collection[i])
             i = i+1
-        while i < my_length:
-            self.store(space, i, space.w_nil)
-            i = i+1
+        if i < my_length:
+            self._get_strategy().fill_range(self, i, my_length, space.w_nil)
+
+    def replace_from(self, space, start, stop, w_source, source_start):
+        # Copy the variable part of w_source starting at source_start into our
+        # variable part from start to stop (0-based, inclusive). Elements are
+        # copied front to back, just like the Smalltalk fallback code.
+        assert isinstance(w_source, W_PointersObject)
+        my_offset = self.instsize()
+        self._get_strategy().copy_range_from(
+            self, my_offset + start, my_offset + stop + 1,
+            w_source, w_source.instsize() + source_start)
 
     def at0(self, space, index0):
         # To test, at0 = in varsize part
@@ -933,8 +964,40 @@ class W_PointersObject(W_AbstractObjectWithIdentityHash):
     def _get_strategy(self):
         return self.strategy.promote_if_neccessary() if self.strategy is not None else None
 
+    def is_forwarded(self):
+        from rsqueakvm.storage import ForwardingStrategy
+        return isinstance(self.strategy, ForwardingStrategy)
+
+    def forwarded(self):
+        """Answer the object that we were lazily becomeForward:ed to, or
+        ourselves."""
+        # this is on the path of every send and identity comparison, only a
+        # class check on the quasi-immutable strategy stays in the traces
+        if not self.is_forwarded():
+            return self
+        return self._follow_forwarders()
+
+    @jit.dont_look_inside
+    def _follow_forwarders(self):
+        w_obj = self
+        while w_obj.is_forwarded():
+            w_target = w_obj.strategy.forwarded_object()
+            assert isinstance(w_target, W_PointersObject)
+            w_obj = w_target
+        return w_obj
+
+    def is_same_object(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, W_PointersObject):
+            return False
+        return self.forwarded() is other.forwarded()
+
     @objectmodel.specialize.arg(2)
     def as_special_get_shadow(self, space, TheClass):
+        w_self = self.forwarded()
+        if w_self is not self:
+            return w_self.as_special_get_shadow(space, TheClass)
         shadow = self._get_strategy()
         if not isinstance(shadow, TheClass):
             shadow = space.strategy_factory.switch_strategy(self, TheClass)
@@ -968,6 +1031,11 @@ class W_PointersObject(W_AbstractObjectWithIdentityHash):
         # The space is accessed through the strategy.
         return self.has_strategy()
 
+    def become(self, w_other):
+        if isinstance(w_other, W_PointersObject):
+            w_other = w_other.forwarded()
+        return W_AbstractObjectWithIdentityHash.become(self.forwarded(), w_other)
+
     def _become(self, w_other):
         assert isinstance(w_other, W_PointersObject)
         # Only one strategy will handle the become (or none of them).
@@ -982,24 +1050,37 @@ class W_PointersObject(W_AbstractObjectWithIdentityHash):
         W_AbstractObjectWithIdentityHash._become(self, w_other)
 
     def pointers_become_one_way(self, space, from_w, to_w):
-        ptrs = self.fetch_all(space)
-        ptridx = 0
-        for i, w_from in enumerate(from_w):
-            try:
-                ptridx = ptrs.index(w_from)
-            except ValueError:
-                continue
-            w_to = to_w[i]
-            ptrs[ptridx] = w_to
-            w_from.post_become_one_way(w_to)
-        self.store_all(space, ptrs)
+        if self.is_forwarded():
+            # the slots belong to the target, which is visited on its own
+            return
+        # Only store the slots that change, every object in the heap comes
+        # through here.
+        for n0 in range(self.size()):
+            w_ptr = self.fetch(space, n0)
+            for i in range(len(from_w)):
+                if w_ptr is from_w[i]:
+                    w_to = to_w[i]
+                    self.store(space, n0, w_to)
+                    w_ptr.post_become_one_way(w_to)
+                    break
 
     def clone(self, space):
-        my_pointers = self.fetch_all(space)
-        w_result = W_PointersObject(space, self.getclass(space), len(my_pointers))
-        w_result.store_all(space, my_pointers)
+        size = self.size()
+        w_result = W_PointersObject(space, self.getclass(space), size)
+        w_result._get_strategy().copy_range_from(w_result, 0, size, self, 0)
         return w_result
 
+def new_bytes(size):
+    # Bytes are never resized, so they are laid out as a single flat array of
+    # chars instead of a resizable list with a separate item array.
+    return make_sure_not_resized(['\x00'] * size)
+
+def copy_bytes(chars):
+    bytes = new_bytes(len(chars))
+    for i in range(len(chars)):
+        bytes[i] = chars[i]
+    return bytes
+
 class W_BytesObject(W_AbstractObjectWithClassReference):
     _attrs_ = ['version', 'bytes', 'native_bytes']
     repr_classname = 'W_BytesObject'
@@ -1010,7 +1091,7 @@ class W_BytesObject(W_AbstractObjectWithClassReference):
         W_AbstractObjectWithClassReference.__init__(self, space, w_class)
         assert isinstance(size, int)
         self.mutate()
-        self.bytes = ['\x00'] * size
+        self.bytes = new_bytes(size)
         self.native_bytes = None
 
     def mutate(self):
@@ -1019,7 +1100,7 @@ class W_BytesObject(W_AbstractObjectWithClassReference):
     def fillin(self, space, g_self):
         W_AbstractObjectWithClassReference.fillin(self, space, g_self)
         self.mutate()
-        self.bytes = g_self.get_bytes()
+        self.bytes = copy_bytes(g_self.get_bytes())
         self.native_bytes = None
 
     def at0(self, space, index0):
@@ -1043,6 +1124,29 @@ class W_BytesObject(W_AbstractObjectWithClassReference):
             self.bytes[n0] = character
         self.mutate()
 
+    @jit.look_inside_iff(lambda self, space, start, stop, w_source, source_start:
+                         jit.isconstant(stop - start) and stop - start < 16)
+    def replace_from(self, space, start, stop, w_source, source_start):
+        # See W_PointersObject.replace_from. Only bumps the version once.
+        assert isinstance(w_source, W_BytesObject)
+        offset = source_start - start
+        i = start
+        if self.native_bytes is None and w_source.native_bytes is None:
+            bytes = self.bytes
+            source_bytes = w_source.bytes
+            while i <= stop:
+                bytes[i] = source_bytes[offset + i]
+                i += 1
+        else:
+            while i <= stop:
+                character = w_source.getchar(offset + i)
+                if self.native_bytes is not None:
+                    self.native_bytes.setchar(i, character)
+                else:
+                    self.bytes[i] = character
+                i += 1
+        self.mutate()
+
     def short_at0(self, space, index0):
         byte_index0 = index0 * 2
         byte0 = ord(self.getchar(byte_index0))
@@ -1109,7 +1213,7 @@ class W_BytesObject(W_AbstractObjectWithClassReference):
         if self.native_bytes is not None:
             w_result.bytes = self.native_bytes.copy_bytes()
         else:
-            w_result.bytes = list(self.bytes)
+            w_result.bytes = copy_bytes(self.bytes)
         return w_result
 
     @jit.unroll_safe
@@ -1176,6 +1280,70 @@ class W_BytesObject(W_AbstractObjectWithClassReference):
             self.mutate()
         return self.native_bytes.c_bytes
 
+    def unwrap_string_slice(self, space, start, stop):
+        assert 0 <= start <= stop
+        if self.native_bytes is not None:
+            return rffi.charpsize2str(rffi.ptradd(self.native_bytes.c_bytes, start),
+                                      stop - start)
+        else:
+            return "".join(self.bytes[start:stop])
+
+    def raw_address(self):
+        if self.native_bytes is not None:
+            return self.native_bytes.c_bytes
+        return lltype.nullptr(rffi.CCHARP.TO)
+
+    def as_buffer(self, start, length):
+        """A buffer for I/O into the bytes start...start+length-1. The caller
+        has to call mutate() once when it is done writing."""
+        assert 0 <= start and start + length <= self.size()
+        return BytesObjectBuffer(self, start, length)
+
+
+class BytesObjectBuffer(Buffer):
+    """Lets rsocket and friends write into a range of a W_BytesObject, in
+    place for native bytes, which have a raw address. For bytes in a list,
+    the data is copied over without boxing single characters and without
+    changing the version for each of them."""
+    _attrs_ = ["w_bytes", "start", "length"]
+    _immutable_ = True
+
+    def __init__(self, w_bytes, start, length):
+        self.w_bytes = w_bytes
+        self.start = start
+        self.length = length
+        self.readonly = False
+
+    def getlength(self):
+        return self.length
+
+    def getitem(self, index):
+        return self.w_bytes.getchar(self.start + index)
+
+    def setitem(self, index, char):
+        native_bytes = self.w_bytes.native_bytes
+        if native_bytes is not None:
+            native_bytes.setchar(self.start + index, char)
+        else:
+            self.w_bytes.bytes[self.start + index] = char
+
+    def setslice(self, start, string):
+        native_bytes = self.w_bytes.native_bytes
+        offset = self.start + start
+        if native_bytes is not None:
+            for i in range(len(string)):
+                native_bytes.setchar(offset + i, string[i])
+        else:
+            bytes = self.w_bytes.bytes
+            for i in range(len(string)):
+                bytes[offset + i] = string[i]
+
+    def get_raw_address(self):
+        native_bytes = self.w_bytes.native_bytes
+        if native_bytes is None:
+            raise ValueError("bytes in a list have no raw address")
+        return rffi.ptradd(native_bytes.c_bytes, self.start)
+
 
 # This indirection avoids a call for alloc_with_del in Jitted code
 class NativeBytesWrapper(object):
@@ -1197,7 +1365,10 @@ class NativeBytesWrapper(object):
         return "".join([self.c_bytes[i] for i in range(self.size)])
 
     def copy_bytes(self):
-        return [self.c_bytes[i] for i in range(self.size)]
+        bytes = new_bytes(self.size)
+        for i in range(self.size):
+            bytes[i] = self.c_bytes[i]
+        return bytes
 
     def __del__(self):
         rffi.free_charp(self.c_bytes)
@@ -1248,6 +1419,24 @@ class W_WordsObject(W_AbstractObjectWithClassReference):
         assert len(character) == 1
         self.setword(n0, ord(character))
 
+    @jit.look_inside_iff(lambda self, space, start, stop, w_source, source_start:
+                         jit.isconstant(stop - start) and stop - start < 16)
+    def replace_from(self, space, start, stop, w_source, source_start):
+        # See W_PointersObject.replace_from.
+        assert isinstance(w_source, W_WordsObject)
+        offset = source_start - start
+        i = start
+        if self.native_words is None and w_source.native_words is None:
+            words = self.words
+            source_words = w_source.words
+            while i <= stop:
+                words[i] = source_words[offset + i]
+                i += 1
+        else:
+            while i <= stop:
+                self.setword(i, w_source.getword(offset + i))
+                i += 1
+
     def short_at0(self, space, index0):
         word = intmask(self.getword(index0 / 2))
         if index0 % 2 == 0:
@@ -1296,6 +1485,23 @@ class W_WordsObject(W_AbstractObjectWithClassReference):
                     chr((word & r_uint(0xff000000)) >> 24)]
         return "".join(res)
 
+    def unwrap_string_slice(self, space, start, stop):
+        assert 0 <= start <= stop
+        if self.native_words is not None and WORDS_ARE_LITTLE_ENDIAN:
+            return rffi.charpsize2str(rffi.ptradd(self.raw_address(), start),
+                                      stop - start)
+        res = []
+        for i in range(start, stop):
+            word = self.getword(i // 4)
+            res.append(chr((word >> ((i % 4) * 8)) & r_uint(0xff)))
+        return "".join(res)
+
+    def raw_address(self):
+        # unwrap_string answers the bytes of each word least significant first
+        if self.native_words is not None and WORDS_ARE_LITTLE_ENDIAN:
+            return rffi.cast(rffi.CCHARP, self.native_words.c_words)
+        return lltype.nullptr(rffi.CCHARP.TO)
+
     def invariant(self):
         return (W_AbstractObjectWithClassReference.invariant(self) and
                 isinstance(self.words, list))
@@ -1400,10 +1606,18 @@ class W_CompiledMethod(W_AbstractObjectWithIdentityHash):
                 # Main method content
                 "bytes", "literals",
                 # Additional info about the method
-                "lookup_selector", "compiledin_class", "lookup_class" ]
+                "lookup_selector", "compiledin_class", "lookup_class",
+                # Inline caches of the send sites, valid for one version
+                "_send_caches", "_send_caches_version",
+                # Stack depth of each bytecode, valid for one version
+                "_stack_depths", "_stack_depths_version" ]
     _immutable_fields_ = ["version?"]
     lookup_selector = "<unknown>"
     lookup_class = None
+    _send_caches = None
+    _send_caches_version = None
+    _stack_depths = None
+    _stack_depths_version = None
     import_from_mixin(VersionMixin)
 
     def pointers_become_one_way(self, space, from_w, to_w):
@@ -1532,6 +1746,49 @@ class W_CompiledMethod(W_AbstractObjectWithIdentityHash):
         assert pc >= 0 and pc < len(self.bytes)
         return self.bytes[pc]
 
+    @constant_for_version_arg2
+    def send_cache_at(self, pc, w_selector):
+        # The caches depend on our literals and bytecodes, so they are dropped
+        # whenever this method changes.
+        from rsqueakvm.storage_classes import InlineCache
+        if self._send_caches_version is not self.version:
+            self._send_caches = {}
+            self._send_caches_version = self.version
+        cache = self._send_caches.get(pc, None)
+        if cache is None:
+            cache = InlineCache(w_selector)
+            self._send_caches[pc] = cache
+        return cache
+
+    def stack_depths(self):
+        # Like the send caches, the analysis is redone when the bytecodes
+        # change. An empty list means the bytecodes could not be analysed.
+        from rsqueakvm.interpreter_bytecodes import compute_stack_depths
+        if self._stack_depths_version is not self.version:
+            depths = compute_stack_depths(self.bytes)
+            if depths is None:
+                depths = []
+            self._stack_depths = depths
+            self._stack_depths_version = self.version
+        return self._stack_depths
+
+    @constant_for_version_arg
+    def stack_depth_at(self, pc):
+        """Answer the number of stack slots in use above the temps when
+        execution reaches pc, or -1 if that is not known."""
+        depths = self.stack_depths()
+        if 0 <= pc < len(depths):
+            return depths[pc]
+        return -1
+
+    @constant_for_version
+    def max_stack_depth(self):
+        depth = -1
+        for d in self.stack_depths():
+            if d > depth:
+                depth = d
+        return depth
+
     def compiled_in(self):
         # This method cannot be constant/elidable. Looking up the compiledin-class from
         # the literals must be done lazily because we cannot analyze the literals
@@ -69,6 +69,11 @@ class W_DisplayBitmap(model.W_AbstractObjectWithIdentityHash):
                     chr((self.getword(i) & r_uint(0xff000000)) >> 24)]
         return "".join(res)
 
+    def raw_address(self):
+        if model.WORDS_ARE_LITTLE_ENDIAN:
+            return rffi.cast(rffi.CCHARP, self._real_depth_buffer)
+        return lltype.nullptr(rffi.CCHARP.TO)
+
     def getword(self, n):
         assert self.size() > n >= 0
         return r_uint(self._real_depth_buffer[n])
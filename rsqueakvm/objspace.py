@@ -76,6 +76,11 @@ class ObjSpace(object):
         self.is_spur = ConstantFlag()
         self.uses_block_contexts = ConstantFlag()
         self.simulate_numeric_primitives = ConstantFlag()
+        self.background_snapshot = ConstantFlag()
+        # set during a batch of method changes, see begin_method_changes
+        self.defer_method_changes = ConstantFlag()
+        self.method_change_batches = 0
+        self.deferred_classes_s = {}
 
         self.classtable = {}
         self.objtable = {}
@@ -130,6 +135,28 @@ class ObjSpace(object):
         self.system_attributes[idx] = value
         self._system_attribute_version.set(Version())
 
+    def begin_method_changes(self):
+        """Start a batch of method dictionary changes, e.g. a file-in. Until
+        the batch ends, sends look up their methods without the caches, and
+        the lookups of each changed class are invalidated only once at the
+        end instead of for every installed method. Batches nest."""
+        self.method_change_batches += 1
+        self.defer_method_changes.activate()
+
+    def end_method_changes(self):
+        if self.method_change_batches == 0:
+            return
+        self.method_change_batches -= 1
+        if self.method_change_batches == 0:
+            classes_s = self.deferred_classes_s
+            self.deferred_classes_s = {}
+            self.defer_method_changes.deactivate()
+            for s_class in classes_s:
+                s_class.changed()
+
+    def defer_class_change(self, s_class):
+        self.deferred_classes_s[s_class] = None
+
     def populate_special_objects(self, specials):
         for name, idx in constants.objects_in_special_object_table.items():
             name = "w_" + name
@@ -365,6 +392,9 @@ class ObjSpace(object):
     def executable_path(self):
         return self._executable_path.get()
 
+    def has_display(self):
+        return self._display.get() is not None
+
     def display(self):
         disp = self._display.get()
         if disp is None:
@@ -1,6 +1,8 @@
 import os, stat, sys
 
-from rpython.rlib import jit, rarithmetic
+from rpython.rlib import jit, rarithmetic, rposix
+from rpython.rlib.objectmodel import keepalive_until_here
+from rpython.rtyper.lltypesystem import lltype, rffi
 
 from rsqueakvm import model, model_display, constants
 from rsqueakvm.plugins.plugin import Plugin
@@ -18,7 +20,6 @@ except ValueError:
     std_fds = [0, 1, 2]
 
 if IS_WINDOWS:
-    from rpython.rtyper.lltypesystem import rffi
     from rpython.rtyper.tool import rffi_platform as platform
     from rpython.translator.tool.cbuild import ExternalCompilationInfo
 
@@ -41,6 +42,73 @@ else:
 #should we implement primitiveDirectoryEntry ?
 #should we implement primitiveHasFileAccess ?
 
+
+class DirectoryEntry(object):
+    _immutable_fields_ = ["name", "ctime", "mtime", "is_dir", "size"]
+
+    def __init__(self, name, file_info):
+        self.name = name
+        self.ctime = file_info.st_ctime
+        self.mtime = file_info.st_mtime
+        self.is_dir = stat.S_ISDIR(file_info.st_mode)
+        self.size = rarithmetic.intmask(file_info.st_size)
+
+    def wrap(self, space):
+        return space.wrap_list([space.wrap_string(self.name),
+                                smalltalk_timestamp(space, self.ctime),
+                                smalltalk_timestamp(space, self.mtime),
+                                space.wrap_bool(self.is_dir),
+                                space.wrap_int(self.size)])
+
+
+class DirectoryCache(object):
+    """The directory that the image enumerates, listed once and with each
+    entry stat'ed once, instead of once for every index. The image starts
+    an enumeration at the first index, that is when the listing is read
+    again, or when the modification time of the directory changed."""
+    _attrs_ = ["path", "mtime", "names", "entries"]
+
+    def __init__(self):
+        self.path = None
+        self.mtime = 0.0
+        self.names = []
+        self.entries = []
+
+    def list(self, path, restart):
+        """Answer the number of entries in the directory at path."""
+        try:
+            dir_info = os.stat(path)
+        except OSError:
+            raise PrimitiveFailedError
+        if not stat.S_ISDIR(dir_info.st_mode):
+            raise PrimitiveFailedError
+        if restart or path != self.path or dir_info.st_mtime != self.mtime:
+            try:
+                names = os.listdir(path)
+            except OSError:
+                raise PrimitiveFailedError
+            self.path = path
+            self.mtime = dir_info.st_mtime
+            self.names = names
+            self.entries = [None] * len(names)
+        return len(self.names)
+
+    def entry(self, index):
+        """Answer the entry at index, or None if the file vanished since the
+        directory was listed."""
+        entry = self.entries[index]
+        if entry is None:
+            name = self.names[index]
+            try:
+                file_info = os.stat(os.path.join(self.path, name))
+            except OSError:
+                return None
+            entry = DirectoryEntry(name, file_info)
+            self.entries[index] = entry
+        return entry
+
+directory_cache = DirectoryCache()
+
 @FilePlugin.expose_primitive(unwrap_spec=[object])
 def primitiveFileStdioHandles(interp, s_frame, w_rcvr):
     return interp.space.wrap_list(
@@ -83,35 +151,33 @@ def primitiveDirectoryDelete(interp, s_frame, w_rcvr, dir_path):
 @FilePlugin.expose_primitive(unwrap_spec=[object, str, index1_0])
 def primitiveDirectoryLookup(interp, s_frame, w_file_directory, full_path, index):
     if full_path == '':
-        contents = os.listdir(os.path.sep)
-    else:
-        if not os.path.isdir(full_path):
-            raise PrimitiveFailedError
-        contents = os.listdir(full_path)
-    space = interp.space
-    if index >= len(contents):
-        return space.w_nil
-
-    # should probably be sorted...
-    contents
-    py_name = contents[index]
-    try:
-        file_path = os.path.join(full_path, py_name)
-    except OSError:
+        full_path = os.path.sep
+    if index < 0:
         raise PrimitiveFailedError
-    try:
-        file_info = os.stat(file_path)
-    except OSError:
+    # should probably be sorted...
+    size = directory_cache.list(full_path, index == 0)
+    if index >= size:
+        return interp.space.w_nil
+    entry = directory_cache.entry(index)
+    if entry is None:
         raise PrimitiveFailedError
+    return entry.wrap(interp.space)
 
-    w_name = space.wrap_string(py_name)
-    w_creationTime = smalltalk_timestamp(space, file_info.st_ctime)
-    w_modificationTime = smalltalk_timestamp(space, file_info.st_mtime)
-    w_dirFlag = space.w_true if stat.S_IFDIR & file_info.st_mode else space.w_false
-    w_fileSize = space.wrap_int(rarithmetic.intmask(file_info.st_size))
-
-    return space.wrap_list([w_name, w_creationTime, w_modificationTime,
-                            w_dirFlag, w_fileSize])
+@FilePlugin.expose_primitive(unwrap_spec=[object, str])
+def primitiveDirectoryEntries(interp, s_frame, w_file_directory, full_path):
+    """All entries of the directory in one Array, in the same format and
+    order as primitiveDirectoryLookup answers them one by one. Files that
+    vanish while the directory is read are left out."""
+    if full_path == '':
+        full_path = os.path.sep
+    size = directory_cache.list(full_path, True)
+    space = interp.space
+    entries_w = []
+    for i in range(size):
+        entry = directory_cache.entry(i)
+        if entry is not None:
+            entries_w.append(entry.wrap(space))
+    return space.wrap_list(entries_w)
 
 @FilePlugin.expose_primitive(unwrap_spec=[object, str, object])
 def primitiveFileOpen(interp, s_frame, w_rcvr, file_path, w_writeable_flag):
@@ -153,17 +219,29 @@ def primitiveFileAtEnd(interp, s_frame, w_rcvr, fd):
 def primitiveFileRead(interp, s_frame, w_rcvr, fd, target, start, count):
     if not isinstance(target, model.W_BytesObject):
         raise PrimitiveFailedError
-    try:
-        contents = os.read(fd, count)
-    except OSError:
+    if start < 0 or count < 0 or target.size() < start + count:
         raise PrimitiveFailedError
-    space = interp.space
-    len_read = len(contents)
-    if target.size() < start + len_read:
+    # read straight into the target, changing its version only once
+    len_read = read_into(fd, target.as_buffer(start, count), count)
+    target.mutate()
+    return interp.space.wrap_int(len_read)
+
+def read_into(fd, rwbuffer, count):
+    try:
+        raw = rwbuffer.get_raw_address()
+    except ValueError:
+        try:
+            contents = os.read(fd, count)
+        except OSError:
+            raise PrimitiveFailedError
+        rwbuffer.setslice(0, contents)
+        return len(contents)
+    len_read = rffi.cast(lltype.Signed,
+                         rposix.c_read(fd, rffi.cast(rffi.VOIDP, raw), count))
+    keepalive_until_here(rwbuffer)
+    if len_read < 0:
         raise PrimitiveFailedError
-    for i in range(len_read):
-        target.setchar(start + i, contents[i])
-    return space.wrap_int(len_read)
+    return len_read
 
 @FilePlugin.expose_primitive(unwrap_spec=[object, int])
 def primitiveFileGetPosition(interp, s_frame, w_rcvr, fd):
@@ -213,19 +291,30 @@ def primitiveFileWrite(interp, s_frame, w_rcvr, fd, content, start, count):
     else:
         raise PrimitiveFailedError
 
-    string_content = interp.space.unwrap_string(content)
     byte_start = start * element_size
     byte_end = min(start + count, size) * element_size
 
     space = interp.space
     if not (byte_start >= 0 and byte_end > byte_start):
         return space.wrap_int(0)
-    try:
-        written = os.write(fd, string_content[byte_start:byte_end])
-    except OSError:
+    written = write_from(fd, space, content, byte_start, byte_end)
+    return space.wrap_positive_wordsize_int(rarithmetic.intmask(written / element_size))
+
+def write_from(fd, space, content, byte_start, byte_end):
+    raw = content.raw_address()
+    if not raw:
+        try:
+            return os.write(fd, content.unwrap_string_slice(space, byte_start, byte_end))
+        except OSError:
+            raise PrimitiveFailedError
+    # write straight from the storage of the content
+    written = rffi.cast(lltype.Signed, rposix.c_write(
+        fd, rffi.cast(rffi.VOIDP, rffi.ptradd(raw, byte_start)),
+        byte_end - byte_start))
+    keepalive_until_here(content)
+    if written < 0:
         raise PrimitiveFailedError
-    else:
-        return space.wrap_positive_wordsize_int(rarithmetic.intmask(written / element_size))
+    return written
 
 @FilePlugin.expose_primitive(unwrap_spec=[object, int, int])
 def primitiveFileTruncate(interp, s_frame, w_rcvr, fd, position):
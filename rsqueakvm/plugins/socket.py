@@ -1,8 +1,10 @@
 from rpython.rlib import rsocket, _rsocket_rffi, jit, objectmodel
-from rsqueakvm import model, error
+from rpython.rtyper.lltypesystem import lltype, rffi
+from rsqueakvm import model, model_display, error
 from rsqueakvm.plugins.plugin import Plugin
 import errno
 
+from rsqueakvm.util.reactor import READ, WRITE
 from rsqueakvm.util.system import IS_WINDOWS
 
 if IS_WINDOWS:
@@ -12,11 +14,31 @@ if IS_WINDOWS:
             return self.socket.recv(count)
         finally:
             self.socket._setblocking(True)
+
+    def non_blocking_recvinto(self, rwbuffer, count):
+        self.socket._setblocking(False)
+        try:
+            return self.socket.recvinto(rwbuffer, count)
+        finally:
+            self.socket._setblocking(True)
+
+    def non_blocking_recvfrom_into(self, rwbuffer, count):
+        self.socket._setblocking(False)
+        try:
+            return self.socket.recvfrom_into(rwbuffer, count)
+        finally:
+            self.socket._setblocking(True)
 else:
     # on unix, we just use the flag, avoiding the extra fcntl calls
     def non_blocking_recv(self, count):
         return self.socket.recv(count, _rsocket_rffi.MSG_DONTWAIT)
 
+    def non_blocking_recvinto(self, rwbuffer, count):
+        return self.socket.recvinto(rwbuffer, count, _rsocket_rffi.MSG_DONTWAIT)
+
+    def non_blocking_recvfrom_into(self, rwbuffer, count):
+        return self.socket.recvfrom_into(rwbuffer, count, _rsocket_rffi.MSG_DONTWAIT)
+
 
 class Cell(object):
     _attrs_ = ["value"]
@@ -53,24 +75,52 @@ Connected = 2
 OtherEndClosed = 3
 ThisEndClosed = 4
 
+TCPSocketType = 0
+UDPSocketType = 1
+
 class W_SocketHandle(model.W_AbstractObjectWithIdentityHash):
-    _attrs_ = ["socket", "state", "family", "socketType"]
+    _attrs_ = ["socket", "state", "family", "socketType",
+               "sema", "readSema", "writeSema", "backlog", "accepted"]
     repr_classname = "W_SocketHandle"
 
-    def __init__(self, family, socketType):
+    def __init__(self, family, socketType, sema=0, readSema=0, writeSema=0,
+                 socket=None):
         self.socket = None
         self.state = Unconnected
         self.family = family
         self.socketType = socketType
-        self.make_socket()
+        # indices of external semaphores, signalled by the interpreter's
+        # reactor when the socket becomes readable while the VM is idle
+        self.sema = sema
+        self.readSema = readSema
+        self.writeSema = writeSema
+        # for listening TCP sockets, the backlog passed to listen and the
+        # connection that made the socket Connected, if it is not yet
+        # accepted
+        self.backlog = 0
+        self.accepted = None
+        if socket is None:
+            self.make_socket()
+        else:
+            # an accepted connection
+            self.socket = socket
+            self.socket.setblocking(False)
+            self.state = Connected
 
     def make_socket(self):
+        if self.socketType == UDPSocketType:
+            socktype = rsocket.SOCK_DGRAM
+        else:
+            socktype = rsocket.SOCK_STREAM
         try:
-            self.socket = rsocket.RSocket(family=self.family, proto=self.socketType)
+            self.socket = rsocket.RSocket(family=self.family, type=socktype)
         except rsocket.CSocketError:
             raise error.PrimitiveFailedError
         self.socket.setblocking(False)
 
+    def is_udp(self):
+        return self.socketType == UDPSocketType
+
     def isipv4(self):
         return self.family == rsocket.AF_INET
 
@@ -83,39 +133,177 @@ class W_SocketHandle(model.W_AbstractObjectWithIdentityHash):
     def guess_classname(self):
         return "SocketHandle"
 
-    def connect(self, w_bytes, port):
-        try:
-            inet = rsocket.INETAddress(w_bytes.unwrap_string(None), port)
-        except rsocket.GAIError:
-            inet = rsocket.INET6Address(w_bytes.unwrap_string(None), port)
-            self.family = rsocket.AF_INET6
+    def register(self, reactor):
+        if self.backlog > 0 and self.state == WaitingForConnection:
+            # a listening socket becomes readable with a new connection,
+            # which the image waits for on the socket's semaphore
+            reactor.register(self.socket.fd, self.sema, self.sema,
+                             self.writeSema)
+        else:
+            reactor.register(self.socket.fd, self.sema, self.readSema,
+                             self.writeSema)
+        reactor.enable(self.socket.fd, READ)
+
+    def wait_for_data(self, reactor):
+        # wake the image up when more data arrives
+        if self.state == Connected:
+            reactor.enable(self.socket.fd, READ)
+
+    def unregister(self, reactor):
+        if self.socket is not None:
+            reactor.unregister(self.socket.fd)
+
+    def connect(self, space, w_bytes, port):
+        self.connect_to(address_from_bytes(space, w_bytes, port))
+
+    def connect_to(self, address):
+        if address.family != self.family:
+            self.family = address.family
             self.make_socket()
-        except rsocket.GAIError:
-            raise error.PrimitiveFailedError
         self.socket.setblocking(True)
         try:
-            self.socket.connect(inet)
+            self.socket.connect(address)
         except rsocket.SocketError:
             raise error.PrimitiveFailedError
         finally:
             self.socket.setblocking(False)
         self.state = Connected
 
-    def can_read(self):
-        if self.state == Connected:
-            try:
-                r = self.socket.recv(1, rsocket.MSG_PEEK)
-            except rsocket.CSocketError, e:
-                if e.errno == errno.EAGAIN or e.errno == errno.EWOULDBLOCK:
-                    return False
-                raise
-            if len(r) == 0:
-                self.state = OtherEndClosed
-                return False
+    def listen(self, space, port, backlog, w_interface):
+        """Bind to the port on the given interface, or on all interfaces if
+        that is None. TCP sockets listen with the backlog. With a backlog of
+        1, the socket itself becomes the first connection, otherwise
+        connections are taken with accept. UDP sockets are ready to send and
+        receive once they are bound."""
+        if self.state != Unconnected:
+            raise error.PrimitiveFailedError
+        if w_interface is None:
+            if self.family == rsocket.AF_INET6:
+                address = rsocket.INET6Address("::", port)
             else:
-                return True
+                address = rsocket.INETAddress("0.0.0.0", port)
+        else:
+            address = address_from_bytes(space, w_interface, port)
+            if address.family != self.family:
+                self.family = address.family
+                self.make_socket()
+        try:
+            self.socket.setsockopt_int(rsocket.SOL_SOCKET, rsocket.SO_REUSEADDR, 1)
+        except rsocket.SocketError:
+            raise error.PrimitiveFailedError
+        self.bind(address)
+        if not self.is_udp():
+            self.listen_with_backlog(backlog)
+
+    def bind(self, address):
+        """Bind to the address. UDP sockets are ready to send and receive
+        afterwards, TCP sockets still have to listen."""
+        if self.state != Unconnected:
+            raise error.PrimitiveFailedError
+        if address.family != self.family:
+            self.family = address.family
+            self.make_socket()
+        try:
+            self.socket.bind(address)
+        except rsocket.SocketError:
+            raise error.PrimitiveFailedError
+        if self.is_udp():
+            self.state = Connected
+
+    def listen_with_backlog(self, backlog):
+        """Listen on the address the socket is bound to, or on a free port if
+        it is not bound, see listen for the backlog."""
+        if self.state != Unconnected or self.is_udp():
+            raise error.PrimitiveFailedError
+        try:
+            self.socket.listen(max(backlog, 1))
+        except rsocket.SocketError:
+            raise error.PrimitiveFailedError
+        self.backlog = max(backlog, 1)
+        self.state = WaitingForConnection
+
+    def poll_connection(self, reactor):
+        """A listening socket becomes Connected when a connection comes in."""
+        if self.backlog == 0 or self.state != WaitingForConnection:
+            return
+        try:
+            fd, _ = self.socket.accept()
+        except rsocket.SocketError:
+            # nothing yet, wait for the next connection
+            reactor.enable(self.socket.fd, READ)
+            return
+        connection = rsocket.RSocket(self.family, rsocket.SOCK_STREAM, 0, fd)
+        if self.backlog == 1:
+            # the socket becomes the connection, like listenOn: does it
+            self.unregister(reactor)
+            self.socket.close()
+            self.socket = connection
+            self.socket.setblocking(False)
+            self.backlog = 0
+            self.state = Connected
+            self.register(reactor)
+        else:
+            self.accepted = connection
+            self.state = Connected
+
+    def accept(self, reactor):
+        """Answer the connection that made this listening socket Connected
+        and wait for the next one."""
+        self.poll_connection(reactor)
+        connection = self.accepted
+        if self.backlog <= 1 or connection is None:
+            raise error.PrimitiveFailedError
+        self.accepted = None
+        self.state = WaitingForConnection
+        reactor.enable(self.socket.fd, READ)
+        return connection
+
+    def local_address(self):
+        try:
+            return self.socket.getsockname()
+        except rsocket.SocketError:
+            return None
+
+    def remote_address(self):
+        if self.state != Connected and self.state != OtherEndClosed:
+            return None
+        try:
+            return self.socket.getpeername()
+        except rsocket.SocketError:
+            return None
+
+    def can_read(self, reactor):
+        """Whether data arrived since the socket was last drained, as far as
+        the reactor knows. Only sockets that it does not watch ask the
+        system."""
+        if self.state != Connected:
+            return False
+        if not reactor.is_registered(self.socket.fd):
+            return self.peek()
+        if reactor.is_ready(self.socket.fd, READ):
+            return True
+        self.wait_for_data(reactor)
         return False
 
+    def peek(self):
+        try:
+            r = self.socket.recv(1, rsocket.MSG_PEEK)
+        except rsocket.CSocketError, e:
+            if e.errno == errno.EAGAIN or e.errno == errno.EWOULDBLOCK:
+                return False
+            raise
+        if len(r) == 0:
+            self.state = OtherEndClosed
+            return False
+        return True
+
+    def send_done(self, reactor):
+        """Whether the last send was complete or the system can take more
+        data since."""
+        if self.state != Connected:
+            return True
+        return not reactor.is_enabled(self.socket.fd, WRITE)
+
     def recv(self, count):
         try:
             data = non_blocking_recv(self, count)
@@ -125,18 +313,82 @@ class W_SocketHandle(model.W_AbstractObjectWithIdentityHash):
             self.state = OtherEndClosed
         return data
 
+    def recvinto(self, rwbuffer, count):
+        try:
+            received = non_blocking_recvinto(self, rwbuffer, count)
+        except rsocket.CSocketError, e:
+            if e.errno == errno.EAGAIN or e.errno == errno.EWOULDBLOCK:
+                return 0
+            raise error.PrimitiveFailedError
+        if received == 0 and count > 0:
+            self.state = OtherEndClosed
+        return received
+
+    def recvfrom_into(self, rwbuffer, count):
+        try:
+            return non_blocking_recvfrom_into(self, rwbuffer, count)
+        except rsocket.CSocketError, e:
+            if e.errno == errno.EAGAIN or e.errno == errno.EWOULDBLOCK:
+                return 0, None
+            raise error.PrimitiveFailedError
+
     def send(self, data):
         return self.socket.send(data)
 
-    def close(self):
+    def send_from(self, reactor, space, w_data, byte_start, byte_end):
+        try:
+            sent = self._send_from(space, w_data, byte_start, byte_end)
+        except rsocket.CSocketError, e:
+            if e.errno != errno.EAGAIN and e.errno != errno.EWOULDBLOCK:
+                raise error.PrimitiveFailedError
+            sent = 0
+        if sent < byte_end - byte_start:
+            # the send buffer is full, the reactor tells when it drains
+            reactor.enable(self.socket.fd, WRITE)
+        return sent
+
+    def _send_from(self, space, w_data, byte_start, byte_end):
+        raw = w_data.raw_address()
+        if not raw:
+            return self.send(w_data.unwrap_string_slice(space, byte_start, byte_end))
+        # send straight from the storage of the data
+        try:
+            return self.socket.send_raw(rffi.ptradd(raw, byte_start),
+                                        byte_end - byte_start)
+        finally:
+            objectmodel.keepalive_until_here(w_data)
+
+    def sendto_from(self, space, w_data, byte_start, byte_end, address):
+        raw = w_data.raw_address()
+        try:
+            if not raw:
+                data = w_data.unwrap_string_slice(space, byte_start, byte_end)
+                with rffi.scoped_nonmovingbuffer(data) as dataptr:
+                    return self.socket.sendto(dataptr, len(data), 0, address)
+            try:
+                return self.socket.sendto(rffi.ptradd(raw, byte_start),
+                                          byte_end - byte_start, 0, address)
+            finally:
+                objectmodel.keepalive_until_here(w_data)
+        except rsocket.SocketError:
+            raise error.PrimitiveFailedError
+
+    def close(self, reactor=None):
         if (self.state == Connected or
             self.state == OtherEndClosed or
                 self.state == WaitingForConnection):
+            if reactor is not None:
+                self.unregister(reactor)
+            if self.accepted is not None:
+                self.accepted.close()
+                self.accepted = None
             self.socket.close()
+            self.backlog = 0
             self.state = Unconnected
 
-    def destroy(self):
+    def destroy(self, reactor):
         if self.state != InvalidSocket:
+            self.unregister(reactor)
             self.state = InvalidSocket
 
     def __del__(self):
@@ -149,6 +401,102 @@ def ensure_socket(w_socket):
     else:
         return w_socket
 
+def address_from_bytes(space, w_bytes, port):
+    """The image passes host addresses as ByteArrays of 4 or 16 bytes, but
+    our resolver answers them as Strings, so those are host names."""
+    host = w_bytes.unwrap_string(space)
+    if not w_bytes.getclass(space).is_same_object(space.w_String):
+        if len(host) == 4:
+            host = "%d.%d.%d.%d" % (ord(host[0]), ord(host[1]),
+                                    ord(host[2]), ord(host[3]))
+        elif len(host) == 16:
+            host = ":".join(["%x" % (ord(host[i]) << 8 | ord(host[i + 1]))
+                             for i in range(0, 16, 2)])
+    try:
+        try:
+            return rsocket.INETAddress(host, port)
+        except rsocket.GAIError:
+            return rsocket.INET6Address(host, port)
+    except rsocket.SocketError:
+        raise error.PrimitiveFailedError
+
+def wrap_address_bytes(space, address):
+    """The host of an address as a ByteArray, all zeros if unknown."""
+    host = "\x00\x00\x00\x00"
+    if isinstance(address, rsocket.INETAddress) or isinstance(address, rsocket.INET6Address):
+        p, size = address.lock_in_addr()
+        try:
+            host = rffi.charpsize2str(rffi.cast(rffi.CCHARP, p), size)
+        finally:
+            address.unlock()
+    w_bytes = model.W_BytesObject(space, space.w_ByteArray, len(host))
+    for i in range(len(host)):
+        w_bytes.setchar(i, host[i])
+    return w_bytes
+
+def copy_socket_address(space, address, w_address):
+    """Store the address into a socket address of the image, a ByteArray
+    of the size answered before, which holds the sockaddr structure. The
+    image only passes it back to the socket primitives."""
+    if address is None or not isinstance(w_address, model.W_BytesObject):
+        raise error.PrimitiveFailedError
+    if w_address.size() != address.addrlen:
+        raise error.PrimitiveFailedError
+    p = address.lock()
+    try:
+        data = rffi.charpsize2str(rffi.cast(rffi.CCHARP, p), address.addrlen)
+    finally:
+        address.unlock()
+    for i in range(len(data)):
+        w_address.setchar(i, data[i])
+
+def unwrap_socket_address(space, w_address):
+    """The address in a socket address, see copy_socket_address. Only IPv4
+    and IPv6 addresses are accepted."""
+    if not isinstance(w_address, model.W_BytesObject):
+        raise error.PrimitiveFailedError
+    data = w_address.unwrap_string(space)
+    size = len(data)
+    with lltype.scoped_alloc(rffi.CCHARP.TO, max(size, 1)) as buf:
+        for i in range(size):
+            buf[i] = data[i]
+        addr_p = rffi.cast(_rsocket_rffi.sockaddr_ptr, buf)
+        family = rffi.cast(lltype.Signed, addr_p.c_sa_family)
+        if ((family != rsocket.AF_INET or
+                size != rffi.sizeof(_rsocket_rffi.sockaddr_in)) and
+            (family != rsocket.AF_INET6 or
+                size != rffi.sizeof(_rsocket_rffi.sockaddr_in6))):
+            raise error.PrimitiveFailedError
+        return rsocket.make_address(addr_p, size)
+
+def address_port(address):
+    if isinstance(address, rsocket.INETAddress) or isinstance(address, rsocket.INET6Address):
+        return address.get_port()
+    return 0
+
+# The socket options the image can get and set by name
+SOCKET_OPTIONS = {}
+for _name, _level in [("SO_DEBUG", "SOL_SOCKET"), ("SO_REUSEADDR", "SOL_SOCKET"),
+                      ("SO_REUSEPORT", "SOL_SOCKET"), ("SO_DONTROUTE", "SOL_SOCKET"),
+                      ("SO_BROADCAST", "SOL_SOCKET"), ("SO_SNDBUF", "SOL_SOCKET"),
+                      ("SO_RCVBUF", "SOL_SOCKET"), ("SO_KEEPALIVE", "SOL_SOCKET"),
+                      ("SO_OOBINLINE", "SOL_SOCKET"), ("SO_RCVLOWAT", "SOL_SOCKET"),
+                      ("SO_SNDLOWAT", "SOL_SOCKET"), ("SO_ERROR", "SOL_SOCKET"),
+                      ("IP_TTL", "IPPROTO_IP"), ("IP_HDRINCL", "IPPROTO_IP"),
+                      ("IP_MULTICAST_IF", "IPPROTO_IP"),
+                      ("IP_MULTICAST_TTL", "IPPROTO_IP"),
+                      ("IP_MULTICAST_LOOP", "IPPROTO_IP"),
+                      ("TCP_MAXSEG", "IPPROTO_TCP"), ("TCP_NODELAY", "IPPROTO_TCP"),
+                      ("TCP_CORK", "IPPROTO_TCP")]:
+    if _name in rsocket.constants and _level in rsocket.constants:
+        SOCKET_OPTIONS[_name] = (rsocket.constants[_level], rsocket.constants[_name])
+
+def socket_option(name):
+    try:
+        return SOCKET_OPTIONS[name]
+    except KeyError:
+        raise error.PrimitiveFailedError
+
 
 @SocketPlugin.expose_primitive(unwrap_spec=None)
 def primitiveResolverGetNameInfoHostResult(interp, s_frame, argcount):
@@ -326,280 +674,306 @@ def primitiveHasSocketAccess(interp, s_frame, w_rcvr):
     # if security plugin forbids it, this should return false
     return interp.space.w_true
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketAddressSetPort(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
+@SocketPlugin.expose_primitive(unwrap_spec=[object, int])
+def primitiveSocketAddressSetPort(interp, s_frame, w_address, port):
+    address = unwrap_socket_address(interp.space, w_address)
+    if not 0 <= port <= 0xffff:
         raise error.PrimitiveFailedError
+    # the port is in network byte order in both sockaddr_in and sockaddr_in6
+    if address.family == rsocket.AF_INET:
+        offset = rffi.offsetof(_rsocket_rffi.sockaddr_in, 'c_sin_port')
     else:
-        print "Missing Socket primitive primitiveSocketAddressSetPort"
-        raise error.PrimitiveFailedError
+        offset = rffi.offsetof(_rsocket_rffi.sockaddr_in6, 'c_sin6_port')
+    w_address.setchar(offset, chr(port >> 8))
+    w_address.setchar(offset + 1, chr(port & 0xff))
+    return w_address
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketAddressGetPort(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketAddressGetPort"
-        raise error.PrimitiveFailedError
+@SocketPlugin.expose_primitive(unwrap_spec=[object])
+def primitiveSocketAddressGetPort(interp, s_frame, w_address):
+    address = unwrap_socket_address(interp.space, w_address)
+    return interp.space.wrap_int(address_port(address))
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketReceiveUDPDataBufCount(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketReceiveUDPDataBufCount"
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveSocketRemoteAddressSize(interp, s_frame, w_rcvr, w_handle):
+    w_socket = ensure_socket(w_handle)
+    address = w_socket.remote_address()
+    if address is None:
         raise error.PrimitiveFailedError
+    return interp.space.wrap_int(address.addrlen)
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketSetOptions(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketSetOptions"
-        raise error.PrimitiveFailedError
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object, object])
+def primitiveSocketConnectTo(interp, s_frame, w_rcvr, w_handle, w_address):
+    w_socket = ensure_socket(w_handle)
+    w_socket.connect_to(unwrap_socket_address(interp.space, w_address))
+    w_socket.register(interp.reactor)
+    return interp.space.w_nil
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketRemoteAddressSize(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketRemoteAddressSize"
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveSocketLocalAddressSize(interp, s_frame, w_rcvr, w_handle):
+    w_socket = ensure_socket(w_handle)
+    address = w_socket.local_address()
+    if address is None:
         raise error.PrimitiveFailedError
+    return interp.space.wrap_int(address.addrlen)
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketConnectTo(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketConnectTo"
-        raise error.PrimitiveFailedError
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object, object])
+def primitiveSocketBindTo(interp, s_frame, w_rcvr, w_handle, w_address):
+    w_socket = ensure_socket(w_handle)
+    w_socket.bind(unwrap_socket_address(interp.space, w_address))
+    if w_socket.state == Connected:
+        w_socket.register(interp.reactor)
+    return interp.space.w_nil
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketLocalAddressSize(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketLocalAddressSize"
-        raise error.PrimitiveFailedError
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object, int])
+def primitiveSocketListenWithBacklog(interp, s_frame, w_rcvr, w_handle, backlog):
+    w_socket = ensure_socket(w_handle)
+    w_socket.listen_with_backlog(backlog)
+    w_socket.register(interp.reactor)
+    return interp.space.w_nil
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketRemoteAddress(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketRemoteAddress"
-        raise error.PrimitiveFailedError
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object, object])
+def primitiveSocketLocalAddressResult(interp, s_frame, w_rcvr, w_handle, w_address):
+    w_socket = ensure_socket(w_handle)
+    copy_socket_address(interp.space, w_socket.local_address(), w_address)
+    return interp.space.w_nil
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketLocalPort(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketLocalPort"
-        raise error.PrimitiveFailedError
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object, object])
+def primitiveSocketRemoteAddressResult(interp, s_frame, w_rcvr, w_handle, w_address):
+    w_socket = ensure_socket(w_handle)
+    copy_socket_address(interp.space, w_socket.remote_address(), w_address)
+    return interp.space.w_nil
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketError(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketError"
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveSocketCloseConnection(interp, s_frame, w_rcvr, w_handle):
+    w_socket = ensure_socket(w_handle)
+    try:
+        w_socket.close(interp.reactor)
+    except rsocket.SocketError:
         raise error.PrimitiveFailedError
+    return interp.space.w_nil
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketBindTo(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketBindTo"
-        raise error.PrimitiveFailedError
+@SocketPlugin.expose_primitive(unwrap_spec=[object, int, int, int, int, int, int, int])
+def primitiveSocketCreate3Semaphores(interp, s_frame, w_rcvr, netType, socketType, rcvBufSize, sendBufSize, sema, readSema, writeSema):
+    if netType == 0: # undefined
+        netType = rsocket.AF_INET
+    return W_SocketHandle(netType, socketType, sema, readSema, writeSema)
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketAbortConnection(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveSocketConnectionStatus(interp, s_frame, w_rcvr, w_socket):
+    if not isinstance(w_socket, W_SocketHandle):
+        return interp.space.wrap_int(InvalidSocket)
     else:
-        print "Missing Socket primitive primitiveSocketAbortConnection"
-        raise error.PrimitiveFailedError
+        w_socket.poll_connection(interp.reactor)
+        return interp.space.wrap_int(w_socket.state)
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketListenWithBacklog(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketListenWithBacklog"
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object, object, int])
+def primitiveSocketConnectToPort(interp, s_frame, w_rcvr, w_handle, w_hostaddr, port):
+    w_socket = ensure_socket(w_handle)
+    if not isinstance(w_hostaddr, model.W_BytesObject):
         raise error.PrimitiveFailedError
+    w_socket.connect(interp.space, w_hostaddr, port)
+    w_socket.register(interp.reactor)
+    return interp.space.w_nil
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketGetOptions(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketGetOptions"
-        raise error.PrimitiveFailedError
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object, int])
+def primitiveSocketListenOnPort(interp, s_frame, w_rcvr, w_handle, port):
+    w_socket = ensure_socket(w_handle)
+    w_socket.listen(interp.space, port, 1, None)
+    w_socket.register(interp.reactor)
+    return interp.space.w_nil
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketSendUDPDataBufCount(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketSendUDPDataBufCount"
-        raise error.PrimitiveFailedError
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object, int, int])
+def primitiveSocketListenWithOrWithoutBacklog(interp, s_frame, w_rcvr, w_handle, port, backlog):
+    w_socket = ensure_socket(w_handle)
+    w_socket.listen(interp.space, port, backlog, None)
+    w_socket.register(interp.reactor)
+    return interp.space.w_nil
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketLocalAddressResult(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketLocalAddressResult"
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object, int, int, object])
+def primitiveSocketListenOnPortBacklogInterface(interp, s_frame, w_rcvr, w_handle, port, backlog, w_interface):
+    w_socket = ensure_socket(w_handle)
+    if not isinstance(w_interface, model.W_BytesObject):
         raise error.PrimitiveFailedError
+    w_socket.listen(interp.space, port, backlog, w_interface)
+    w_socket.register(interp.reactor)
+    return interp.space.w_nil
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketLocalAddress(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketLocalAddress"
-        raise error.PrimitiveFailedError
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object, int, int, int, int, int])
+def primitiveSocketAccept3Semaphores(interp, s_frame, w_rcvr, w_handle, rcvBufSize, sendBufSize, sema, readSema, writeSema):
+    w_socket = ensure_socket(w_handle)
+    connection = w_socket.accept(interp.reactor)
+    w_connection = W_SocketHandle(w_socket.family, w_socket.socketType,
+                                  sema, readSema, writeSema, connection)
+    w_connection.register(interp.reactor)
+    return w_connection
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketListenWithOrWithoutBacklog(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketListenWithOrWithoutBacklog"
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveSocketAbortConnection(interp, s_frame, w_rcvr, w_handle):
+    w_socket = ensure_socket(w_handle)
+    try:
+        w_socket.close(interp.reactor)
+    except rsocket.SocketError:
         raise error.PrimitiveFailedError
+    return interp.space.w_nil
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketAccept3Semaphores(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketAccept3Semaphores"
-        raise error.PrimitiveFailedError
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveSocketError(interp, s_frame, w_rcvr, w_handle):
+    w_socket = ensure_socket(w_handle)
+    try:
+        code = w_socket.socket.getsockopt_int(rsocket.SOL_SOCKET, rsocket.SO_ERROR)
+    except rsocket.SocketError:
+        code = 0
+    return interp.space.wrap_int(code)
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketRemoteAddressResult(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketRemoteAddressResult"
-        raise error.PrimitiveFailedError
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveSocketLocalAddress(interp, s_frame, w_rcvr, w_handle):
+    w_socket = ensure_socket(w_handle)
+    return wrap_address_bytes(interp.space, w_socket.local_address())
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketListenOnPortBacklogInterface(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
-    else:
-        print "Missing Socket primitive primitiveSocketListenOnPortBacklogInterface"
-        raise error.PrimitiveFailedError
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveSocketLocalPort(interp, s_frame, w_rcvr, w_handle):
+    w_socket = ensure_socket(w_handle)
+    return interp.space.wrap_int(address_port(w_socket.local_address()))
 
 @SocketPlugin.expose_primitive(unwrap_spec=[object, object])
-def primitiveSocketCloseConnection(interp, s_frame, w_rcvr, w_handle):
+def primitiveSocketRemoteAddress(interp, s_frame, w_rcvr, w_handle):
+    w_socket = ensure_socket(w_handle)
+    return wrap_address_bytes(interp.space, w_socket.remote_address())
+
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveSocketRemotePort(interp, s_frame, w_rcvr, w_handle):
+    w_socket = ensure_socket(w_handle)
+    return interp.space.wrap_int(address_port(w_socket.remote_address()))
+
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object, str])
+def primitiveSocketGetOptions(interp, s_frame, w_rcvr, w_handle, name):
     w_socket = ensure_socket(w_handle)
+    level, option = socket_option(name)
     try:
-        w_socket.close()
+        value = w_socket.socket.getsockopt_int(level, option)
     except rsocket.SocketError:
         raise error.PrimitiveFailedError
-    return interp.space.w_nil
+    space = interp.space
+    return space.wrap_list([space.wrap_int(0), space.wrap_int(value)])
 
-@SocketPlugin.expose_primitive(unwrap_spec=None)
-def primitiveSocketRemotePort(interp, s_frame, argcount):
-    if not objectmodel.we_are_translated():
-        import pdb; pdb.set_trace()
-        raise error.PrimitiveFailedError
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object, str, str])
+def primitiveSocketSetOptions(interp, s_frame, w_rcvr, w_handle, name, value):
+    w_socket = ensure_socket(w_handle)
+    level, option = socket_option(name)
+    if value == "true":
+        flag = 1
+    elif value == "false":
+        flag = 0
     else:
-        print "Missing Socket primitive primitiveSocketRemotePort"
+        try:
+            flag = int(value)
+        except ValueError:
+            raise error.PrimitiveFailedError
+    try:
+        w_socket.socket.setsockopt_int(level, option, flag)
+        flag = w_socket.socket.getsockopt_int(level, option)
+    except rsocket.SocketError:
         raise error.PrimitiveFailedError
-
-@SocketPlugin.expose_primitive(unwrap_spec=[object, int, int, int, int, int, int, int])
-def primitiveSocketCreate3Semaphores(interp, s_frame, w_rcvr, netType, socketType, rcvBufSize, sendBufSize, sema, readSema, writeSema):
-    if netType == 0: # undefined
-        netType = rsocket.AF_INET
-    return W_SocketHandle(netType, socketType)
+    space = interp.space
+    return space.wrap_list([space.wrap_int(0), space.wrap_int(flag)])
 
 @SocketPlugin.expose_primitive(unwrap_spec=[object, object])
-def primitiveSocketConnectionStatus(interp, s_frame, w_rcvr, w_socket):
-    if not isinstance(w_socket, W_SocketHandle):
-        return interp.space.wrap_int(InvalidSocket)
+def primitiveSocketSendDone(interp, s_frame, w_rcvr, w_handle):
+    w_socket = ensure_socket(w_handle)
+    return interp.space.wrap_bool(w_socket.send_done(interp.reactor))
+
+def data_element_size(w_data):
+    if (isinstance(w_data, model.W_WordsObject) or
+            isinstance(w_data, model_display.W_DisplayBitmap)):
+        return 4
+    elif isinstance(w_data, model.W_BytesObject):
+        return 1
     else:
-        return interp.space.wrap_int(w_socket.state)
+        raise error.PrimitiveFailedError
 
-@SocketPlugin.expose_primitive(unwrap_spec=[object, object, object, int])
-def primitiveSocketConnectToPort(interp, s_frame, w_rcvr, w_handle, w_hostaddr, port):
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object, object, object, int, int, int])
+def primitiveSocketSendUDPDataBufCount(interp, s_frame, w_rcvr, w_handle, w_data, w_hostaddr, port, start, count):
     w_socket = ensure_socket(w_handle)
+    element_size = data_element_size(w_data)
     if not isinstance(w_hostaddr, model.W_BytesObject):
         raise error.PrimitiveFailedError
-    w_socket.connect(w_hostaddr, port)
-    return interp.space.w_nil
+    s = start - 1
+    if s < 0 or count < 0 or s + count > w_data.size():
+        raise error.PrimitiveFailedError
+    address = address_from_bytes(interp.space, w_hostaddr, port)
+    res = w_socket.sendto_from(interp.space, w_data, s * element_size,
+                               (s + count) * element_size, address)
+    return interp.space.wrap_int(res / element_size)
 
-@SocketPlugin.expose_primitive(unwrap_spec=[object, object])
-def primitiveSocketSendDone(interp, s_frame, w_rcvr, fd):
-    return interp.space.w_true
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object, object, int, int])
+def primitiveSocketReceiveUDPDataBufCount(interp, s_frame, w_rcvr, w_handle, w_target, start, count):
+    w_socket = ensure_socket(w_handle)
+    if start < 1 or count < 0 or start + count - 1 > w_target.size():
+        raise error.PrimitiveFailedError
+    if not isinstance(w_target, model.W_BytesObject):
+        raise error.PrimitiveFailedError
+    received, address = 0, None
+    try:
+        received, address = w_socket.recvfrom_into(
+            w_target.as_buffer(start - 1, count), count)
+    finally:
+        if received == 0:
+            w_socket.wait_for_data(interp.reactor)
+    w_target.mutate()
+    space = interp.space
+    return space.wrap_list([space.wrap_int(received),
+                            wrap_address_bytes(space, address),
+                            space.wrap_int(address_port(address)),
+                            space.w_false])
 
-@SocketPlugin.expose_primitive(unwrap_spec=[object, object, str, int, int])
-def primitiveSocketSendDataBufCount(interp, s_frame, w_rcvr, w_handle, data, start, count):
+@SocketPlugin.expose_primitive(unwrap_spec=[object, object, object, int, int])
+def primitiveSocketSendDataBufCount(interp, s_frame, w_rcvr, w_handle, w_data, start, count):
     w_socket = ensure_socket(w_handle)
+    element_size = data_element_size(w_data)
     s = start - 1
-    if s < 0:
+    if s < 0 or count < 0:
         raise error.PrimitiveFailedError
     e = s + count
-    if e > len(data):
+    if e > w_data.size():
         raise error.PrimitiveFailedError
-    assert e >= 0
-    res = w_socket.send(data[s:e])
-    return interp.space.wrap_int(res)
+    res = w_socket.send_from(interp.reactor, interp.space, w_data,
+                             s * element_size, e * element_size)
+    return interp.space.wrap_int(res / element_size)
 
 @SocketPlugin.expose_primitive(unwrap_spec=[object, object])
 def primitiveSocketReceiveDataAvailable(interp, s_frame, w_rcvr, w_handle):
     w_socket = ensure_socket(w_handle)
-    if w_socket.can_read():
-        return interp.space.w_true
-    else:
-        return interp.space.w_false
+    # Answered from what the interrupt checks last saw, so polling an idle
+    # socket costs no system call. waitForDataFor: waits on the read
+    # semaphore, which the reactor signals when data arrives.
+    return interp.space.wrap_bool(w_socket.can_read(interp.reactor))
 
 @SocketPlugin.expose_primitive(unwrap_spec=[object, object, object, int, int])
 def primitiveSocketReceiveDataBufCount(interp, s_frame, w_rcvr, w_handle, w_target, start, count):
     w_socket = ensure_socket(w_handle)
     assert isinstance(w_socket, W_SocketHandle)
-    if start + count - 1 > w_target.size():
+    if start < 1 or count < 0 or start + count - 1 > w_target.size():
         raise error.PrimitiveFailedError
     if not isinstance(w_target, model.W_BytesObject):
         raise error.PrimitiveFailedError
+    # receive straight into the target, changing its version only once
+    received = 0
     try:
-        data = w_socket.recv(count)
+        received = w_socket.recvinto(w_target.as_buffer(start - 1, count), count)
     except rsocket.SocketError:
         return interp.space.wrap_int(0)
-    for idx, char in enumerate(data):
-        w_target.setchar(idx + start - 1, char)
-    return interp.space.wrap_int(len(data))
+    finally:
+        if received < count:
+            # drained, the reactor tells when more data arrives
+            w_socket.wait_for_data(interp.reactor)
+    w_target.mutate()
+    return interp.space.wrap_int(received)
 
 @SocketPlugin.expose_primitive(unwrap_spec=[object, object])
 def primitiveSocketDestroy(interp, s_frame, w_rcvr, w_handle):
     w_socket = ensure_socket(w_handle)
     try:
-        w_socket.destroy()
+        w_socket.destroy(interp.reactor)
     except rsocket.SocketError:
         raise error.PrimitiveFailedError
     return interp.space.wrap_int(w_socket.state)
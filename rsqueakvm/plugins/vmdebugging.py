@@ -64,6 +64,30 @@ def debugPrint(interp, s_frame, w_rcvr, w_string):
     print interp.space.unwrap_string(w_string).replace('\r', '\n')
     return w_rcvr
 
+@DebuggingPlugin.expose_primitive(unwrap_spec=[object, object])
+def invalidationCounts(interp, s_frame, w_rcvr, w_class):
+    # Answer how often the lookups of the class were invalidated, because the
+    # class itself changed or because a method in its dictionary changed
+    if not (isinstance(w_class, model.W_PointersObject) and
+            w_class.is_class(interp.space)):
+        raise error.PrimitiveFailedError()
+    s_class = w_class.as_class_get_shadow(interp.space)
+    return interp.space.wrap_list([
+        interp.space.wrap_int(s_class.class_invalidations),
+        interp.space.wrap_int(s_class.selector_invalidations)])
+
+@DebuggingPlugin.expose_primitive(unwrap_spec=[object])
+def beginMethodChanges(interp, s_frame, w_rcvr):
+    # Used around bulk loads, lookups are only invalidated once per changed
+    # class in endMethodChanges
+    interp.space.begin_method_changes()
+    return w_rcvr
+
+@DebuggingPlugin.expose_primitive(unwrap_spec=[object])
+def endMethodChanges(interp, s_frame, w_rcvr):
+    interp.space.end_method_changes()
+    return w_rcvr
+
 @DebuggingPlugin.expose_primitive(unwrap_spec=[object])
 def stopUIProcess(interp, s_frame, w_rcvr):
     if DebuggingPlugin.userdata.get('stop_ui', False):
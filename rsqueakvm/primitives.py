@@ -5,6 +5,7 @@ import operator
 from rsqueakvm import model, model_display, storage_contexts, error, constants, display
 from rsqueakvm.error import PrimitiveFailedError, PrimitiveNotYetWrittenError, MetaPrimFailed
 from rsqueakvm import wrapper
+from rsqueakvm.util.instances import find_instances
 
 from rpython.rlib import rfloat, unroll, jit, objectmodel
 from rpython.rlib.rarithmetic import intmask, r_uint, ovfcheck, ovfcheck_float_to_int, r_int64, int_between, r_uint32
@@ -555,13 +556,13 @@ def func(interp, s_frame, w_class):
 
 @expose_primitive(ALL_INSTANCES, unwrap_spec=[object])
 def func(interp, s_frame, w_class):
-    match_w = get_instances_array(interp, s_frame, w_class=w_class, store=False)
-    return interp.space.wrap_list(match_w)
+    instances = get_instances(interp, s_frame, w_class=w_class, store=False)
+    return interp.space.wrap_list(instances.objects_w)
 
 @expose_primitive(ALL_OBJECTS, unwrap_spec=[object])
 def func(interp, s_frame, w_rcvr):
-    match_w = get_instances_array(interp, s_frame, w_class=None, store=False)
-    return interp.space.wrap_list(match_w)
+    instances = get_instances(interp, s_frame, w_class=None, store=False)
+    return interp.space.wrap_list(instances.objects_w)
 
 # ___________________________________________________________________________
 # Storage Management Primitives
@@ -629,16 +630,100 @@ def func(interp, s_frame, w_cls, size):
     try:
         return s_class.new(size)
     except MemoryError:
+        interp.gc_stats.allocation_failed()
         raise PrimitiveFailedError
 
+# Lazily forwarded objects are replaced by their targets in the next heap
+# walk, at the latest once this many have piled up.
+MAX_PENDING_FORWARDERS = 10000
+
 @expose_primitive(ARRAY_BECOME_ONE_WAY, unwrap_spec=[object, object])
 def func(interp, s_frame, w_from, w_to):
     from_w = interp.space.unwrap_array(w_from)
     to_w = interp.space.unwrap_array(w_to)
-    space = interp.space
     if len(from_w) != len(to_w):
         raise PrimitiveFailedError
 
+    if can_forward_lazily(interp, from_w, to_w):
+        for i in range(len(from_w)):
+            forward_lazily(interp, from_w[i], to_w[i])
+        if len(interp.forwarders_w) > MAX_PENDING_FORWARDERS:
+            flush_forwarders(interp, s_frame)
+    else:
+        # the heap walk also replaces the pending forwarders, whose targets
+        # may be among the objects that are becoming something else now
+        pending_w = interp.forwarders_w
+        interp.forwarders_w = []
+        targets_w = [w_obj.forwarded() for w_obj in pending_w]
+        for i in range(len(targets_w)):
+            for j in range(len(from_w)):
+                if targets_w[i].is_same_object(from_w[j]):
+                    targets_w[i] = to_w[j]
+                    break
+        become_forward_in_heap(interp, s_frame, from_w + pending_w, to_w + targets_w)
+    return w_from
+
+def can_forward_lazily(interp, from_w, to_w):
+    """Plain objects can be forwarded without looking at the heap. Classes,
+    contexts and other objects with shadows are referenced from VM-internal
+    structures, and the special objects are cached in the object space, so
+    those still need the heap walk. So does a target that is also the source
+    of another pair, because forwarding chains would not match the
+    simultaneous replacement of all references."""
+    space = interp.space
+    special_w = interp.image.special_objects.fetch_all(space)
+    sources = {}
+    for i in range(len(from_w)):
+        w_from = from_w[i]
+        w_to = to_w[i]
+        if not (isinstance(w_from, model.W_PointersObject) and
+                isinstance(w_to, model.W_PointersObject)):
+            return False
+        w_from = w_from.forwarded()
+        if sources.get(w_from, False):
+            return False
+        sources[w_from] = True
+        strategy = w_from.strategy
+        if strategy is None or strategy.is_shadow():
+            return False
+        for w_special in special_w:
+            if w_from.is_same_object(w_special):
+                return False
+    for w_to in to_w:
+        assert isinstance(w_to, model.W_PointersObject)
+        if sources.get(w_to.forwarded(), False):
+            return False
+    return True
+
+def forward_lazily(interp, w_from, w_to):
+    from rsqueakvm.storage import ForwardingStrategy
+    assert isinstance(w_from, model.W_PointersObject)
+    assert isinstance(w_to, model.W_PointersObject)
+    w_from = w_from.forwarded()
+    w_to = w_to.forwarded()
+    if w_from is w_to:
+        return
+    w_from.post_become_one_way(w_to)
+    strategy = ForwardingStrategy(interp.space, w_to)
+    w_from.strategy = strategy
+    # the slots are read from the target from now on, do not keep the old
+    # ones alive until the forwarders are flushed
+    strategy.set_storage(w_from, None)
+    interp.forwarders_w.append(w_from)
+
+def flush_forwarders(interp, s_frame):
+    """Replace all references to lazily forwarded objects by references to
+    their targets, e.g. before the heap is written to a snapshot."""
+    if len(interp.forwarders_w) == 0:
+        return
+    from_w = interp.forwarders_w
+    to_w = [w_obj.forwarded() for w_obj in from_w]
+    interp.forwarders_w = []
+    become_forward_in_heap(interp, s_frame, from_w, to_w)
+
+@jit.dont_look_inside
+def become_forward_in_heap(interp, s_frame, from_w, to_w):
+    space = interp.space
     # TODO: make this fast (context-switch and stack-rebuilding?)
     s_current = s_frame
     while s_current.s_sender() is not None:
@@ -662,7 +747,6 @@ def func(interp, s_frame, w_from, w_to):
         if rgc.get_gcflag_extra(gcref):
             rgc.toggle_gcflag_extra(gcref)
             roots.extend(rgc.get_rpy_referents(gcref))
-    return w_from
 
 @expose_primitive(INST_VAR_AT, unwrap_spec=[object, index1_0])
 def func(interp, s_frame, w_rcvr, n0):
@@ -719,55 +803,25 @@ def get_instances_array_gc(interp, w_class=None):
     rgc.assert_no_more_gcflags()
     return result_w
 
-@jit.dont_look_inside
-def get_instances_array_trace(interp, w_class, some_instance=False):
-    space = interp.space
-    result_w = []
-    seen_w = {}
-    roots = [interp.image.special_objects]
-    pending = roots[:]
-    while pending:
-        w_obj = pending.pop()
-        if w_obj and not seen_w.get(w_obj, False):
-            seen_w[w_obj] = True
-            if w_obj.has_class():
-                w_cls = w_obj.getclass(space)
-                if w_cls is not None:
-                    # XXX: should not return SmallFloat64 on Spur64...
-                    if ((not w_cls.is_same_object(space.w_SmallInteger)) and
-                        (not (space.is_spur.is_set() and w_cls.is_same_object(space.w_Character))) and
-                        (w_class is None or w_cls.is_same_object(w_class))):
-                        if some_instance:
-                            return [w_obj]
-                        else:
-                            result_w.append(w_obj)
-            pending.extend(_trace_pointers(interp.space, w_obj))
-    return result_w
-
-def _trace_pointers(space, w_obj):
-    p_w = [w_obj.getclass(space)]
-    if isinstance(w_obj, model.W_CompiledMethod):
-        p_w.extend(w_obj.literals)
-    elif isinstance(w_obj, model.W_PointersObject):
-        p_w.extend(w_obj.fetch_all(space))
-    return p_w
-
-def get_instances_array(interp, s_frame, w_class=None, store=True, some_instance=False):
+def get_instances(interp, s_frame, w_class=None, store=True, some_instance=False):
+    instances = s_frame.instances_array(w_class)
+    if instances is not None:
+        return instances
     # make sure we also get any objects in the currently active process
     w_active_process = wrapper.scheduler(interp.space).active_process()
     active_process = wrapper.ProcessWrapper(interp.space, w_active_process)
     active_process.store_suspended_context(s_frame.w_self())
     try:
-        match_w = s_frame.instances_array(w_class)
-        if match_w is None:
-            if some_instance and interp.space.is_spur.is_set():
-                # on Spur, someInstance really means just one, it's not used to
-                # start iterating over all instances
-                return get_instances_array_trace(interp, w_class, some_instance=True)
-            match_w = get_instances_array_trace(interp, w_class)
-            if store:
-                s_frame.store_instances_array(w_class, match_w)
-        return match_w
+        if some_instance and interp.space.is_spur.is_set():
+            # on Spur, someInstance really means just one, it's not used to
+            # start iterating over all instances
+            return find_instances(interp.space, interp.image.special_objects,
+                                  w_class, some_instance=True)
+        instances = find_instances(interp.space, interp.image.special_objects,
+                                   w_class)
+        if store:
+            s_frame.store_instances_array(w_class, instances)
+        return instances
     finally:
         active_process.store_suspended_context(interp.space.w_nil)
 
@@ -778,39 +832,26 @@ def func(interp, s_frame, w_class):
     # If no class is given, it returns some object.
     if w_class.is_same_object(interp.space.w_SmallInteger):
         raise PrimitiveFailedError()
-
-    match_w = get_instances_array(interp, s_frame, w_class=w_class, some_instance=True)
-    try:
-        return match_w[0]
-    except IndexError:
-        raise PrimitiveFailedError()
-
-def next_instance(space, list_of_objects, w_obj):
-    retval = None
-    try:
-        idx = list_of_objects.index(w_obj)
-    except ValueError:
-        idx = -1
-    try:
-        retval = list_of_objects[idx + 1]
-    except IndexError:
+    instances = get_instances(interp, s_frame, w_class=w_class, some_instance=True)
+    w_first = instances.first()
+    if w_first is None:
         raise PrimitiveFailedError()
-    # just in case, that one of the objects in the list changes its class
-    if retval.getclass(space).is_same_object(w_obj.getclass(space)):
-        return retval
-    else:
-        list_of_objects.pop(idx + 1)
-        return next_instance(space, list_of_objects, w_obj)
+    return w_first
 
 @expose_primitive(NEXT_INSTANCE, unwrap_spec=[object])
 def func(interp, s_frame, w_obj):
     # This primitive is used to iterate through all instances of a class:
     # it returns the "next" instance after w_obj.
-    return next_instance(
-        interp.space,
-        get_instances_array(interp, s_frame, w_class=w_obj.getclass(interp.space)),
-        w_obj
-    )
+    space = interp.space
+    w_class = w_obj.getclass(space)
+    instances = get_instances(interp, s_frame, w_class=w_class)
+    w_next = instances.next_after(w_obj)
+    # just in case, that one of the objects in the list changes its class
+    while w_next is not None and not w_next.getclass(space).is_same_object(w_class):
+        w_next = instances.next_after(w_next)
+    if w_next is None:
+        raise PrimitiveFailedError()
+    return w_next
 
 @expose_primitive(NEW_METHOD, unwrap_spec=[object, int, int])
 def func(interp, s_frame, w_class, bytecount, header):
@@ -886,13 +927,18 @@ def func(interp, s_frame, argcount, w_method):
 
 @expose_primitive(SNAPSHOT, clean_stack=False, no_result=True)
 def func(interp, s_frame, argcount):
+    flush_forwarders(interp, s_frame)
     s_frame.pop_n(argcount)
     s_frame.push(interp.space.w_true)
     # leaving true on the frame as return value for resuming image
     from rsqueakvm.squeakimage import SpurImageWriter
     from rsqueakvm.constants import SYSTEM_ATTRIBUTE_IMAGE_NAME_INDEX
     filename = interp.space.get_system_attribute(SYSTEM_ATTRIBUTE_IMAGE_NAME_INDEX)
-    SpurImageWriter(interp, filename).trace_image(s_frame)
+    writer = SpurImageWriter(interp, filename)
+    if interp.space.background_snapshot.is_set():
+        writer.trace_image_in_background(interp, s_frame)
+    else:
+        writer.trace_image(s_frame)
     s_frame.pop()
     s_frame.push(interp.space.w_false)  # the non-resuming image gets false
 
@@ -966,32 +1012,48 @@ def func(interp, s_frame, w_rcvr):
         interp.image.lastWindowSize = (form.width() << 16) + form.height()
     return w_rcvr
 
-# @expose_primitive(STRING_REPLACE, unwrap_spec=[object, index1_0, index1_0, object, index1_0])
-# @jit.look_inside_iff(lambda interp, s_frame, w_rcvr, start, stop, w_replacement, repStart: jit.isconstant(stop) and jit.isconstant(start))
-# def func(interp, s_frame, w_rcvr, start, stop, w_replacement, repStart):
-#     """replaceFrom: start to: stop with: replacement startingAt: repStart
-#     Primitive. This destructively replaces elements from start to stop in the
-#     receiver starting at index, repStart, in the collection, replacement. Answer
-#     the receiver. Range checks are performed in the primitive only. Essential
-#     for Pharo Candle Symbols.
-#     | index repOff |
-#     repOff := repStart - start.
-#     index := start - 1.
-#     [(index := index + 1) <= stop]
-#         whileTrue: [self at: index put: (replacement at: repOff + index)]"""
-#     if (start < 0 or start - 1 > stop or repStart < 0):
-#         raise PrimitiveFailedError()
-#     # This test deliberately test for equal W_Object class. The Smalltalk classes
-#     # might be different (e.g. Symbol and ByteString)
-#     if w_rcvr.__class__ is not w_replacement.__class__:
-#         raise PrimitiveFailedError
-#     if (w_rcvr.size() - w_rcvr.instsize() <= stop
-#             or w_replacement.size() - w_replacement.instsize() <= repStart + (stop - start)):
-#         raise PrimitiveFailedError()
-#     repOff = repStart - start
-#     for i0 in range(start, stop + 1):
-#         w_rcvr.atput0(interp.space, i0, w_replacement.at0(interp.space, repOff + i0))
-#     return w_rcvr
+@expose_primitive(STRING_REPLACE, unwrap_spec=[object, index1_0, index1_0, object, index1_0])
+def func(interp, s_frame, w_rcvr, start, stop, w_replacement, repStart):
+    """replaceFrom: start to: stop with: replacement startingAt: repStart
+    Primitive. This destructively replaces elements from start to stop in the
+    receiver starting at index, repStart, in the collection, replacement. Answer
+    the receiver. Range checks are performed in the primitive only. Essential
+    for Pharo Candle Symbols.
+    | index repOff |
+    repOff := repStart - start.
+    index := start - 1.
+    [(index := index + 1) <= stop]
+        whileTrue: [self at: index put: (replacement at: repOff + index)]"""
+    if (start < 0 or start - 1 > stop or repStart < 0):
+        raise PrimitiveFailedError()
+    # This test deliberately test for equal W_Object class. The Smalltalk classes
+    # might be different (e.g. Symbol and ByteString)
+    if w_rcvr.__class__ is not w_replacement.__class__:
+        raise PrimitiveFailedError
+    if (w_rcvr.size() - w_rcvr.instsize() <= stop
+            or w_replacement.size() - w_replacement.instsize() <= repStart + (stop - start)):
+        raise PrimitiveFailedError()
+    if start > stop:
+        return w_rcvr
+    space = interp.space
+    if isinstance(w_rcvr, model.W_BytesObject):
+        w_rcvr.replace_from(space, start, stop, w_replacement, repStart)
+    elif isinstance(w_rcvr, model.W_WordsObject):
+        w_rcvr.replace_from(space, start, stop, w_replacement, repStart)
+    elif isinstance(w_rcvr, model.W_PointersObject):
+        w_rcvr.replace_from(space, start, stop, w_replacement, repStart)
+    else:
+        _replace_from_generic(space, w_rcvr, start, stop, w_replacement, repStart)
+    return w_rcvr
+
+@jit.look_inside_iff(lambda space, w_rcvr, start, stop, w_replacement, repStart:
+                     jit.isconstant(stop - start) and stop - start < 16)
+def _replace_from_generic(space, w_rcvr, start, stop, w_replacement, repStart):
+    # Everything without a bulk copy (compiled methods, display bitmaps, large
+    # integers, ...) goes through at0/atput0.
+    repOff = repStart - start
+    for i0 in range(start, stop + 1):
+        w_rcvr.atput0(space, i0, w_replacement.at0(space, repOff + i0))
 
 @expose_primitive(SCREEN_SIZE, unwrap_spec=[object])
 def func(interp, s_frame, w_rcvr):
@@ -1058,11 +1120,12 @@ def func(interp, s_frame, argcount):
 
 @expose_primitive(BYTES_LEFT, unwrap_spec=[object])
 def func(interp, s_frame, w_rcvr):
-    return fake_bytes_left(interp)
+    return wrap_bytes(interp.space, interp.gc_stats.bytes_left())
 
 @expose_primitive(QUIT, unwrap_spec=[object])
 def func(interp, s_frame, w_rcvr):
     from rsqueakvm.error import Exit
+    interp.wait_for_snapshot()
     raise Exit('Quit-Primitive called')
 
 @expose_primitive(EXIT_TO_DEBUGGER, unwrap_spec=[object])
@@ -1153,10 +1216,8 @@ def func(interp, s_frame, argcount, w_method):
 def func(interp, s_frame, w_rcvr):
     if not isinstance(w_rcvr, model.W_CompiledMethod):
         raise PrimitiveFailedError()
-    w_class = w_rcvr.compiled_in()
-    if w_class:
-        w_class = assert_pointers(w_class)
-        w_class.as_class_get_shadow(interp.space).flush_method_caches()
+    # Method dictionaries already changed the class versions when the method
+    # was stored, a flush here would invalidate the whole class hierarchy
     return w_rcvr
 
 @objectmodel.specialize.arg(0)
@@ -1215,13 +1276,20 @@ def func(interp, s_frame, argument_count):
     raise PrimitiveFailedError
 
 @expose_primitive(LOW_SPACE_SEMAPHORE, unwrap_spec=[object, object])
-def func(interp, s_frame, w_receiver, i):
-    # dont know when the space runs out
+def func(interp, s_frame, w_receiver, w_semaphore):
+    space = interp.space
+    if not (w_semaphore.is_nil(space) or
+            w_semaphore.getclass(space).is_same_object(space.w_Semaphore)):
+        raise PrimitiveFailedError
+    interp.image.special_objects.atput0(space, constants.SO_LOW_SPACE_SEMAPHORE, w_semaphore)
     return w_receiver
 
 @expose_primitive(SIGNAL_AT_BYTES_LEFT, unwrap_spec=[object, int])
-def func(interp, s_frame, w_receiver, i):
-    # dont know when the space runs out
+def func(interp, s_frame, w_receiver, nbytes):
+    # only checked with a maximum heap size, see GcStatistics
+    if nbytes < 0:
+        raise PrimitiveFailedError
+    interp.gc_stats.low_space_threshold = nbytes
     return w_receiver
 
 @expose_primitive(DEFER_UPDATES, unwrap_spec=[object, bool])
@@ -1269,27 +1337,23 @@ def func(interp, s_frame, w_rcvr, w_new):
             raise PrimitiveFailedError()
     return w_rcvr
 
-def fake_bytes_left(interp):
-    from rsqueakvm.util.platform_calls import get_memory_usage
-    usage = get_memory_usage()
-    if usage < 0:
-        # there was an error getting the result
-        return interp.space.wrap_int(2**29)
-    else:
-        return interp.space.wrap_int(constants.MAXINT - usage)
-
 @expose_primitive(SPECIAL_OBJECTS_ARRAY, unwrap_spec=[object])
 def func(interp, s_frame, w_rcvr):
     return interp.image.special_objects
 
 @expose_primitive(INC_GC, unwrap_spec=[object])
-@expose_primitive(FULL_GC, unwrap_spec=[object])
 @jit.dont_look_inside
 def func(interp, s_frame, w_rcvr):
     # Squeak pops the arg and ignores it ... go figure
-    from rpython.rlib import rgc
-    rgc.collect()
-    return fake_bytes_left(interp)
+    interp.gc_stats.collect(False, interp.event_time_now())
+    return wrap_bytes(interp.space, interp.gc_stats.bytes_left())
+
+@expose_primitive(FULL_GC, unwrap_spec=[object])
+@jit.dont_look_inside
+def func(interp, s_frame, w_rcvr):
+    flush_forwarders(interp, s_frame)
+    interp.gc_stats.collect(True, interp.event_time_now())
+    return wrap_bytes(interp.space, interp.gc_stats.bytes_left())
 
 @expose_primitive(SET_INTERRUPT_KEY, unwrap_spec=[object, int])
 def func(interp, s_frame, w_rcvr, encoded_key):
@@ -1386,29 +1450,19 @@ SYSTEM_ATTRIBUTE = 149
 
 @expose_primitive(SOME_OBJECT, unwrap_spec=[object])
 def func(interp, s_frame, w_class):
-    match_w = get_instances_array(interp, s_frame, some_instance=True)
-    try:
-        return match_w[0]
-    except IndexError:
+    w_first = get_instances(interp, s_frame, some_instance=True).first()
+    if w_first is None:
         raise PrimitiveFailedError()
-
-def next_object(space, list_of_objects, w_obj):
-    retval = None
-    try:
-        idx = list_of_objects.index(w_obj)
-    except ValueError:
-        idx = -1
-    try:
-        retval = list_of_objects[idx + 1]
-    except IndexError:
-        return space.wrap_int(0)
-    return retval
+    return w_first
 
 @expose_primitive(NEXT_OBJECT, unwrap_spec=[object])
 def func(interp, s_frame, w_obj):
     # This primitive is used to iterate through all objects:
     # it returns the "next" instance after w_obj.
-    return next_object(interp.space, get_instances_array(interp, s_frame), w_obj)
+    w_next = get_instances(interp, s_frame).next_after(w_obj)
+    if w_next is None:
+        return interp.space.wrap_int(0)
+    return w_next
 
 @expose_primitive(BEEP, unwrap_spec=[object])
 def func(interp, s_frame, w_receiver):
@@ -1762,6 +1816,13 @@ def func(interp, s_frame, w_rcvr):
     s_frame.push(proc.my_list())  # leave my_list on stack as return value
     proc.suspend(s_frame)
 
+@expose_primitive(FLUSH_CACHE, unwrap_spec=[object])
+def func(interp, s_frame, w_rcvr):
+    # Lookups are versioned and method dictionaries update their caches when
+    # they are stored into, so this is only needed to drop references
+    interp.lookup_cache.flush()
+    return w_rcvr
+
 @expose_primitive(YIELD, unwrap_spec=[object], no_result=True, clean_stack=False)
 def func(interp, s_frame, w_rcvr):
     # we leave the rcvr on the stack, so it is there even if we resume another
@@ -1787,13 +1848,6 @@ def func(interp, s_frame, w_rcvr):
 def func(interp, s_frame, w_rcvr):
     return wrapper.CriticalSectionWrapper(interp.space, w_rcvr).test_and_set_owner(s_frame)
 
-@expose_primitive(FLUSH_CACHE, unwrap_spec=[object])
-def func(interp, s_frame, w_rcvr):
-    w_rcvr = assert_pointers(w_rcvr)
-    s_class = w_rcvr.as_class_get_shadow(interp.space)
-    s_class.flush_method_caches()
-    return w_rcvr
-
 def model_sizeof(model):
     return 4 # constant for interpretation
 
@@ -1976,14 +2030,10 @@ SET_FULL_SCREEN = 233
 
 @expose_primitive(IDLE_FOR_MICROSECONDS, unwrap_spec=[object, int], no_result=True, clean_stack=False)
 def func(interp, s_frame, w_rcvr, time_mu_s):
-    import time
     s_frame.pop()
-    time_s = time_mu_s / 1000000.0
-    interp.interrupt_check_counter = 0
-    interp.quick_check_for_interrupt(s_frame, dec=0)
-    time.sleep(time_s)
-    interp.interrupt_check_counter = 0
-    interp.quick_check_for_interrupt(s_frame, dec=0)
+    interp.force_interrupt_check(s_frame)
+    interp.idle(s_frame, time_mu_s)
+    interp.force_interrupt_check(s_frame)
 
 # @expose_primitive(FORCE_DISPLAY_UPDATE, unwrap_spec=[object])
 # def func(interp, s_frame, w_rcvr):
@@ -2005,6 +2055,66 @@ VM_PARAMETERS = 254
 META_PRIM_FAILED = 255 # Used to be INST_VARS_PUT_FROM_STACK. Never used except in Disney tests.  Remove after 2.3 release.
 VM_LOADED_MODULES = 573
 
+@expose_primitive(VM_CLEAR_PROFILE, unwrap_spec=[object])
+def func(interp, s_frame, w_rcvr):
+    interp.profiler.clear()
+    return w_rcvr
+
+@expose_primitive(VM_CONTROL_PROFILING, unwrap_spec=[object, bool])
+def func(interp, s_frame, w_rcvr, flag):
+    """Start or stop the sampling profiler. Answer the number of samples
+    taken so far."""
+    if flag:
+        interp.profiler.start()
+    else:
+        interp.profiler.stop()
+    return interp.space.wrap_int(interp.profiler.sample_count())
+
+@expose_primitive(VM_PROFILE_SAMPLES_INTO, unwrap_spec=[object, object])
+def func(interp, s_frame, w_rcvr, w_array):
+    """Copy the samples into an Array, two slots per sample: the
+    CompiledMethod that was active (or nil) and where the VM was at that
+    time (0 interpreting, 1 in jitted code, 2 in a primitive). Answer the
+    number of samples copied."""
+    if not isinstance(w_array, model.W_PointersObject):
+        raise PrimitiveFailedError
+    space = interp.space
+    profiler = interp.profiler
+    count = min(profiler.sample_count(), w_array.size() // 2)
+    for i in range(count):
+        w_method = profiler.methods_w[i]
+        if w_method is None:
+            w_method = space.w_nil
+        w_array.atput0(space, 2 * i, w_method)
+        w_array.atput0(space, 2 * i + 1, space.wrap_int(profiler.kinds[i]))
+    return space.wrap_int(count)
+
+@expose_primitive(VM_PROFILE_INFO_INTO, unwrap_spec=[object, object])
+def func(interp, s_frame, w_rcvr, w_array):
+    """Fill an Array with information about the profile, as far as it fits:
+        1   number of samples
+        2   samples taken while interpreting
+        3   samples taken in jitted code
+        4   samples taken in primitives
+        5   samples dropped because the buffer was full
+        6   sampling interval in microseconds
+        7   whether profiling is active
+    Answer the Array."""
+    if not isinstance(w_array, model.W_PointersObject):
+        raise PrimitiveFailedError
+    space = interp.space
+    profiler = interp.profiler
+    info_w = [space.wrap_int(profiler.sample_count()),
+              space.wrap_int(profiler.counts[0]),
+              space.wrap_int(profiler.counts[1]),
+              space.wrap_int(profiler.counts[2]),
+              space.wrap_int(profiler.dropped),
+              space.wrap_int(profiler.interval),
+              space.wrap_bool(profiler.is_active())]
+    for i in range(min(len(info_w), w_array.size())):
+        w_array.atput0(space, i, info_w[i])
+    return w_array
+
 @expose_primitive(META_PRIM_FAILED, unwrap_spec=[object, int])
 def func(interp, s_frame, w_rcvr, primFailFlag):
     if primFailFlag != 0:
@@ -2078,48 +2188,83 @@ def func(interp, s_frame, argcount):
             64  current number of machine code methods (read-only; Cog VMs only)
             65  true if the VM supports multiple bytecode sets;  (read-only; Cog VMs only; nil in older Cog VMs)
             66  the byte size of a stack page in the stack zone  (read-only; Cog VMs only)
-            67 - 69 reserved for more Cog-related info
+            67  number of global method lookup cache hits since startup (read-only; RSqueak only)
+            68  number of global method lookup cache misses since startup (read-only; RSqueak only)
+            69  reserved for more Cog-related info
             70  the value of VM_PROXY_MAJOR (the interpreterProxy major version number)
             71  the value of VM_PROXY_MINOR (the interpreterProxy minor version number)
+            72  memory used after the last garbage collection primitive (read-only; RSqueak only)
+            73  maximum heap size in bytes, 0 for no limit (read-write; RSqueak only).
+                The low space semaphore is only signalled with a limit, it is
+                compared with the memory used by the whole process.
 
         Note: Thanks to Ian Piumarta for this primitive."""
 
     if not 0 <= argcount <= 2:
         raise PrimitiveFailedError
 
-    arg1_w = s_frame.pop()  # receiver
-
-    vm_w_params = [interp.space.wrap_int(0)] * 71
-
-    vm_w_params[2] = interp.space.wrap_int(1)  # must be 1 for VM Stats view to work
-    vm_w_params[8] = interp.space.wrap_int(1)  # must be 1 for VM Stats view to work
-
-    vm_w_params[41] = interp.space.wrap_int(1)  # We are a "stack-like" VM - number of stack tables
-    vm_w_params[45] = interp.space.wrap_int(1)  # We are a "cog-like" VM - machine code zone size
-
-    vm_w_params[39] = interp.space.wrap_int(constants.BYTES_PER_WORD)
-    vm_w_params[40] = interp.space.wrap_int(interp.image.version.magic)
-    vm_w_params[55] = interp.space.wrap_int(interp.process_switch_count)
-    vm_w_params[57] = interp.space.wrap_int(interp.forced_interrupt_checks_count)
-    vm_w_params[59] = interp.space.wrap_int(interp.stack_overflow_count)
-    vm_w_params[69] = interp.space.wrap_int(constants.INTERP_PROXY_MAJOR)
-    vm_w_params[70] = interp.space.wrap_int(constants.INTERP_PROXY_MINOR)
+    space = interp.space
+    gc_stats = interp.gc_stats
+    vm_w_params = [space.wrap_int(0)] * 73
+
+    vm_w_params[0] = wrap_bytes(space, gc_stats.old_space_size())
+    vm_w_params[1] = wrap_bytes(space, gc_stats.nursery_size)
+    vm_w_params[2] = wrap_bytes(space, gc_stats.memory_usage())
+    vm_w_params[6] = space.wrap_int(gc_stats.full_gcs)
+    vm_w_params[7] = space.wrap_int(gc_stats.full_gc_usecs // 1000)
+    # must be at least 1 for VM Stats view to work
+    vm_w_params[8] = space.wrap_int(max(1, gc_stats.incremental_gcs))
+    vm_w_params[9] = space.wrap_int(gc_stats.incremental_gc_usecs // 1000)
+    vm_w_params[35] = space.wrap_int(gc_stats.last_gc_clock)
+    vm_w_params[37] = space.wrap_int(gc_stats.last_gc_usecs // 1000)
+
+    vm_w_params[41] = space.wrap_int(1)  # We are a "stack-like" VM - number of stack tables
+    vm_w_params[43] = wrap_bytes(space, gc_stats.nursery_size)
+    vm_w_params[44] = wrap_bytes(space, gc_stats.nursery_size)
+    vm_w_params[45] = space.wrap_int(1)  # We are a "cog-like" VM - machine code zone size
+
+    vm_w_params[39] = space.wrap_int(constants.BYTES_PER_WORD)
+    vm_w_params[40] = space.wrap_int(interp.image.version.magic)
+    vm_w_params[53] = wrap_bytes(space, gc_stats.bytes_left())
+    vm_w_params[55] = space.wrap_int(interp.process_switch_count)
+    vm_w_params[57] = space.wrap_int(interp.forced_interrupt_checks_count)
+    vm_w_params[59] = space.wrap_int(interp.stack_overflow_count)
+    vm_w_params[66] = space.wrap_int(interp.lookup_cache.hits)
+    vm_w_params[67] = space.wrap_int(interp.lookup_cache.misses)
+    vm_w_params[69] = space.wrap_int(constants.INTERP_PROXY_MAJOR)
+    vm_w_params[70] = space.wrap_int(constants.INTERP_PROXY_MINOR)
+    vm_w_params[71] = wrap_bytes(space, gc_stats.memory_after_gc)
+    vm_w_params[72] = wrap_bytes(space, gc_stats.max_heap_size)
 
     if argcount == 0:
-        return interp.space.wrap_list(vm_w_params)
+        s_frame.pop()  # receiver
+        return space.wrap_list(vm_w_params)
 
-    arg2_w = s_frame.pop()  # index (really the receiver, index has been removed above)
-    if not isinstance(arg1_w, model.W_SmallInteger):
+    w_index = s_frame.peek(argcount - 1)
+    if not isinstance(w_index, model.W_SmallInteger):
+        raise PrimitiveFailedError
+    index = w_index.value
+    if not 1 <= index <= len(vm_w_params):
         raise PrimitiveFailedError
+    w_old_value = vm_w_params[index - 1]
     if argcount == 1:
-        if not 0 <= arg1_w.value <= 70:
-            raise PrimitiveFailedError
-        return vm_w_params[arg1_w.value - 1]
+        s_frame.pop_n(2)  # index, receiver
+        return w_old_value
 
-    s_frame.pop()  # new value
-    if argcount == 2:
-        # return the 'old value'
-        return interp.space.wrap_int(0)
+    w_value = s_frame.peek(0)
+    if index == 73:
+        nbytes = space.unwrap_int(w_value)
+        if nbytes < 0:
+            raise PrimitiveFailedError
+        gc_stats.set_max_heap_size(nbytes)
+    # the other parameters cannot be changed, the GC reads its nursery size
+    # and thresholds from the environment at startup
+    s_frame.pop_n(3)  # value, index, receiver
+    return w_old_value
+
+def wrap_bytes(space, nbytes):
+    """Wrap a memory size, which may not fit into a SmallInteger."""
+    return space.wrap_int(min(max(0, nbytes), constants.MAXINT))
 
 # list the n-th loaded module
 @expose_primitive(VM_LOADED_MODULES, unwrap_spec=[int])
@@ -2,12 +2,17 @@ import os, time
 from rsqueakvm import constants, model, error, model_display, wrapper
 from rsqueakvm.util import stream, system
 from rsqueakvm.util.bitmanipulation import splitter
-from rpython.rlib import objectmodel
+from rpython.rlib import objectmodel, rmmap
+from rpython.rlib.rfloat import formatd
 from rpython.rlib.rarithmetic import r_ulonglong, intmask, r_uint, r_uint32, r_int64
 from rpython.rlib import jit
 
 # Access for module users
 Stream = stream.Stream
+MmapStream = stream.MmapStream
+WriteBuffer = stream.WriteBuffer
+
+HAS_FORK = hasattr(os, "fork")
 
 # ____________________________________________________________
 #
@@ -89,14 +94,102 @@ def set_reader_user_param(arg):
 set_reader_user_param("threshold=2,function_threshold=2,trace_eagerness=2,loop_longevity=100")
 
 
+def resident_memory():
+    """Resident set size of the VM in bytes, or -1 where it is not known."""
+    try:
+        fd = os.open("/proc/self/statm", os.O_RDONLY, 0)
+    except OSError:
+        return -1
+    try:
+        fields = os.read(fd, 256).split(" ")
+    finally:
+        os.close(fd)
+    if len(fields) < 2:
+        return -1
+    try:
+        return int(fields[1]) * rmmap.PAGESIZE
+    except ValueError:
+        return -1
+
+
+class PhaseTimer(object):
+    """Collects the wall clock time of each startup phase, if enabled. When
+    profiling, it also records the change in resident memory, the number of
+    objects each phase worked on and the kinds of objects that were loaded."""
+    _immutable_fields_ = ["enabled", "profile"]
+
+    def __init__(self, enabled=False, profile=False):
+        self.enabled = enabled or profile
+        self.profile = profile
+        self.phases = []
+        self.object_kinds = {}
+        self.strategies = {}
+        self.last = time.time()
+        self.last_memory = resident_memory() if profile else -1
+
+    def phase(self, name, objects=-1):
+        if not self.enabled:
+            return
+        now = time.time()
+        memory = resident_memory() if self.profile else -1
+        if memory >= 0 and self.last_memory >= 0:
+            memory_delta = memory - self.last_memory
+        else:
+            memory_delta = 0
+        self.phases.append((name, now - self.last, memory_delta, objects))
+        self.last = now
+        self.last_memory = memory
+
+    def count_objects(self, chunks):
+        if not self.profile:
+            return
+        for chunk in chunks:
+            w_object = chunk.g_object.w_object
+            if w_object is None:
+                continue
+            self.object_kinds[w_object.repr_classname] = \
+                self.object_kinds.get(w_object.repr_classname, 0) + 1
+            if isinstance(w_object, model.W_PointersObject) and w_object.has_strategy():
+                name = w_object._get_strategy().repr_classname
+                self.strategies[name] = self.strategies.get(name, 0) + 1
+
+    def report(self):
+        if not self.enabled:
+            return
+        total = 0.0
+        os.write(2, "Startup phases:\n")
+        for name, seconds, memory_delta, objects in self.phases:
+            total += seconds
+            line = "  %s: %s ms" % (name, formatd(seconds * 1000, 'f', 1))
+            if self.profile:
+                line += ", %d KB" % (memory_delta / 1024)
+                if objects >= 0:
+                    line += ", %d objects" % objects
+            os.write(2, line + "\n")
+        os.write(2, "  total: %s ms\n" % formatd(total * 1000, 'f', 1))
+        if self.profile:
+            os.write(2, "Loaded objects:\n")
+            for name, count in self.object_kinds.items():
+                os.write(2, "  %s: %d\n" % (name, count))
+            os.write(2, "Storage strategies:\n")
+            for name, count in self.strategies.items():
+                os.write(2, "  %s: %d\n" % (name, count))
+
+
 class ImageReader(object):
-    _immutable_fields_ = ["space", "stream", "readerStrategy"]
+    _immutable_fields_ = ["space", "stream", "readerStrategy", "lazy", "timer"]
 
-    def __init__(self, space, stream):
+    def __init__(self, space, stream, lazy=False, timer=None):
         self.space = space
         self.stream = stream
         self.version = None
         self.readerStrategy = None
+        # When lazy, object bodies are only decoded from the stream when they
+        # are needed and dropped again afterwards.
+        self.lazy = lazy
+        if timer is None:
+            timer = PhaseTimer()
+        self.timer = timer
 
     def create_image(self):
         self.read_all()
@@ -104,7 +197,12 @@ class ImageReader(object):
 
     def read_all(self):
         self.read_header()
-        self.readerStrategy.read_and_initialize()
+        self.timer.phase("read header")
+        try:
+            self.readerStrategy.read_and_initialize()
+        finally:
+            self.stream.close()
+        self.timer.count_objects(self.chunklist)
 
     def try_read_version(self):
         magic1 = self.stream.next()
@@ -178,13 +276,18 @@ class ImageReader(object):
         return self.readerStrategy.decode_pointers(g_object, space, end)
 
 class BaseReaderStrategy(object):
-    _immutable_fields_ = ["imageReader", "version", "stream", "space", "chunks", "chunklist"]
+    _immutable_fields_ = ["imageReader", "version", "stream", "space", "chunks", "chunklist", "lazy", "timer"]
 
     def __init__(self, imageReader, version, stream, space):
         self.imageReader = imageReader
         self.version = version
         self.stream = stream
         self.space = space
+        self.lazy = imageReader is not None and imageReader.lazy
+        if imageReader is not None:
+            self.timer = imageReader.timer
+        else:
+            self.timer = PhaseTimer()
         self.chunks = {} # Dictionary mapping old address to chunk object
         self.chunklist = [] # Flat list of all read chunks
         self.intcache = {} # Cached instances of SmallInteger
@@ -215,14 +318,26 @@ class BaseReaderStrategy(object):
         self.stream.skipbytes(self.headersize - self.stream.pos)
 
     def read_and_initialize(self):
+        # The phases run one after the other. The VM is translated without
+        # thread support, and even with it RPython threads share the heap but
+        # run one at a time under the GIL, so decoding chunks on several
+        # threads would not overlap. Measure with --reader-timings instead;
+        # with --mmap-image the bodies are decoded from the mapped file on
+        # demand, which mostly moves work from read body to the later phases.
         self.read_body()
+        self.timer.phase("read body", len(self.chunks))
         # All chunks are read, now convert them to real objects.
         self.init_g_objects()
+        self.timer.phase("init g objects", len(self.chunks))
         self.assign_prebuilt_constants()
         self.init_w_objects()
+        self.timer.phase("init w objects", len(self.chunks))
         self.fillin_w_objects()
+        self.timer.phase("fillin w objects", self.filledin_objects)
         self.populate_special_objects()
+        self.timer.phase("populate special objects")
         self.fillin_weak_w_objects()
+        self.timer.phase("fillin weak w objects", self.filledin_weakobjects)
 
     def read_body(self):
         raise NotImplementedError("subclass must override this")
@@ -240,7 +355,10 @@ class BaseReaderStrategy(object):
 
     def init_g_object(self, chunk):
         init_g_objects_driver.jit_merge_point(self=self, chunk=chunk)
-        chunk.as_g_object(jit.promote(self), self.space)  # initialize g_object
+        g_object = chunk.as_g_object(jit.promote(self), self.space)  # initialize g_object
+        if self.lazy and self.ispointers(g_object):
+            # the pointers are decoded, other bodies are still needed in fillin
+            chunk.release_data()
 
     def assign_prebuilt_constants(self):
         # Assign classes and objects that in special objects array that are already created.
@@ -292,6 +410,8 @@ class BaseReaderStrategy(object):
     def fillin_w_object(self, chunk):
         fillin_w_objects_driver.jit_merge_point(self=self, chunk=chunk)
         chunk.g_object.fillin(self.space)
+        if self.lazy:
+            chunk.release_data()
 
     def fillin_weak_w_objects(self):
         for chunk in self.chunks.itervalues():
@@ -310,22 +430,22 @@ class BaseReaderStrategy(object):
         self.log_progress(self.filledin_weakobjects * 100, '*')
 
     def len_bytes_of(self, chunk):
-        return len(chunk.data) * 4
+        return chunk.data_size() * 4
 
     def get_bytes_of(self, chunk):
-        bytes = []
+        data = chunk.get_data()
+        bytes = ['\x00'] * (len(data) * 4)
         if self.version.is_big_endian:
-            for each in chunk.data:
-                bytes.append(chr((each >> 24) & 0xff))
-                bytes.append(chr((each >> 16) & 0xff))
-                bytes.append(chr((each >> 8) & 0xff))
-                bytes.append(chr((each >> 0) & 0xff))
+            shifts = (24, 16, 8, 0)
         else:
-            for each in chunk.data:
-                bytes.append(chr((each >> 0) & 0xff))
-                bytes.append(chr((each >> 8) & 0xff))
-                bytes.append(chr((each >> 16) & 0xff))
-                bytes.append(chr((each >> 24) & 0xff))
+            shifts = (0, 8, 16, 24)
+        i = 0
+        for each in data:
+            bytes[i] = chr((each >> shifts[0]) & 0xff)
+            bytes[i + 1] = chr((each >> shifts[1]) & 0xff)
+            bytes[i + 2] = chr((each >> shifts[2]) & 0xff)
+            bytes[i + 3] = chr((each >> shifts[3]) & 0xff)
+            i += 4
         return bytes
 
     def isfloat(self, g_object):
@@ -340,7 +460,6 @@ class NonSpurReader(BaseReaderStrategy):
             self.log_progress(len(self.chunklist), '#')
             self.chunklist.append(chunk)
             self.chunks[pos + self.oldbaseaddress] = chunk
-        self.stream.close()
         return self.chunklist # return for testing
 
     def init_g_objects(self):
@@ -358,8 +477,13 @@ class NonSpurReader(BaseReaderStrategy):
         else: # 10 bits
             raise error.CorruptImageError("Unused block not allowed in image")
         size = intmask(chunk.size)
-        chunk.data = [self.stream.next()
-                     for _ in range(size - 1)] #size-1, excluding header
+        if self.lazy:
+            chunk.set_lazy_data(self.stream, self.stream.pos, size - 1)
+            if size > 1:
+                self.stream.skipbytes((size - 1) * self.stream.word_size)
+        else:
+            chunk.data = [self.stream.next()
+                         for _ in range(size - 1)] #size-1, excluding header
         return chunk, pos
 
     def read_1wordobjectheader(self):
@@ -390,10 +514,10 @@ class NonSpurReader(BaseReaderStrategy):
         assert special.size > 24 #at least
         assert special.format == 2
         # squeak-specific: compact classes array
-        chunk = self.chunks[special.data[COMPACT_CLASSES_ARRAY]]
-        assert len(chunk.data) == 31
+        chunk = self.chunks[special.get_data()[COMPACT_CLASSES_ARRAY]]
+        assert chunk.data_size() == 31
         assert chunk.format == 2
-        self.compactclasses = [self.chunks[pointer] for pointer in chunk.data]
+        self.compactclasses = [self.chunks[pointer] for pointer in chunk.get_data()]
 
     def g_class_of(self, chunk):
         if chunk.iscompact():
@@ -406,11 +530,12 @@ class NonSpurReader(BaseReaderStrategy):
         return self.chunks[pointer]
 
     def decode_pointers(self, g_object, space, end=-1):
+        data = g_object.chunk.get_data()
         if end == -1:
-            end = len(g_object.chunk.data)
+            end = len(data)
         pointers = []
         for i in range(end):
-            pointer = g_object.chunk.data[i]
+            pointer = data[i]
             if (pointer & 1) == 1:
                 # pointer = ...1
                 # tagged integer
@@ -557,7 +682,6 @@ class SpurReader(BaseReaderStrategy):
                 break
             segmentEnd = segmentEnd + nextSegmentSize
             currentAddressSwizzle += bridgeSpan
-        self.stream.close()
         return self.chunklist # return for testing
 
     def read_object(self):
@@ -579,6 +703,10 @@ class SpurReader(BaseReaderStrategy):
         chunk = ImageChunk(size, format, classid, hash)
         # the minimum object length is 16 bytes, i.e. 8 header + 8 payload
         # (to accommodate a forwarding ptr)
+        if self.lazy:
+            chunk.set_lazy_data(self.stream, self.stream.pos, intmask(size))
+            self.stream.skipbytes(self.words_for(size) * self.stream.word_size)
+            return chunk, pos
         chunk.data = [self.stream.next() for _ in range(self.words_for(size))]
         if len(chunk.data) != size:
             # remove trailing alignment slots
@@ -602,8 +730,8 @@ class SpurReader(BaseReaderStrategy):
         minor_class_index = self.minor_class_index_of(chunk.classid)
         HIDDEN_ROOTS_CHUNK = 4 # after nil, true, false, freeList
         hiddenRoots = self.chunklist[HIDDEN_ROOTS_CHUNK]
-        classTablePage = self.chunks[hiddenRoots.data[major_class_index]]
-        return self.chunks[classTablePage.data[minor_class_index]].g_object
+        classTablePage = self.chunks[hiddenRoots.get_pinned_data()[major_class_index]]
+        return self.chunks[classTablePage.get_pinned_data()[minor_class_index]].g_object
 
     def major_class_index_of(self, classid):
         return classid >> 10
@@ -619,11 +747,12 @@ class SpurReader(BaseReaderStrategy):
         return self.chunks[pointer]
 
     def decode_pointers(self, g_object, space, end=-1):
+        data = g_object.chunk.get_data()
         if end == -1:
-            end = len(g_object.chunk.data)
+            end = len(data)
         pointers = []
         for i in range(end):
-            pointer = g_object.chunk.data[i]
+            pointer = data[i]
             if (pointer & 3) == 0:
                 # pointer = ...00
                 pointers.append(self.chunk(pointer).g_object)
@@ -820,7 +949,7 @@ class GenericObject(object):
             self.pointers = self.reader.decode_pointers(self, space)
             assert None not in self.pointers
         elif self.reader.iscompiledmethod(self):
-            header = self.chunk.data[0] >> 1 # untag tagged int
+            header = self.chunk.get_data()[0] >> 1 # untag tagged int
             literalsize = self.reader.literal_count_of_method_header(header)
             self.pointers = self.reader.decode_pointers(self, space, literalsize + 1)  # adjust +1 for the header
 
@@ -844,7 +973,7 @@ class GenericObject(object):
 
     def get_ruints(self, required_len=-1):
         from rpython.rlib.rarithmetic import r_uint32, r_uint
-        words = [r_uint(r_uint32(x)) for x in self.chunk.data]
+        words = [r_uint(r_uint32(x)) for x in self.chunk.get_data()]
         if required_len != -1 and len(words) != required_len:
             raise error.CorruptImageError("Expected %d words, got %d" % (required_len, len(words)))
         return words
@@ -879,7 +1008,7 @@ class GenericObject(object):
     def as_string(self):
         """NOT RPYTHON"""
         return "".join([chr(c) for bytes in
-            [splitter[8,8,8,8](w) for w in self.chunk.data]
+            [splitter[8,8,8,8](w) for w in self.chunk.get_data()]
             for c in bytes if c != 0])
 
     def classname(self):
@@ -897,6 +1026,12 @@ class ImageChunk(object):
         self.hash = hash
         # list of integers forming the body of the object
         self.data = data
+        # where to decode the body from, if it is read lazily
+        self.stream = None
+        self.data_pos = 0
+        self.data_words = 0
+        # whether a lazily read body is kept, because loading looks it up often
+        self.pinned = False
         self.g_object = GenericObject()
 
     def __repr__(self):
@@ -916,6 +1051,33 @@ class ImageChunk(object):
         "(for testing)"
         return not self == other
 
+    def set_lazy_data(self, stream, pos, words):
+        self.stream = stream
+        self.data_pos = pos
+        self.data_words = words
+        self.data = None
+
+    def get_data(self):
+        if self.data is None:
+            assert self.stream is not None
+            self.data = self.stream.words_at(self.data_pos, self.data_words)
+        return self.data
+
+    def get_pinned_data(self):
+        self.pinned = True
+        return self.get_data()
+
+    def data_size(self):
+        if self.data is None:
+            return self.data_words
+        return len(self.data)
+
+    def release_data(self):
+        # Lazily read bodies can be decoded again, so free them once they
+        # are not needed for loading anymore.
+        if self.stream is not None and not self.pinned:
+            self.data = None
+
     def as_g_object(self, reader, space):
         if not self.g_object.isinitialized():
             self.g_object.initialize(self, reader, space)
@@ -932,10 +1094,12 @@ class SpurImageWriter(object):
     word_size = 4
 
     def __init__(self, interp, filename):
-        from rpython.rlib import streamio, objectmodel
         self.space = interp.space
         self.image = interp.image
-        self.f = streamio.open_file_as_stream(filename, mode="wb")
+        self.filename = filename
+        # The image is assembled in memory, the file is written in one go
+        # once tracing is finished.
+        self.f = WriteBuffer()
         self.next_chunk = self.image_header_size
         self.oop_map = {}
         self.trace_queue = []
@@ -1017,10 +1181,29 @@ class SpurImageWriter(object):
             self.trace_until_finish()
             self.write_last_bridge()
             self.write_file_header()
+            self.f.write_to(self.filename)
         finally:
-            self.f.close()
             active_process.store_suspended_context(self.space.w_nil)
 
+    def trace_image_in_background(self, interp, s_frame):
+        """Write the image from a forked child process. The child gets a
+        copy-on-write copy of the whole heap, which is consistent for as long
+        as the child needs to trace and write it, so the interpreter can go on
+        right away. Where fork is not available, this writes synchronously."""
+        if not HAS_FORK:
+            return self.trace_image(s_frame)
+        # Only one snapshot at a time, the next one writes the same file
+        interp.wait_for_snapshot()
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                self.trace_image(s_frame)
+            except Exception:
+                status = 1
+            os._exit(status)
+        interp.snapshot_pid = pid
+
     @jit.dont_look_inside
     def trace_until_finish(self):
         while True:
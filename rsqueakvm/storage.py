@@ -70,6 +70,33 @@ class AbstractStrategy(object):
         raise NotImplementedError("This strategy doesn't handle become.")
     def getclass(self):
         return self.w_class
+    def forwarded_object(self):
+        """Only the ForwardingStrategy answers the target of a lazy become."""
+        return None
+    def copy_range_from(self, w_self, start, end, w_source, source_start):
+        """Copy the slots of w_source starting at source_start into the slots
+        start...end-1 of w_self, front to back. This generic version stores
+        element by element and hands over to the new strategy as soon as a
+        store has generalized the storage of w_self."""
+        offset = source_start - start
+        i = start
+        while i < end:
+            self.store(w_self, i, w_source.fetch(self.space, offset + i))
+            i += 1
+            new_strategy = w_self._get_strategy()
+            if new_strategy is not self:
+                new_strategy.copy_range_from(w_self, i, end, w_source, offset + i)
+                return
+    def fill_range(self, w_self, start, end, w_value):
+        """Store w_value into the slots start...end-1 of w_self."""
+        i = start
+        while i < end:
+            self.store(w_self, i, w_value)
+            i += 1
+            new_strategy = w_self._get_strategy()
+            if new_strategy is not self:
+                new_strategy.fill_range(w_self, i, end, w_value)
+                return
     def instantiate(self, w_self, w_class):
         if self._is_singleton:
             new_strategy = self.strategy_factory().strategy_singleton_instance(self.instantiate_type, w_class)
@@ -83,6 +110,37 @@ class AbstractStrategy(object):
 
 # ========== Storage classes implementing storage strategies ==========
 
+class BulkCopyMixin(object):
+    """
+    Bulk operations for singleton strategies with a storage list. When source
+    and destination use the same strategy, the unwrapped storage is copied
+    directly, without boxing every element on the way.
+    Shadows inherit this through ListStrategy, but always use the generic path,
+    because they need to see every store.
+    """
+    def copy_range_from(self, w_self, start, end, w_source, source_start):
+        if self._is_singleton and w_source._get_strategy().__class__ is self.__class__:
+            storage = self.get_storage(w_self)
+            source_storage = self.get_storage(w_source)
+            offset = source_start - start
+            i = start
+            while i < end:
+                storage[i] = source_storage[offset + i]
+                i += 1
+        else:
+            AbstractStrategy.copy_range_from(self, w_self, start, end, w_source, source_start)
+
+    def fill_range(self, w_self, start, end, w_value):
+        if self._is_singleton and self._check_can_handle(w_value):
+            value = self._unwrap(w_value)
+            storage = self.get_storage(w_self)
+            i = start
+            while i < end:
+                storage[i] = value
+                i += 1
+        else:
+            AbstractStrategy.fill_range(self, w_self, start, end, w_value)
+
 class SimpleStorageStrategy(AbstractStrategy):
     """
     Singleton strategies handle 'simple' object storage in normal objects, without
@@ -102,6 +160,7 @@ class ListStrategy(SimpleStorageStrategy):
     repr_classname = "ListStrategy"
 
     import_from_mixin(rstrat.GenericStrategy)
+    import_from_mixin(BulkCopyMixin)
 ListStrategy.instantiate_type = ListStrategy
 
 class ListEntry(object):
@@ -200,6 +259,7 @@ WeakListStrategy.instantiate_type = WeakListStrategy
 class SmallIntegerOrNilStrategy(SimpleStorageStrategy):
     repr_classname = "SmallIntegerOrNilStrategy"
     import_from_mixin(rstrat.TaggingStrategy)
+    import_from_mixin(BulkCopyMixin)
     contained_type = model.W_SmallInteger
     def wrap(self, val): return self.space.wrap_int(val)
     def unwrap(self, w_val): return self.space.unwrap_int(w_val)
@@ -211,6 +271,7 @@ SmallIntegerOrNilStrategy.instantiate_type = SmallIntegerOrNilStrategy
 class CharacterOrNilStrategy(SimpleStorageStrategy):
     repr_classname = "CharacterOrNilStrategy"
     import_from_mixin(rstrat.TaggingStrategy)
+    import_from_mixin(BulkCopyMixin)
     contained_type = model.W_Character
     def wrap(self, val): return model.W_Character(val)
     def unwrap(self, w_val):
@@ -225,6 +286,7 @@ CharacterOrNilStrategy.instantiate_type = CharacterOrNilStrategy
 class FloatOrNilStrategy(SimpleStorageStrategy):
     repr_classname = "FloatOrNilStrategy"
     import_from_mixin(rstrat.TaggingStrategy)
+    import_from_mixin(BulkCopyMixin)
     contained_type = model.W_Float
     tag_float = sys.float_info.max
     def wrap(self, val): return self.space.wrap_float(val)
@@ -241,6 +303,14 @@ class AllNilStrategy(SimpleStorageStrategy):
     repr_classname = "AllNilStrategy"
     import_from_mixin(rstrat.SingleValueStrategy)
     def value(self): return self.space.w_nil
+    def copy_range_from(self, w_self, start, end, w_source, source_start):
+        if isinstance(w_source._get_strategy(), AllNilStrategy):
+            return # Nothing to do, both are all nil.
+        AbstractStrategy.copy_range_from(self, w_self, start, end, w_source, source_start)
+    def fill_range(self, w_self, start, end, w_value):
+        if w_value is self.value():
+            return
+        AbstractStrategy.fill_range(self, w_self, start, end, w_value)
 AllNilStrategy.instantiate_type = AllNilStrategy
 
 class StrategyFactory(rstrat.StrategyFactory):
@@ -342,6 +412,40 @@ class StrategyFactory(rstrat.StrategyFactory):
 
 # ========== Other storage classes, non-strategies ==========
 
+class ForwardingStrategy(AbstractStrategy):
+    """
+    The strategy of an object that was the source of a lazy one-way become.
+    All accesses are handed on to the target of the become, so references that
+    were not yet updated see the target's class and slots. The forwarded objects
+    are replaced by their targets during the next full heap walk (see the
+    ARRAY_BECOME_ONE_WAY primitive), after which nothing should reference them.
+    """
+    _attrs_ = ['w_target']
+    _immutable_fields_ = ['w_target']
+    repr_classname = "ForwardingStrategy"
+
+    def __init__(self, space, w_target):
+        AbstractStrategy.__init__(self, space, None, 0, None)
+        self.w_target = w_target
+    def forwarded_object(self):
+        return self.w_target
+    def getclass(self):
+        return self.w_target.getclass(self.space)
+    def fetch(self, w_self, n0):
+        return self.w_target.fetch(self.space, n0)
+    def store(self, w_self, n0, w_value):
+        self.w_target.store(self.space, n0, w_value)
+    def size(self, w_self):
+        return self.w_target.size()
+    def copy_range_from(self, w_self, start, end, w_source, source_start):
+        w_target = self.w_target
+        w_target._get_strategy().copy_range_from(w_target, start, end, w_source, source_start)
+    def fill_range(self, w_self, start, end, w_value):
+        w_target = self.w_target
+        w_target._get_strategy().fill_range(w_target, start, end, w_value)
+    def promote_if_neccessary(self):
+        return self
+
 class ShadowMixin(object):
     """
     Shadows are non-singleton strategies. They maintain a backpointer to their shadowed
@@ -429,7 +533,7 @@ class ObserveeShadow(AbstractGenericShadow):
     def store(self, w_self, n0, w_value):
         AbstractGenericShadow.store(self, w_self, n0, w_value)
         if self.observer:
-            self.observer.notify()
+            self.observer.notify(n0)
 
     def set_observer(self, observer):
         if self.observer is not None and observer is not self.observer:
@@ -1,8 +1,8 @@
 
 from rsqueakvm import model, constants, error
 from rsqueakvm.storage import AbstractCachingShadow, AbstractGenericShadow
-from rsqueakvm.util.version import constant_for_version, constant_for_version_arg, Version
-from rpython.rlib import jit
+from rsqueakvm.util.version import constant_for_version, Version
+from rpython.rlib import jit, objectmodel
 
 POINTERS = 0
 BYTES = 1
@@ -22,15 +22,20 @@ class ClassShadow(AbstractCachingShadow):
     """
 
     _attrs_ = ["name", "_instance_size", "instance_varsized", "instance_kind",
-                "_s_methoddict", "_s_superclass", "subclass_s"]
+                "_s_methoddict", "_s_superclass", "subclass_s",
+                "lookup_dependencies", "last_selector_change",
+                "class_invalidations", "selector_invalidations"]
 
     name = '??? (incomplete class info)'
     _s_superclass = _s_methoddict = None
+    last_selector_change = None
+    class_invalidations = selector_invalidations = 0
     provides_getname = True
     repr_classname = "ClassShadow"
 
     def __init__(self, space, w_self, size, w_class):
         self.subclass_s = {}
+        self.lookup_dependencies = {}
         AbstractCachingShadow.__init__(self, space, w_self, size, w_class)
 
     def store(self, w_self, n0, w_val):
@@ -203,13 +208,6 @@ class ClassShadow(AbstractCachingShadow):
             self.name = None
         self.changed()
 
-    @jit.unroll_safe
-    def flush_method_caches(self):
-        look_in_shadow = self
-        while look_in_shadow is not None:
-            look_in_shadow.s_methoddict().flush_method_cache()
-            look_in_shadow = look_in_shadow._s_superclass
-
     def new(self, extrasize=0):
         w_cls = self.w_self()
         instance_kind = self.get_instance_kind()
@@ -278,26 +276,68 @@ class ClassShadow(AbstractCachingShadow):
     # _______________________________________________________________
     # Other Methods
 
-    @constant_for_version_arg
     def lookup(self, w_selector):
+        jit.promote(self)
+        if self.space.defer_method_changes.is_set():
+            # the versions are not changed until the batch ends, see
+            # ObjSpace.begin_method_changes
+            return self.find_method(w_selector)
+        dependency = self.lookup_dependency(w_selector)
+        return self._lookup(w_selector, dependency.version)
+
+    @jit.elidable_promote()
+    def lookup_dependency(self, w_selector):
+        # Only ever adds entries, so the answer for a selector never changes
+        dependency = self.lookup_dependencies.get(w_selector, None)
+        if dependency is None:
+            dependency = LookupDependency()
+            self.lookup_dependencies[w_selector] = dependency
+        return dependency
+
+    @jit.elidable_promote()
+    def _lookup(self, w_selector, version):
+        return self.find_method(w_selector)
+
+    def find_method(self, w_selector):
         look_in_shadow = self
         while look_in_shadow is not None:
-            w_method = look_in_shadow.s_methoddict().find_selector(w_selector)
-            if w_method is not None:
-                return w_method
+            s_methoddict = look_in_shadow.s_methoddict()
+            if s_methoddict is not None:
+                w_method = s_methoddict.find_selector(w_selector)
+                if w_method is not None:
+                    return w_method
             look_in_shadow = look_in_shadow._s_superclass
         return None
 
     def changed(self):
+        self.class_invalidations += 1
         self.superclass_changed(Version())
 
     # this is done, because the class-hierarchy contains cycles
     def superclass_changed(self, version):
         if self.version is not version:
             self.version = version
+            for dependency in self.lookup_dependencies.itervalues():
+                dependency.version = version
             for s_class in self.subclass_s:
                 s_class.superclass_changed(version)
 
+    def selector_changed(self, w_selector):
+        """The method for w_selector in our method dictionary changed. Only
+        lookups of that selector in this class and its subclasses are
+        invalidated, the class versions stay the same."""
+        self.selector_invalidations += 1
+        self.superclass_selector_changed(w_selector, Version())
+
+    def superclass_selector_changed(self, w_selector, version):
+        if self.last_selector_change is not version:
+            self.last_selector_change = version
+            dependency = self.lookup_dependencies.get(w_selector, None)
+            if dependency is not None:
+                dependency.version = version
+            for s_class in self.subclass_s:
+                s_class.superclass_selector_changed(w_selector, version)
+
     # _______________________________________________________________
     # Methods used only in testing
 
@@ -325,17 +365,188 @@ class ClassShadow(AbstractCachingShadow):
         self.s_methoddict().methoddict[w_selector] = w_method
         if isinstance(w_method, model.W_CompiledMethod):
             w_method.compiledin_class = self.w_self()
+        self.selector_changed(w_selector)
 ClassShadow.instantiate_type = ClassShadow
 
 
+class LookupDependency(object):
+    """The version of the lookup of one selector in one class. It changes
+    whenever the class or one of its superclasses changes, or when the method
+    for the selector changes in one of their method dictionaries."""
+    _attrs_ = ["version"]
+    _immutable_fields_ = ["version?"]
+
+    def __init__(self):
+        self.version = Version()
+
+
+class MethodLookupCache(object):
+    """A fixed-size global cache in front of ClassShadow.lookup, hashed on the
+    identities of the class shadow and the selector. Each entry remembers the
+    LookupDependency of the class and selector, and its version when the
+    entry was filled. Since changes to classes and method dictionaries give
+    the affected dependencies a new version, stale entries simply stop
+    matching and no explicit flushing is needed.
+    This is only for the interpreter, in traces the lookup is constant-folded.
+    """
+    _attrs_ = ["mask", "classes_s", "selectors_w", "dependencies", "versions",
+               "methods_w", "hits", "misses"]
+    _immutable_fields_ = ["mask", "classes_s", "selectors_w", "dependencies",
+                          "versions", "methods_w"]
+
+    def __init__(self, size=constants.METHOD_CACHE_SIZE):
+        assert size > 0 and size & (size - 1) == 0, "size must be a power of 2"
+        self.mask = size - 1
+        self.classes_s = [None] * size
+        self.selectors_w = [None] * size
+        self.dependencies = [None] * size
+        self.versions = [None] * size
+        self.methods_w = [None] * size
+        self.hits = 0
+        self.misses = 0
+
+    def index_for(self, s_class, w_selector):
+        return (objectmodel.compute_identity_hash(s_class) ^
+                objectmodel.compute_identity_hash(w_selector)) & self.mask
+
+    @jit.dont_look_inside
+    def lookup(self, s_class, w_selector):
+        index = self.index_for(s_class, w_selector)
+        if (self.classes_s[index] is s_class and
+                self.selectors_w[index] is w_selector and
+                self.versions[index] is self.dependencies[index].version):
+            self.hits += 1
+            return self.methods_w[index]
+        self.misses += 1
+        dependency = s_class.lookup_dependency(w_selector)
+        version = dependency.version
+        w_method = s_class.lookup(w_selector)
+        # also cache failed lookups, they are valid for this version, too
+        self.classes_s[index] = s_class
+        self.selectors_w[index] = w_selector
+        self.dependencies[index] = dependency
+        self.versions[index] = version
+        self.methods_w[index] = w_method
+        return w_method
+
+    def flush(self):
+        for i in range(self.mask + 1):
+            self.classes_s[i] = None
+            self.selectors_w[i] = None
+            self.dependencies[i] = None
+            self.versions[i] = None
+            self.methods_w[i] = None
+
+
+class InlineCacheEntry(object):
+    _attrs_ = ["s_class", "dependency", "version", "w_method", "next"]
+    _immutable_fields_ = ["s_class", "dependency", "version", "w_method", "next"]
+
+    def __init__(self, s_class, dependency, version, w_method, next):
+        self.s_class = s_class
+        self.dependency = dependency
+        self.version = version
+        self.w_method = w_method
+        self.next = next
+
+
+class InlineCache(object):
+    """A polymorphic inline cache for a single send site of a CompiledMethod.
+    It starts out monomorphic, grows a chain of immutable entries for up to
+    INLINE_CACHE_SIZE receiver classes, and then turns megamorphic and only
+    delegates to the global lookup, until INLINE_CACHE_RETRY interpreted sends
+    later it starts over. The chain and the megamorphic flag are
+    quasi-immutable, so traces fold the probe for the (promoted) receiver
+    class into a constant and are only invalidated when the site changes.
+    Only the interpreter fills the cache, traces never write to it.
+    """
+    _attrs_ = ["w_selector", "first", "size", "megamorphic", "retry_countdown"]
+    _immutable_fields_ = ["w_selector", "first?", "megamorphic?"]
+
+    def __init__(self, w_selector):
+        self.w_selector = w_selector
+        self.first = None
+        self.size = 0
+        self.megamorphic = False
+        self.retry_countdown = 0
+
+    @jit.unroll_safe
+    def lookup(self, s_class, w_selector, lookup_cache):
+        if w_selector is not self.w_selector:
+            return self.global_lookup(s_class, w_selector, lookup_cache)
+        if self.megamorphic:
+            if not jit.we_are_jitted():
+                self.count_megamorphic_send()
+            return self.global_lookup(s_class, w_selector, lookup_cache)
+        s_class = jit.promote(s_class)
+        entry = self.first
+        while entry is not None:
+            if entry.s_class is s_class:
+                if entry.version is entry.dependency.version:
+                    return entry.w_method
+                break
+            entry = entry.next
+        if jit.we_are_jitted():
+            return self.global_lookup(s_class, w_selector, lookup_cache)
+        dependency = s_class.lookup_dependency(w_selector)
+        version = dependency.version
+        w_method = self.global_lookup(s_class, w_selector, lookup_cache)
+        self.add_entry(s_class, dependency, version, w_method)
+        return w_method
+
+    def count_megamorphic_send(self):
+        # The receivers may have settled down since the site overflowed, so
+        # every now and then give the chain another chance.
+        self.retry_countdown -= 1
+        if self.retry_countdown <= 0:
+            self.megamorphic = False
+
+    def global_lookup(self, s_class, w_selector, lookup_cache):
+        if jit.we_are_jitted():
+            return s_class.lookup(w_selector)
+        else:
+            return lookup_cache.lookup(s_class, w_selector)
+
+    @jit.dont_look_inside
+    def add_entry(self, s_class, dependency, version, w_method):
+        # Entries are immutable, so rebuild the chain without a stale entry
+        # for s_class and prepend the new one.
+        first = None
+        size = 0
+        entry = self.first
+        while entry is not None:
+            if entry.s_class is not s_class:
+                first = InlineCacheEntry(entry.s_class, entry.dependency,
+                                         entry.version, entry.w_method, first)
+                size += 1
+            entry = entry.next
+        if size >= constants.INLINE_CACHE_SIZE:
+            self.megamorphic = True
+            self.retry_countdown = constants.INLINE_CACHE_RETRY
+            self.first = None
+            self.size = 0
+        else:
+            self.first = InlineCacheEntry(s_class, dependency, version,
+                                          w_method, first)
+            self.size = size + 1
+
+
 class MethodDictionaryShadow(AbstractGenericShadow):
+    """Caches the selector -> method mapping of a MethodDictionary.
+
+    Stores into the selector slots or the values array only update the
+    selector in that slot, and only lookups of selectors whose method actually
+    changed are invalidated. A selector whose method is still nil is not in
+    the cache: Squeak stores the key first and the method afterwards, so
+    adding a method invalidates its lookups only once."""
     _immutable_fields_ = ['s_class']
-    _attrs_ = ['methoddict', 's_class']
+    _attrs_ = ['methoddict', 'selector_slots', 's_class']
     repr_classname = "MethodDictionaryShadow"
 
     def __init__(self, space, w_self, size, w_class):
         self.s_class = None
         self.methoddict = {}
+        self.selector_slots = {}
         AbstractGenericShadow.__init__(self, space, w_self, size, w_class)
 
     def become(self, w_other):
@@ -349,26 +560,26 @@ class MethodDictionaryShadow(AbstractGenericShadow):
         if self.s_class: self.s_class.store_s_methoddict(self)
         if s_other.s_class: s_other.s_class.store_s_methoddict(s_other)
 
-    def notify(self):
-        self.sync_method_cache()
+    def notify(self, n0):
+        # a method was stored into our values array
+        self.update_method(n0)
 
     def find_selector(self, w_selector):
         return self.methoddict.get(w_selector, None)
 
-    # We do not call notify() after changes to ourselves:
-    # Whenever a method is added, it's keyword is added to w_self, then the
-    # w_compiled_method is added to our observee.
-    # sync_method_cache at this point would not have the desired effect, because in
-    # the Smalltalk Implementation, the dictionary changes first. Afterwards
-    # its contents array is filled with the value belonging to the new key.
     def store(self, w_self, n0, w_value):
+        w_old_selector = None
+        if n0 >= constants.METHODDICT_NAMES_INDEX:
+            w_old_selector = self.own_fetch(n0)
         AbstractGenericShadow.store(self, w_self, n0, w_value)
         if n0 == constants.METHODDICT_VALUES_INDEX:
             self.setup_notification()
-        if n0 >= constants.METHODDICT_NAMES_INDEX:
-            # the caller / user cannot be expected to add the compiledMethod to the observee next (as indicated above)
-            # in case of clone / copyFrom the compiledMethod is already contained, so a sync is necessary here too
             self.sync_method_cache()
+        elif w_old_selector is not None:
+            # in case of clone / copyFrom the compiledMethod is already
+            # contained, so the method has to be looked up here, too
+            self.update_selector(n0 - constants.METHODDICT_NAMES_INDEX,
+                                 w_old_selector)
 
     def setup_notification(self):
         self.w_values().as_observed_get_shadow(self.space).set_observer(self)
@@ -378,39 +589,104 @@ class MethodDictionaryShadow(AbstractGenericShadow):
         assert isinstance(w_values, model.W_PointersObject)
         return w_values
 
-    def flush_method_cache(self):
-        self.sync_method_cache()
+    def selector_count(self):
+        return self.own_size() - constants.METHODDICT_NAMES_INDEX
+
+    def fetch_method(self, index):
+        w_values = self.own_fetch(constants.METHODDICT_VALUES_INDEX)
+        if not isinstance(w_values, model.W_PointersObject):
+            return None
+        if index >= w_values.size():
+            return None
+        w_method = w_values.fetch(self.space, index)
+        if w_method.is_nil(self.space):
+            return None
+        return w_method
+
+    def find_slot(self, w_selector):
+        for i in range(self.selector_count()):
+            if self.own_fetch(constants.METHODDICT_NAMES_INDEX + i) is w_selector:
+                return i
+        return -1
+
+    def update_selector(self, index, w_old_selector):
+        if (not w_old_selector.is_nil(self.space) and
+                self.selector_slots.get(w_old_selector, -1) == index):
+            w_old_method = self.methoddict.get(w_old_selector, None)
+            del self.selector_slots[w_old_selector]
+            if w_old_method is not None:
+                del self.methoddict[w_old_selector]
+            # while keys are swapped, the selector is in another slot, too
+            other = self.find_slot(w_old_selector)
+            if other >= 0:
+                self.install_slot(other)
+            if self.methoddict.get(w_old_selector, None) is not w_old_method:
+                self.selector_changed(w_old_selector)
+        if self.install_slot(index):
+            self.selector_changed(self.own_fetch(constants.METHODDICT_NAMES_INDEX + index))
+
+    def update_method(self, index):
+        if index >= self.selector_count():
+            return
+        w_selector = self.own_fetch(constants.METHODDICT_NAMES_INDEX + index)
+        if w_selector.is_nil(self.space):
+            return
+        if self.selector_slots.get(w_selector, index) != index:
+            # a duplicate key while keys are swapped, the other slot wins
+            return
+        if self.install_slot(index):
+            self.selector_changed(w_selector)
+
+    def selector_changed(self, w_selector):
+        if self.s_class:
+            if self.space.defer_method_changes.is_set():
+                self.space.defer_class_change(self.s_class)
+            else:
+                self.s_class.selector_changed(w_selector)
+
+    def install_slot(self, index):
+        """Enter the selector and method in slot index into the cache. Answer
+        whether the method for that selector changed."""
+        w_selector = self.own_fetch(constants.METHODDICT_NAMES_INDEX + index)
+        if w_selector.is_nil(self.space):
+            return False
+        self.selector_slots[w_selector] = index
+        w_method = self.fetch_method(index)
+        w_old_method = self.methoddict.get(w_selector, None)
+        if w_method is None:
+            if w_old_method is None:
+                return False
+            del self.methoddict[w_selector]
+            return True
+        self.methoddict[w_selector] = w_method
+        self.set_lookup_class_and_name(w_selector, w_method)
+        return w_method is not w_old_method
+
+    def set_lookup_class_and_name(self, w_selector, w_compiledmethod):
+        if not isinstance(w_compiledmethod, model.W_CompiledMethod) or not self.s_class:
+            return
+        if isinstance(w_selector, model.W_BytesObject):
+            selector = w_selector.unwrap_string(None)
+        else:
+            selector = "? (non-byteobject selector)"
+            # TODO: Check if there's more assumptions about this.
+            #       Putting any key in the methodDict and running with
+            #       perform is actually supported in Squeak
+            # raise ClassShadowError("bogus selector in method dict")
+        if (w_compiledmethod.lookup_class is not self.s_class.w_self() or
+            w_compiledmethod.lookup_selector != selector):
+            w_compiledmethod.set_lookup_class_and_name(self.s_class.w_self(), selector)
 
     def sync_method_cache(self):
-        size = self.own_size()
-        if size == 0:
+        if self.own_size() == 0:
             return
         self.methoddict = {}
-        size -= constants.METHODDICT_NAMES_INDEX
-        w_values = self.w_values()
-        for i in range(size):
-            w_selector = self.own_fetch(constants.METHODDICT_NAMES_INDEX+i)
-            if not w_selector.is_nil(self.space):
-                if isinstance(w_selector, model.W_BytesObject):
-                    selector = w_selector.unwrap_string(None)
-                else:
-                    selector = "? (non-byteobject selector)"
-                    pass
-                    # TODO: Check if there's more assumptions about this.
-                    #       Putting any key in the methodDict and running with
-                    #       perform is actually supported in Squeak
-                    # raise ClassShadowError("bogus selector in method dict")
-
-                w_compiledmethod = w_values.fetch(self.space, i)
-                if not isinstance(w_compiledmethod, model.W_Object):
-                    raise ClassShadowError("The methoddict must contain only wrapped Objects."
-                                       "If the value observed is nil, our "
-                                       "invalidating mechanism may be broken.")
-                self.methoddict[w_selector] = w_compiledmethod
-                if isinstance(w_compiledmethod, model.W_CompiledMethod) and self.s_class:
-                    if (w_compiledmethod.lookup_class is not self.s_class.w_self() or
-                        w_compiledmethod.lookup_selector is not selector):
-                        w_compiledmethod.set_lookup_class_and_name(self.s_class.w_self(), selector)
+        self.selector_slots = {}
+        for i in range(self.selector_count()):
+            self.install_slot(i)
         if self.s_class:
-            self.s_class.changed()
+            if self.space.defer_method_changes.is_set():
+                self.space.defer_class_change(self.s_class)
+            else:
+                self.s_class.changed()
 MethodDictionaryShadow.instantiate_type = MethodDictionaryShadow
@@ -432,8 +432,8 @@ class ContextPartShadow(AbstractStrategy):
         # do a pop and access the stack afterwards. Or better said, do a pop on
         # the empty stack and would hence nil out a temp. We cannot let this
         # happen.
-        # Problem: how do we tell the GC to collect outside self._stack_ptr?
-        #  self.stack_put(ptr, self.space.w_nil)
+        # Instead, clear_dead_stack_slots nils out everything above the stack
+        # pointer at send sites, where the stack depth is known.
         assert ptr >= 0
         self._stack_ptr = ptr
         return ret
@@ -445,6 +445,25 @@ class ContextPartShadow(AbstractStrategy):
         self.stack_put(ptr, w_v)
         self._stack_ptr = ptr + 1
 
+    @jit.unroll_safe
+    def clear_dead_stack_slots(self):
+        # Slots above the stack pointer are never read again, but keep their
+        # objects alive as long as this frame. We only clear them if the stack
+        # pointer is where the bytecodes say it should be, so that the slots
+        # of frames which were reflectively modified stay untouched.
+        w_method = self.w_method()
+        depth = w_method.stack_depth_at(self.pc())
+        if depth < 0:
+            return
+        tempsize = self.tempsize()
+        ptr = jit.promote(self._stack_ptr)
+        if ptr != tempsize + depth - 1:
+            return
+        end = min(tempsize + w_method.max_stack_depth(),
+                  len(self._temps_and_stack))
+        for i in range(ptr, end):
+            self.stack_put(i, self.space.w_nil)
+
     @jit.unroll_safe
     def push_all(self, lst):
         for elt in lst:
@@ -485,11 +504,11 @@ class ContextPartShadow(AbstractStrategy):
     # ______________________________________________________________________
     # Primitive support
 
-    def store_instances_array(self, w_class, match_w):
-        # used for primitives 77 & 78
+    def store_instances_array(self, w_class, instances):
+        # used for primitives 77, 78, 138 & 139
         if self.get_extra_data().instances_w is None:
             self.get_extra_data().instances_w = {}
-        self.get_extra_data().instances_w[w_class] = match_w
+        self.get_extra_data().instances_w[w_class] = instances
 
     def instances_array(self, w_class):
         if self.get_extra_data().instances_w is None:
@@ -33,6 +33,14 @@ class BaseJITTest(object):
         for op, expected in zip(trace, expected_ops):
             self._assert_ops_equal(aliases, op, expected)
 
+    def assert_no_calls_to(self, trace, function):
+        self.assert_calls_to(trace, function, 0)
+
+    def assert_calls_to(self, trace, function, count):
+        calls = [op for op in trace
+                 if op.name.startswith("call") and function in op.args[0]]
+        assert len(calls) == count
+
     def _assert_ops_equal(self, aliases, op, expected):
         assert op.name == expected.name
         # assert len(op.args) == len(expected.args)
@@ -544,3 +544,40 @@ class TestBasic(BaseJITTest):
         i139 = arraylen_gc(p98, descr=<ArrayS 4>)
         jump(p0, p1, i2, p3, p6, p7, i8, i9, p10, p11, i13, p14, p17, i136, p25, p27, p29, p31, p33, p35, p37, p39, p41, p43, p45, p47, p71, p81, p73, p75, p98, p106, descr=TargetToken(160421980))
         """)
+
+    def test_identity_and_send_do_not_follow_forwarders(self, spy, tmpdir):
+        # Only objects that were lazily forwarded leave the trace to follow
+        # their forwarders, plain comparisons and sends just check the strategy
+        traces = self.run(spy, tmpdir, """
+        | a b i |
+        a := Array new: 2.
+        b := Array new: 2.
+        i := 0.
+        [i <= 100000] whileTrue: [
+          a == b ifFalse: [i := i + a yourself size]].
+        ^ i
+        """)
+        self.assert_no_calls_to(traces[0].loop, "_follow_forwarders")
+
+    def test_string_replace(self, spy, tmpdir):
+        # The copy loop is not inlined into the trace, the primitive is a single
+        # residual call and the trace does not grow with the size of the copy.
+        traces = self.run(spy, tmpdir, """
+        | s t |
+        s := String new: 1000.
+        t := String new: 1000 withAll: $a.
+        1 to: 10000 do: [:i | s replaceFrom: 1 to: 1000 with: t startingAt: 1].
+        """)
+        self.assert_calls_to(traces[0].loop, "replace_from", 1)
+        assert len(traces[0].loop) < 50
+
+    def test_array_replace(self, spy, tmpdir):
+        # Both arrays hold SmallIntegers, so their storage is copied directly
+        traces = self.run(spy, tmpdir, """
+        | a b |
+        a := Array new: 1000.
+        b := (1 to: 1000) asArray.
+        1 to: 10000 do: [:i | a replaceFrom: 1 to: 1000 with: b startingAt: 1].
+        """)
+        self.assert_calls_to(traces[0].loop, "copy_range_from", 1)
+        assert len(traces[0].loop) < 50
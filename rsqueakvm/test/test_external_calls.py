@@ -104,6 +104,56 @@ def test_fileplugin_dirdelete(monkeypatch):
     finally:
         monkeypatch.undo()
 
+def test_fileplugin_dirlookup_lists_once(monkeypatch, tmpdir):
+    for name in ["a", "bb", "ccc"]:
+        tmpdir.join(name).write(name)
+    listings = []
+    listdir = os.listdir
+    def counting_listdir(path):
+        listings.append(path)
+        return listdir(path)
+    monkeypatch.setattr(os, "listdir", counting_listdir)
+
+    w_path = space.wrap_string(str(tmpdir))
+    def lookup(index):
+        stack = [space.w(1), w_path, space.w(index)]
+        return external_call('FilePlugin', 'primitiveDirectoryLookup', stack)
+    try:
+        entries = []
+        index = 1
+        w_entry = lookup(index)
+        while w_entry is not space.w_nil:
+            entries.append(space.unwrap_array(w_entry))
+            index += 1
+            w_entry = lookup(index)
+        names = [w_entry[0].unwrap_string(None) for w_entry in entries]
+        assert sorted(names) == ["a", "bb", "ccc"]
+        assert [space.unwrap_int(w_entry[4]) for w_entry in entries] == [len(name) for name in names]
+        assert len(listings) == 1
+        # starting over lists the directory again
+        lookup(1)
+        assert len(listings) == 2
+        w_entries = external_call('FilePlugin', 'primitiveDirectoryEntries',
+                                  [space.w(1), w_path])
+        assert [space.unwrap_array(w_entry)[0].unwrap_string(None)
+                for w_entry in space.unwrap_array(w_entries)] == names
+        with py.test.raises(PrimitiveFailedError):
+            external_call('FilePlugin', 'primitiveDirectoryEntries',
+                          [space.w(1), space.wrap_string(str(tmpdir.join("a")))])
+        # a file removed between listing and stat'ing is left out
+        stat = os.stat
+        def vanishing_stat(path):
+            if os.path.basename(path) == "bb":
+                raise OSError(2, "No such file or directory")
+            return stat(path)
+        monkeypatch.setattr(os, "stat", vanishing_stat)
+        w_entries = external_call('FilePlugin', 'primitiveDirectoryEntries',
+                                  [space.w(1), w_path])
+        assert sorted([space.unwrap_array(w_entry)[0].unwrap_string(None)
+                       for w_entry in space.unwrap_array(w_entries)]) == ["a", "ccc"]
+    finally:
+        monkeypatch.undo()
+
 def test_fileplugin_filewrite_bytes(monkeypatch):
     def write(fd, data):
         assert len(data) == 4
@@ -119,6 +169,31 @@ def test_fileplugin_filewrite_bytes(monkeypatch):
     finally:
         monkeypatch.undo()
 
+def test_fileplugin_fileread_into_bytes():
+    r, w = os.pipe()
+    try:
+        os.write(w, "abc")
+        target = model.W_BytesObject(space, space.w_String, 6)
+        target.bytes = ["x"] * 6
+        version = target.version
+        stack = [space.w(1), space.w(r), target, space.w(2), space.w(4)]
+        w_c = external_call('FilePlugin', 'primitiveFileRead', stack)
+        assert space.unwrap_int(w_c) == 3
+        assert target.unwrap_string(None) == "xabcxx"
+        assert target.version is not version
+        target.convert_to_c_layout()
+        os.write(w, "de")
+        stack = [space.w(1), space.w(r), target, space.w(5), space.w(2)]
+        w_c = external_call('FilePlugin', 'primitiveFileRead', stack)
+        assert space.unwrap_int(w_c) == 2
+        assert target.unwrap_string(None) == "xabcde"
+        stack = [space.w(1), space.w(r), target, space.w(6), space.w(2)]
+        with py.test.raises(PrimitiveFailedError):
+            external_call('FilePlugin', 'primitiveFileRead', stack)
+    finally:
+        os.close(r)
+        os.close(w)
+
 def test_fileplugin_filewrite_words(monkeypatch):
     def write(fd, data):
         assert len(data) == 4
@@ -163,18 +238,49 @@ def test_fileplugin_filewrite_largeposint(monkeypatch):
     finally:
         monkeypatch.undo()
 
+def c_write(fd, buf, count):
+    data = rffi.charpsize2str(rffi.cast(rffi.CCHARP, buf), intmask(count))
+    c_write.written.append(data)
+    return len(data)
+
 def test_fileplugin_filewrite_bitmap(monkeypatch):
-    def write(fd, data):
-        assert len(data) == 4
-        assert data == 'dcba'
-        return 4
-    monkeypatch.setattr(os, "write", write)
+    from rpython.rlib import rposix
+    c_write.written = []
+    monkeypatch.setattr(rposix, "c_write", c_write)
 
     content = model_display.W_DisplayBitmap(space, 1, 32)
     content._real_depth_buffer[0] = rffi.r_uint(1633837924)
     try:
         stack = [space.w(1), space.w(1), content, space.w(1), space.w(1)]
         w_c = external_call('FilePlugin', 'primitiveFileWrite', stack)
+        assert space.unwrap_int(w_c) == 1
+        assert c_write.written == ['dcba']
+    finally:
+        monkeypatch.undo()
+
+def test_fileplugin_filewrite_slices(monkeypatch):
+    from rpython.rlib import rposix
+    def write(fd, data):
+        c_write.written.append(data)
+        return len(data)
+    c_write.written = []
+    monkeypatch.setattr(os, "write", write)
+    monkeypatch.setattr(rposix, "c_write", c_write)
+
+    words = model.W_WordsObject(space, space.w_Bitmap, 3)
+    words.words = [r_uint(0x64636261), r_uint(0x68676665), r_uint(0x6c6b6a69)]
+    bytes = model.W_BytesObject(space, space.w_String, 6)
+    bytes.bytes = list("abcdef")
+    try:
+        for content in [words, bytes]:
+            stack = [space.w(1), space.w(1), content, space.w(2), space.w(2)]
+            w_c = external_call('FilePlugin', 'primitiveFileWrite', stack)
+            assert space.unwrap_int(w_c) == 2
+            content.convert_to_c_layout()
+            stack = [space.w(1), space.w(1), content, space.w(2), space.w(2)]
+            w_c = external_call('FilePlugin', 'primitiveFileWrite', stack)
+            assert space.unwrap_int(w_c) == 2
+        assert c_write.written == ['efghijkl', 'efghijkl', 'bc', 'bc']
     finally:
         monkeypatch.undo()
 
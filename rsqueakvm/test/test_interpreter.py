@@ -117,6 +117,13 @@ def fakeliterals(space, *literals):
 
 # ======= Test methods =======
 
+def test_bytecode_dispatch_covers_ranges():
+    from rsqueakvm.interpreter_bytecodes import BYTECODE_RANGES, BYTECODE_DISPATCH
+    assert [bc for bc, _ in BYTECODE_DISPATCH] == range(256)
+    for entry in BYTECODE_RANGES:
+        for bc in range(entry[0], entry[-2] + 1):
+            assert BYTECODE_DISPATCH[bc][1] == entry[-1]
+
 def test_create_frame():
     w_method = model.W_PreSpurCompiledMethod(space, len("hello"))
     w_method.bytes="hello"
@@ -1065,3 +1072,104 @@ def test_skip_callPrimitive_bytecode(space, interp):
     # note that the primitive index bytes are the bytecodes for ^false and ^nil
     result = interp.interpret_bc(bytecodes)
     assert result.is_same_object(space.w_true)
+
+def test_compute_stack_depths():
+    from rsqueakvm.interpreter_bytecodes import compute_stack_depths
+    # ^ (self foo: 1) + 2
+    bytecode = ''.join(map(chr, [112, 118, 224, 119, 176, 124]))
+    assert compute_stack_depths(bytecode) == [0, 1, 2, 1, 2, 1]
+    # fib: from test_fibWithArgument, with a conditional jump
+    bytecode = ''.join(map(chr, [ 16, 119, 178, 154, 118, 164, 11, 112, 16, 118, 177, 224, 112, 16, 119, 177, 224, 176, 124 ]))
+    assert compute_stack_depths(bytecode) == [
+        0, 1, 2, 1, 0, 1, -1, 0, 1, 2, 3, 2, 1, 2, 3, 4, 3, 2, 1]
+    # [:a | a] with one copied value, the closure body starts on an empty stack
+    bytecode = ''.join(map(chr, [112, 143, 0x11, 0, 2, 16, 125, 124]))
+    assert compute_stack_depths(bytecode) == [0, 1, -1, -1, -1, 0, 1, 1]
+    # ^ self foo: 1 bar: 2 with the selector in literal 3, extended send and
+    # super send with 2 arguments
+    for send in [131, 133]:
+        bytecode = ''.join(map(chr, [112, 118, 119, send, (2 << 5) | 3, 124]))
+        assert compute_stack_depths(bytecode) == [0, 1, 2, 3, -1, 1]
+    # unknown bytecodes and jumps out of the method cannot be analysed
+    assert compute_stack_depths(chr(126)) is None
+    assert compute_stack_depths(chr(151)) is None
+
+def test_send_clears_dead_stack_slots():
+    import gc, weakref
+    w_class = bootstrap_class(0)
+    w_object = w_class.as_class_get_shadow(space).new()
+    w_method = model.W_PreSpurCompiledMethod(space, 2)
+    w_method.bytes = returnReceiverBytecode
+    literals = fakeliterals(space, "foo")
+    w_class.as_class_get_shadow(space).installmethod(literals[0], w_method)
+    # self. (Array new: 127). pop. self foo. ^ top
+    w_frame, s_frame = new_frame(pushReceiverBytecode +
+                                 pushNewArrayBytecode + chr(127) +
+                                 popStackBytecode +
+                                 sendLiteralSelectorBytecode(0) +
+                                 returnTopFromMethodBytecode,
+                                 receiver=w_object)
+    s_frame.w_method().setliterals(literals)
+    step_in_interp(s_frame)
+    step_in_interp(s_frame)
+    w_array = s_frame.top()
+    assert w_array.size() == 127
+    ref = weakref.ref(w_array)
+    del w_array
+    step_in_interp(s_frame)
+    # popped, but still referenced from the frame
+    gc.collect()
+    assert ref() is not None
+    w_active_context = step_in_interp(s_frame)
+    assert w_active_context.as_context_get_shadow(space).w_sender() is w_frame
+    gc.collect()
+    assert ref() is None
+    assert s_frame.stack_get(s_frame.tempsize() + 1).is_nil(space)
+
+def test_send_keeps_stack_slots_of_modified_frames():
+    w_class = bootstrap_class(0)
+    w_object = w_class.as_class_get_shadow(space).new()
+    w_method = model.W_PreSpurCompiledMethod(space, 2)
+    w_method.bytes = returnReceiverBytecode
+    literals = fakeliterals(space, "foo")
+    w_class.as_class_get_shadow(space).installmethod(literals[0], w_method)
+    w_frame, s_frame = new_frame(sendLiteralSelectorBytecode(0) +
+                                 returnTopFromMethodBytecode)
+    s_frame.w_method().setliterals(literals)
+    # the bytecodes expect only the receiver on the stack
+    s_frame.push(space.w_true)
+    s_frame.push(w_object)
+    s_frame.pop()
+    s_frame.push(w_object)
+    step_in_interp(s_frame)
+    assert s_frame.stack() == [space.w_true]
+    assert s_frame.stack_get(s_frame.tempsize() + 1) is w_object
+
+def test_interrupt_timer_signals_interrupt_check(monkeypatch):
+    from rpython.rlib import rsignal
+    from rsqueakvm.util import signals
+    if not signals.HAS_ITIMER:
+        pytest.skip("no interval timers")
+    timer_interp = interpreter.Interpreter(space, interrupt_timer=1000)
+    checks = []
+    monkeypatch.setattr(timer_interp, "check_for_interrupts", checks.append)
+    w_frame, s_frame = new_frame(returnNilBytecode)
+    # the send counter is not used
+    for i in range(timer_interp.interrupt_counter_size + 1):
+        timer_interp.quick_check_for_interrupt(s_frame)
+    assert checks == []
+    # after a primitive, the expired timer stays pending
+    signals.pushback_signal(signals.SIGALRM)
+    timer_interp.check_for_signals_after_primitive(s_frame.w_method())
+    assert checks == []
+    timer_interp.quick_check_for_interrupt(s_frame)
+    assert checks == [s_frame]
+    timer_interp.quick_check_for_interrupt(s_frame)
+    assert checks == [s_frame]
+    # other signals stay pending for check_sigusr
+    signals.pushback_signal(rsignal.SIGUSR1)
+    signals.pushback_signal(signals.SIGALRM)
+    timer_interp.quick_check_for_interrupt(s_frame)
+    assert checks == [s_frame, s_frame]
+    assert signals.poll_signal() == rsignal.SIGUSR1
+    assert signals.poll_signal() == -1
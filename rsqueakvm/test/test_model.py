@@ -62,6 +62,19 @@ def test_bytes_object():
     assert w_bytes.getchar(0) == "\x00"
     py.test.raises(IndexError, lambda: w_bytes.getchar(20))
 
+def test_bytes_object_clone_does_not_share_storage():
+    w_class = bootstrap_class(0, format=storage_classes.BYTES)
+    w_bytes = w_class.as_class_get_shadow(space).new(4)
+    w_bytes.setchar(1, "a")
+    w_clone = w_bytes.clone(space)
+    w_clone.setchar(1, "b")
+    assert w_bytes.getchar(1) == "a"
+    assert w_clone.getbytes() == ["\x00", "b", "\x00", "\x00"]
+    w_bytes.convert_to_c_layout()
+    w_clone = w_bytes.clone(space)
+    assert w_clone.native_bytes is None
+    assert w_clone.getbytes() == ["\x00", "a", "\x00", "\x00"]
+
 def test_c_bytes_object():
     w_class = bootstrap_class(0, format=storage_classes.BYTES)
     w_bytes = w_class.as_class_get_shadow(space).new(20)
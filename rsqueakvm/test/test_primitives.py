@@ -277,6 +277,37 @@ def test_string_at_put():
     for i in range(1,len(exp)+1):
         assert prim(primitives.STRING_AT, [test_str, i]) == wrap(exp[i-1])
 
+def test_string_replace_bytes():
+    w_str = wrap("foobar")
+    w_old_version = w_str.version
+    assert prim(primitives.STRING_REPLACE, [w_str, 2, 4, wrap("xyzzy"), 3]) is w_str
+    assert w_str.unwrap_string(space) == "fzzyar"
+    assert w_str.version is not w_old_version
+    prim_fails(primitives.STRING_REPLACE, [w_str, 5, 7, wrap("xyz"), 1])
+    prim_fails(primitives.STRING_REPLACE, [w_str, 1, 3, wrap("xy"), 1])
+
+def test_string_replace_words():
+    w_rcvr = model.W_WordsObject(space, None, 4)
+    w_source = model.W_WordsObject(space, None, 3)
+    for i in range(3):
+        w_source.setword(i, r_uint(i + 10))
+    prim(primitives.STRING_REPLACE, [w_rcvr, 2, 4, w_source, 1])
+    assert [w_rcvr.getword(i) for i in range(4)] == [0, 10, 11, 12]
+
+def test_string_replace_pointers():
+    w_class = bootstrap_class(1, varsized=True)
+    w_rcvr = w_class.as_class_get_shadow(space).new(3)
+    w_source = w_class.as_class_get_shadow(space).new(3)
+    for i in range(3):
+        w_source.atput0(space, i, wrap(i + 1))
+    prim(primitives.STRING_REPLACE, [w_rcvr, 1, 2, w_source, 2])
+    assert [w_rcvr.at0(space, i) for i in range(3)] == [wrap(2), wrap(3), space.w_nil]
+    assert w_rcvr.fetch(space, 0) is space.w_nil
+
+def test_string_replace_mixed_fails():
+    w_words = model.W_WordsObject(space, None, 3)
+    prim_fails(primitives.STRING_REPLACE, [wrap("foo"), 1, 3, w_words, 1])
+
 def test_new():
     w_Object = space.classtable['w_Object']
     w_res = prim(primitives.NEW, [w_Object])
@@ -489,6 +520,70 @@ def test_full_gc():
     # Should not fail :-)
     prim(primitives.FULL_GC, [42])  # Dummy arg
 
+def test_vm_parameters_gc_statistics():
+    from rsqueakvm.squeakimage import ImageVersion
+    w_frame, s_context = new_frame("<never called, but needed for method generation>")
+    interp = TestInterpreter(space)
+    # the parameters include the image format
+    interp.image.version = ImageVersion(6505, False, False, True, True)
+    s_context.push(space.w_nil)
+    prim_table[primitives.FULL_GC](interp, s_context, 0)
+    s_context.pop()
+
+    s_context.push(space.w_nil)
+    s_context.push(space.wrap_int(7))  # full GCs since startup
+    prim_table[primitives.VM_PARAMETERS](interp, s_context, 1)
+    assert space.unwrap_int(s_context.pop()) == 1
+
+    s_context.push(space.w_nil)
+    s_context.push(space.wrap_int(41))  # image format
+    prim_table[primitives.VM_PARAMETERS](interp, s_context, 1)
+    assert space.unwrap_int(s_context.pop()) == 6505
+
+    s_context.push(space.w_nil)
+    s_context.push(space.wrap_int(73))  # maximum heap size
+    s_context.push(space.wrap_int(1 << 28))
+    prim_table[primitives.VM_PARAMETERS](interp, s_context, 2)
+    assert space.unwrap_int(s_context.pop()) == 0
+    assert interp.gc_stats.max_heap_size == 1 << 28
+
+    s_context.push(space.w_nil)
+    s_context.push(space.wrap_int(74))
+    with py.test.raises(PrimitiveFailedError):
+        prim_table[primitives.VM_PARAMETERS](interp, s_context, 1)
+
+def test_low_space_semaphore():
+    w_frame, s_context = new_frame("<never called, but needed for method generation>")
+    interp = TestInterpreter(space)
+    interp.image.special_objects = space.wrap_list(
+        [space.w_nil] * (constants.SO_PROCESS_SIGNALIGN_LOW_SPACE + 1))
+    # the bootstrapped Semaphore class has no instance variables
+    sema = model.W_PointersObject(space, space.w_Semaphore, 3)
+    semaphore = wrapper.SemaphoreWrapper(space, sema)
+    semaphore.store_excess_signals(0)
+
+    s_context.push(space.w_nil)
+    s_context.push(sema)
+    prim_table[primitives.LOW_SPACE_SEMAPHORE](interp, s_context, 1)
+    s_context.pop()
+    assert interp.image.special(constants.SO_LOW_SPACE_SEMAPHORE) is sema
+
+    # without a memory limit, there is no low space warning
+    s_context.push(space.w_nil)
+    s_context.push(space.wrap_int(1 << 40))
+    prim_table[primitives.SIGNAL_AT_BYTES_LEFT](interp, s_context, 1)
+    s_context.pop()
+    interp.check_for_interrupts(s_context)
+    assert semaphore.excess_signals() == 0
+
+    # the threshold is above the limit, so the first check signals, once
+    interp.gc_stats.set_max_heap_size(1 << 30)
+    interp.check_for_interrupts(s_context)
+    assert semaphore.excess_signals() == 1
+    assert interp.gc_stats.low_space_threshold == 0
+    interp.check_for_interrupts(s_context)
+    assert semaphore.excess_signals() == 1
+
 def test_interrupt_semaphore():
     prim(primitives.INTERRUPT_SEMAPHORE, [1, space.w_true])
     assert space.objtable["w_interrupt_semaphore"].is_nil(space)
@@ -716,6 +811,107 @@ def test_primitive_next_instance():
     assert w_2.getclass(space) is space.w_Array
     assert w_1 is not w_2
 
+def test_instances_are_kept_per_context():
+    someInstances = map(space.wrap_list, [[2], [3], [4]])
+    w_frame, s_context = new_frame("<never called, but needed for method generation>")
+    interp = TestInterpreter(space)
+
+    s_context.push(space.w_Array)
+    prim_table[primitives.SOME_INSTANCE](interp, s_context, 0)
+    w_1 = s_context.pop()
+    instances = s_context.instances_array(space.w_Array)
+    assert instances.first() is w_1
+    # only the instances of the class are traced
+    assert space.w_nil not in instances.objects_w
+
+    # other contexts do not see the enumeration
+    w_other, s_other = new_frame("<never called, but needed for method generation>")
+    assert s_other.instances_array(space.w_Array) is None
+
+    # objects that changed their class in the meantime are skipped
+    w_2, w_3 = instances.objects_w[1], instances.objects_w[2]
+    w_2.change_class(space, space.w_Semaphore)
+    s_context.push(w_1)
+    prim_table[primitives.NEXT_INSTANCE](interp, s_context, 0)
+    assert s_context.pop() is w_3
+    assert s_context.instances_array(space.w_Array) is instances
+
+def test_become_one_way_forwards_lazily():
+    w_frame, s_context = new_frame("<never called, but needed for method generation>")
+    interp = TestInterpreter(space)
+    w_from = space.wrap_list([space.wrap_int(1)])
+    w_to = space.wrap_list([space.wrap_int(2), space.wrap_int(3)])
+    w_holder = space.wrap_list([w_from, w_from])
+    hash = w_from.gethash()
+
+    s_context.push(space.wrap_list([w_from]))
+    s_context.push(space.wrap_list([w_to]))
+    prim_table[primitives.ARRAY_BECOME_ONE_WAY](interp, s_context, 1)
+    s_context.pop()
+    assert interp.forwarders_w == [w_from]
+    assert w_from.is_forwarded()
+    assert w_from.strategy.get_storage(w_from) is None
+    assert w_to.gethash() == hash
+
+    # the holder was not updated yet, but sees the target through the forwarder
+    w_ref = w_holder.at0(space, 0)
+    assert w_ref is w_from
+    assert w_ref.is_same_object(w_to)
+    assert w_to.is_same_object(w_ref)
+    assert w_ref.size() == 2
+    w_ref.atput0(space, 1, space.wrap_int(4))
+    assert space.unwrap_int(w_to.at0(space, 1)) == 4
+
+    # a full GC replaces all references by the target
+    s_context.push(space.w_nil)
+    prim_table[primitives.FULL_GC](interp, s_context, 0)
+    s_context.pop()
+    assert interp.forwarders_w == []
+    assert w_holder.at0(space, 0) is w_to
+    assert w_holder.at0(space, 1) is w_to
+
+def test_profile_samples():
+    from rsqueakvm.util.profiler import SAMPLE_JITTED, SAMPLE_PRIMITIVE
+    w_frame, s_context = new_frame("<never called, but needed for method generation>")
+    interp = TestInterpreter(space)
+    w_method = s_context.w_method()
+    interp.profiler.record(w_method, SAMPLE_JITTED)
+    interp.profiler.record(None, SAMPLE_PRIMITIVE)
+
+    w_samples = space.wrap_list([space.w_nil] * 6)
+    s_context.push(space.w_nil)
+    s_context.push(w_samples)
+    prim_table[primitives.VM_PROFILE_SAMPLES_INTO](interp, s_context, 1)
+    assert space.unwrap_int(s_context.pop()) == 2
+    assert space.unwrap_array(w_samples) == [
+        w_method, space.wrap_int(1), space.w_nil, space.wrap_int(2),
+        space.w_nil, space.w_nil]
+
+    w_info = space.wrap_list([space.w_nil] * 8)
+    s_context.push(space.w_nil)
+    s_context.push(w_info)
+    prim_table[primitives.VM_PROFILE_INFO_INTO](interp, s_context, 1)
+    assert s_context.pop() is w_info
+    info = [space.unwrap_int(w_i) for w_i in space.unwrap_array(w_info)[:6]]
+    assert info == [2, 0, 1, 1, 0, interp.profiler.interval]
+    assert space.unwrap_array(w_info)[6] is space.w_false
+
+    s_context.push(space.w_nil)
+    prim_table[primitives.VM_CLEAR_PROFILE](interp, s_context, 0)
+    s_context.pop()
+    assert interp.profiler.sample_count() == 0
+
+    s_context.push(space.w_nil)
+    s_context.push(space.w_true)
+    prim_table[primitives.VM_CONTROL_PROFILING](interp, s_context, 1)
+    assert space.unwrap_int(s_context.pop()) == 0
+    assert interp.profiler.is_active()
+    s_context.push(space.w_nil)
+    s_context.push(space.w_false)
+    prim_table[primitives.VM_CONTROL_PROFILING](interp, s_context, 1)
+    s_context.pop()
+    assert not interp.profiler.is_active()
+
 def test_primitive_next_instance_wo_some_instance_in_same_frame():
     someInstances = map(space.wrap_list, [[2], [3]])
     w_frame, s_context = new_frame("<never called, but needed for method generation>")
@@ -221,14 +221,14 @@ def test_observee_shadow():
     notified = False
     class Observer():
         def __init__(self): self.notified = False
-        def notify(self): self.notified = True
+        def notify(self, n0): self.notified = n0
     o = Observer()
-    w_o = w_Array.as_class_get_shadow(space).new(1)
+    w_o = w_Array.as_class_get_shadow(space).new(2)
     w_o.as_observed_get_shadow(space).set_observer(o)
-    assert not o.notified
-    w_o.store(space, 0, 1)
-    assert o.notified
-    assert w_o.fetch(space, 0) == 1
+    assert o.notified is False
+    w_o.store(space, 1, 1)
+    assert o.notified == 1
+    assert w_o.fetch(space, 1) == 1
     try:
         w_o.strategy.set_observer(Observer())
     except RuntimeError:
@@ -257,11 +257,11 @@ def test_cached_methoddict():
             or s_class.lookup(key) is bar)
     # change that entry
     w_array = s_class.w_methoddict().fetch(s_class.space, constants.METHODDICT_VALUES_INDEX)
-    version = s_class.version
+    version = s_class.lookup_dependency(key).version
     w_array.atput0(space, i, baz)
 
     assert s_class.lookup(key) is baz
-    assert version is not s_class.version
+    assert version is not s_class.lookup_dependency(key).version
 
 def test_updating_class_changes_subclasses():
     w_parent = build_smalltalk_class("Demo", 0x90,
@@ -269,20 +269,199 @@ def test_updating_class_changes_subclasses():
     w_class = build_smalltalk_class("Demo", 0x90,
             methods={'foo': model.W_PreSpurCompiledMethod(space, 0)}, w_superclass=w_parent)
     s_class = w_class.as_class_get_shadow(space)
-    version = s_class.version
+    s_parent = w_parent.as_class_get_shadow(space)
 
     w_method = model.W_PreSpurCompiledMethod(space, 0)
     key = space.wrap_string('foo')
+    w_other = space.wrap_string('other')
+    assert s_class.lookup(key) is None
+    assert s_class.lookup(w_other) is None
+    version = s_class.version
+    key_version = s_class.lookup_dependency(key).version
+    other_version = s_class.lookup_dependency(w_other).version
+    invalidations = s_parent.selector_invalidations
 
-    s_md = w_parent.as_class_get_shadow(space).s_methoddict()
-    s_md.sync_method_cache()
+    s_md = s_parent.s_methoddict()
     w_ary = s_md._w_self.fetch(s_md.space, constants.METHODDICT_VALUES_INDEX)
     s_md._w_self.atput0(space, 0, key)
     w_ary.atput0(space, 0, w_method)
 
+    # only the lookups of the new selector are invalidated
     assert s_class.lookup(key) is w_method
+    assert s_class.lookup_dependency(key).version is not key_version
+    assert s_class.lookup_dependency(w_other).version is other_version
+    assert s_class.version is version
+    assert s_parent.selector_invalidations > invalidations
+
+    # changing the class itself invalidates all its lookups
+    s_parent.changed()
     assert s_class.version is not version
-    assert s_class.version is w_parent.as_class_get_shadow(space).version
+    assert s_class.version is s_parent.version
+    assert s_class.lookup_dependency(w_other).version is s_parent.version
+
+def test_method_changes_are_invalidated_at_end_of_batch():
+    w_parent = build_smalltalk_class("Demo", 0x90,
+            methods={'bar': model.W_PreSpurCompiledMethod(space, 0)})
+    w_class = build_smalltalk_class("Demo", 0x90,
+            methods={'foo': model.W_PreSpurCompiledMethod(space, 0)}, w_superclass=w_parent)
+    s_class = w_class.as_class_get_shadow(space)
+    s_parent = w_parent.as_class_get_shadow(space)
+    s_md = s_parent.s_methoddict()
+    w_ary = s_md._w_self.fetch(space, constants.METHODDICT_VALUES_INDEX)
+
+    w_method = model.W_PreSpurCompiledMethod(space, 0)
+    key = space.wrap_string('foo')
+    key_version = s_class.lookup_dependency(key).version
+    class_invalidations = s_parent.class_invalidations
+    selector_invalidations = s_parent.selector_invalidations
+
+    space.begin_method_changes()
+    try:
+        space.begin_method_changes()
+        s_md._w_self.atput0(space, 0, key)
+        w_ary.atput0(space, 0, w_method)
+        space.end_method_changes()
+        # the lookup sees the new method, but nothing was invalidated yet
+        assert space.defer_method_changes.is_set()
+        assert s_class.lookup(key) is w_method
+        assert s_class.lookup_dependency(key).version is key_version
+        assert s_parent.selector_invalidations == selector_invalidations
+        assert s_parent.class_invalidations == class_invalidations
+    finally:
+        space.end_method_changes()
+
+    assert not space.defer_method_changes.is_set()
+    assert s_parent.class_invalidations == class_invalidations + 1
+    assert s_class.lookup_dependency(key).version is not key_version
+    assert s_class.lookup(key) is w_method
+
+def test_methoddict_updates_single_selectors():
+    foo = model.W_PreSpurCompiledMethod(space, 0)
+    bar = model.W_PreSpurCompiledMethod(space, 0)
+    baz = model.W_PreSpurCompiledMethod(space, 0)
+    w_class = build_smalltalk_class("Demo", 0x90, methods={'foo': foo, 'baz': baz})
+    s_class = w_class.as_class_get_shadow(space)
+    s_md = s_class.s_methoddict()
+    w_md = s_md.w_self()
+    w_ary = w_md.fetch(space, constants.METHODDICT_VALUES_INDEX)
+    [w_foo] = [w_key for w_key, w_method in s_md.methoddict.items() if w_method is foo]
+    w_bar = space.wrap_string('bar')
+    i_foo = s_md.find_slot(w_foo)
+    i_bar = s_md.find_slot(space.w_nil)
+
+    # like MethodDictionary>>at:put:, the key is stored before the method
+    dependency = s_class.lookup_dependency(w_bar)
+    version = dependency.version
+    w_md.store(space, constants.METHODDICT_NAMES_INDEX + i_bar, w_bar)
+    assert dependency.version is version
+    assert s_class.lookup(w_bar) is None
+    w_ary.store(space, i_bar, bar)
+    assert dependency.version is not version
+    assert s_class.lookup(w_bar) is bar
+    assert s_class.lookup(w_foo) is foo
+
+    # storing the same method again does not change the class
+    version = dependency.version
+    w_ary.store(space, i_bar, bar)
+    assert dependency.version is version
+
+    # like MethodDictionary>>swap:with:, keys and methods are swapped in turn
+    for i, j in [(i_foo, i_bar), (i_bar, i_foo)]:
+        w_key = w_md.fetch(space, constants.METHODDICT_NAMES_INDEX + i)
+        w_md.store(space, constants.METHODDICT_NAMES_INDEX + i,
+                   w_md.fetch(space, constants.METHODDICT_NAMES_INDEX + j))
+        w_md.store(space, constants.METHODDICT_NAMES_INDEX + j, w_key)
+        w_method = w_ary.fetch(space, i)
+        w_ary.store(space, i, w_ary.fetch(space, j))
+        w_ary.store(space, j, w_method)
+        assert s_class.lookup(w_foo) is foo
+        assert s_class.lookup(w_bar) is bar
+
+    # like MethodDictionary>>removeKey:, the method is removed first
+    w_ary.store(space, i_bar, space.w_nil)
+    assert s_class.lookup(w_bar) is None
+    version = dependency.version
+    w_md.store(space, constants.METHODDICT_NAMES_INDEX + i_bar, space.w_nil)
+    assert dependency.version is version
+    assert s_class.lookup(w_foo) is foo
+    assert len(s_md.methoddict) == 2
+
+def test_method_lookup_cache():
+    foo = model.W_PreSpurCompiledMethod(space, 0)
+    w_parent = build_smalltalk_class("Demo", 0x90, methods={'foo': foo})
+    w_class = build_smalltalk_class("Demo", 0x90, w_superclass=w_parent)
+    s_parent = w_parent.as_class_get_shadow(space)
+    s_class = w_class.as_class_get_shadow(space)
+    w_foo = s_parent.s_methoddict().methoddict.keys()[0]
+    w_bar = space.wrap_string('bar')
+    cache = storage_classes.MethodLookupCache(16)
+
+    assert cache.lookup(s_class, w_foo) is foo
+    assert cache.lookup(s_class, w_foo) is foo
+    assert cache.lookup(s_class, w_bar) is None
+    assert cache.lookup(s_class, w_bar) is None
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    # changing the superclass invalidates the cached entries of the subclass
+    foo2 = model.W_PreSpurCompiledMethod(space, 0)
+    s_parent.installmethod(w_foo, foo2)
+    assert cache.lookup(s_class, w_foo) is foo2
+    assert (cache.hits, cache.misses) == (2, 3)
+
+    cache.flush()
+    assert cache.lookup(s_class, w_foo) is foo2
+    assert (cache.hits, cache.misses) == (2, 4)
+
+def test_inline_cache_grows_until_megamorphic():
+    w_selector = space.wrap_string('foo')
+    classes_s = []
+    methods_w = []
+    for i in range(constants.INLINE_CACHE_SIZE + 1):
+        w_method = model.W_PreSpurCompiledMethod(space, 0)
+        w_class = build_smalltalk_class("Demo%d" % i, 0x90)
+        s_class = w_class.as_class_get_shadow(space)
+        s_class.installmethod(w_selector, w_method)
+        classes_s.append(s_class)
+        methods_w.append(w_method)
+    lookup_cache = storage_classes.MethodLookupCache(16)
+    cache = storage_classes.InlineCache(w_selector)
+
+    assert cache.lookup(classes_s[0], w_selector, lookup_cache) is methods_w[0]
+    assert cache.size == 1
+    assert cache.lookup(classes_s[0], w_selector, lookup_cache) is methods_w[0]
+    assert lookup_cache.misses == 1
+    for i in range(1, constants.INLINE_CACHE_SIZE):
+        assert cache.lookup(classes_s[i], w_selector, lookup_cache) is methods_w[i]
+    assert cache.size == constants.INLINE_CACHE_SIZE
+    assert not cache.megamorphic
+
+    # a changed class replaces its entry instead of adding a new one
+    w_other = model.W_PreSpurCompiledMethod(space, 0)
+    classes_s[0].installmethod(w_selector, w_other)
+    assert cache.lookup(classes_s[0], w_selector, lookup_cache) is w_other
+    assert cache.size == constants.INLINE_CACHE_SIZE
+
+    assert cache.lookup(classes_s[-1], w_selector, lookup_cache) is methods_w[-1]
+    assert cache.megamorphic
+    assert cache.first is None
+    assert cache.lookup(classes_s[1], w_selector, lookup_cache) is methods_w[1]
+
+    # after a while the site caches again, in case the receivers settled
+    for i in range(constants.INLINE_CACHE_RETRY - 1):
+        assert cache.lookup(classes_s[2], w_selector, lookup_cache) is methods_w[2]
+    assert not cache.megamorphic
+    assert cache.lookup(classes_s[2], w_selector, lookup_cache) is methods_w[2]
+    assert cache.size == 1
+
+def test_send_caches_are_dropped_with_method_version():
+    w_method = model.W_PreSpurCompiledMethod(space, 0)
+    w_method.setbytes(["\x00"] * 4)
+    w_selector = space.wrap_string('foo')
+    cache = w_method.send_cache_at(2, w_selector)
+    assert w_method.send_cache_at(2, w_selector) is cache
+    assert w_method.send_cache_at(3, w_selector) is not cache
+    w_method.setchar(0, "\x01")
+    assert w_method.send_cache_at(2, w_selector) is not cache
 
 def test_returned_contexts_pc():
     w_context = methodcontext()
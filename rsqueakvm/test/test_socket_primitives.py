@@ -31,7 +31,10 @@ def _prim(space, name, module, stack, context = None):
     descr = space.wrap_list([space.wrap_string(module), space.wrap_string(name)])
     prim_meth.literalatput0(space, 1, descr)
     def call():
-        prim_table[primitives.EXTERNAL_CALL](interp, w_frame.as_context_get_shadow(space), argument_count-1, prim_meth)
+        try:
+            prim_table[primitives.EXTERNAL_CALL](interp, w_frame.as_context_get_shadow(space), argument_count-1, prim_meth)
+        finally:
+            interp.reactor.close()
     return w_frame, orig_stack, call
 
 def prim(name, module=None, stack = None, context = None):
@@ -54,6 +57,22 @@ def prim_fails(name, module, stack):
 def test_vmdebugging():
     assert prim("isRSqueak", "VMDebugging") is space.w_true
 
+def test_invalidation_counts():
+    def counts():
+        w_counts = prim("invalidationCounts", "VMDebugging",
+                        [space.w_nil, space.w_Array])
+        return [space.unwrap_int(w) for w in space.unwrap_array(w_counts)]
+    s_class = space.w_Array.as_class_get_shadow(space)
+    changes, method_changes = counts()
+    s_class.changed()
+    assert counts() == [changes + 1, method_changes]
+    s_class.selector_changed(space.wrap_string("foo"))
+    assert counts() == [changes + 1, method_changes + 1]
+    w_frame, _, call = _prim(space, "invalidationCounts", "VMDebugging",
+                             [space.w_nil, space.w_nil])
+    with py.test.raises(PrimitiveFailedError):
+        call()
+
 
 def test_resolver_start_lookup():
     assert prim("primitiveResolverStartNameLookup", "SocketPlugin",
@@ -133,8 +152,227 @@ def test_socket_send_and_read_into():
                 [space.w_nil, handle, w_str, space.wrap_int(2), space.wrap_int(5)]).value == 5
     assert w_str.unwrap_string(None) == "_HTTP/"
 
+def test_socket_listen_accept_and_options():
+    import socket as pysocket
+    server = prim("primitiveSocketCreate3Semaphores", "SocketPlugin",
+                  [space.w_nil, 2, 0, 8000, 8000, 13, 14, 15])
+    prim("primitiveSocketListenWithOrWithoutBacklog", "SocketPlugin",
+         [space.w_nil, server, space.wrap_int(0), space.wrap_int(4)])
+    assert prim("primitiveSocketConnectionStatus", "SocketPlugin",
+                [space.w_nil, server]).value == 1
+    port = prim("primitiveSocketLocalPort", "SocketPlugin",
+                [space.w_nil, server]).value
+    assert port > 0
+    client = pysocket.create_connection(("127.0.0.1", port))
+    try:
+        time.sleep(0.1)
+        assert prim("primitiveSocketConnectionStatus", "SocketPlugin",
+                    [space.w_nil, server]).value == 2
+        handle = prim("primitiveSocketAccept3Semaphores", "SocketPlugin",
+                      [space.w_nil, server, 8000, 8000, 16, 17, 18])
+        assert isinstance(handle, socket.W_SocketHandle)
+        assert prim("primitiveSocketConnectionStatus", "SocketPlugin",
+                    [space.w_nil, handle]).value == 2
+        assert prim("primitiveSocketConnectionStatus", "SocketPlugin",
+                    [space.w_nil, server]).value == 1
+        assert prim("primitiveSocketRemotePort", "SocketPlugin",
+                    [space.w_nil, handle]).value == client.getsockname()[1]
+        w_address = prim("primitiveSocketRemoteAddress", "SocketPlugin",
+                         [space.w_nil, handle])
+        assert w_address.unwrap_string(None) == "\x7f\x00\x00\x01"
+        w_result = prim("primitiveSocketSetOptions", "SocketPlugin",
+                        [space.w_nil, handle, space.wrap_string("TCP_NODELAY"),
+                         space.wrap_string("1")])
+        assert [w.value for w in space.unwrap_array(w_result)] == [0, 1]
+        w_result = prim("primitiveSocketGetOptions", "SocketPlugin",
+                        [space.w_nil, handle, space.wrap_string("TCP_NODELAY")])
+        assert [w.value for w in space.unwrap_array(w_result)] == [0, 1]
+        client.sendall("ping")
+        time.sleep(0.1)
+        w_str = space.wrap_string("____")
+        assert prim("primitiveSocketReceiveDataBufCount", "SocketPlugin",
+                    [space.w_nil, handle, w_str, space.wrap_int(1), space.wrap_int(4)]).value == 4
+        assert w_str.unwrap_string(None) == "ping"
+        assert prim("primitiveSocketSendDataBufCount", "SocketPlugin",
+                    [space.w_nil, handle, space.wrap_string("pong"),
+                     space.wrap_int(1), space.wrap_int(4)]).value == 4
+        assert client.recv(4) == "pong"
+    finally:
+        client.close()
+
+def test_socket_bind_listen_and_socket_addresses():
+    import socket as pysocket
+    def local_address(handle):
+        size = prim("primitiveSocketLocalAddressSize", "SocketPlugin",
+                    [space.w_nil, handle]).value
+        w_address = model.W_BytesObject(space, space.w_ByteArray, size)
+        prim("primitiveSocketLocalAddressResult", "SocketPlugin",
+             [space.w_nil, handle, w_address])
+        return w_address
+    def port_of(w_address):
+        return prim("primitiveSocketAddressGetPort", "SocketPlugin", [w_address]).value
+
+    # take an address of all interfaces from a listening socket
+    first = prim("primitiveSocketCreate3Semaphores", "SocketPlugin",
+                 [space.w_nil, 2, 0, 8000, 8000, 13, 14, 15])
+    prim("primitiveSocketListenWithOrWithoutBacklog", "SocketPlugin",
+         [space.w_nil, first, space.wrap_int(0), space.wrap_int(4)])
+    w_address = local_address(first)
+    assert port_of(w_address) > 0
+    prim("primitiveSocketAddressSetPort", "SocketPlugin", [w_address, 0x1234])
+    assert port_of(w_address) == 0x1234
+    prim("primitiveSocketAddressSetPort", "SocketPlugin", [w_address, 0])
+
+    server = prim("primitiveSocketCreate3Semaphores", "SocketPlugin",
+                  [space.w_nil, 2, 0, 8000, 8000, 16, 17, 18])
+    with py.test.raises(PrimitiveFailedError):
+        prim("primitiveSocketBindTo", "SocketPlugin",
+             [space.w_nil, server, space.wrap_string("\x7f\x00\x00\x01")])
+    prim("primitiveSocketBindTo", "SocketPlugin", [space.w_nil, server, w_address])
+    assert prim("primitiveSocketConnectionStatus", "SocketPlugin",
+                [space.w_nil, server]).value == 0
+    prim("primitiveSocketListenWithBacklog", "SocketPlugin",
+         [space.w_nil, server, space.wrap_int(4)])
+    assert prim("primitiveSocketConnectionStatus", "SocketPlugin",
+                [space.w_nil, server]).value == 1
+    port = port_of(local_address(server))
+    assert port > 0
+    client = pysocket.create_connection(("127.0.0.1", port))
+    try:
+        time.sleep(0.1)
+        handle = prim("primitiveSocketAccept3Semaphores", "SocketPlugin",
+                      [space.w_nil, server, 8000, 8000, 19, 20, 21])
+        size = prim("primitiveSocketRemoteAddressSize", "SocketPlugin",
+                    [space.w_nil, handle]).value
+        w_remote = model.W_BytesObject(space, space.w_ByteArray, size)
+        prim("primitiveSocketRemoteAddressResult", "SocketPlugin",
+             [space.w_nil, handle, w_remote])
+        assert port_of(w_remote) == client.getsockname()[1]
+        with py.test.raises(PrimitiveFailedError):
+            prim("primitiveSocketRemoteAddressResult", "SocketPlugin",
+                 [space.w_nil, handle, model.W_BytesObject(space, space.w_ByteArray, size + 1)])
+
+        # the accepted connection's local address is 127.0.0.1 and the port
+        # of the server
+        other = prim("primitiveSocketCreate3Semaphores", "SocketPlugin",
+                     [space.w_nil, 2, 0, 8000, 8000, 22, 23, 24])
+        prim("primitiveSocketConnectTo", "SocketPlugin",
+             [space.w_nil, other, local_address(handle)])
+        assert prim("primitiveSocketConnectionStatus", "SocketPlugin",
+                    [space.w_nil, other]).value == 2
+    finally:
+        client.close()
+
+def test_socket_udp():
+    import socket as pysocket
+    w_udp = prim("primitiveSocketCreate3Semaphores", "SocketPlugin",
+                 [space.w_nil, 2, 1, 8000, 8000, 13, 14, 15])
+    prim("primitiveSocketListenOnPort", "SocketPlugin",
+         [space.w_nil, w_udp, space.wrap_int(0)])
+    assert prim("primitiveSocketConnectionStatus", "SocketPlugin",
+                [space.w_nil, w_udp]).value == 2
+    port = prim("primitiveSocketLocalPort", "SocketPlugin",
+                [space.w_nil, w_udp]).value
+    peer = pysocket.socket(pysocket.AF_INET, pysocket.SOCK_DGRAM)
+    try:
+        peer.bind(("127.0.0.1", 0))
+        w_host = space.wrap_string("127.0.0.1")
+        assert prim("primitiveSocketSendUDPDataBufCount", "SocketPlugin",
+                    [space.w_nil, w_udp, space.wrap_string("_hello"), w_host,
+                     space.wrap_int(peer.getsockname()[1]),
+                     space.wrap_int(2), space.wrap_int(5)]).value == 5
+        assert peer.recv(16) == "hello"
+        peer.sendto("world", ("127.0.0.1", port))
+        time.sleep(0.1)
+        w_str = space.wrap_string("_____")
+        w_result = prim("primitiveSocketReceiveUDPDataBufCount", "SocketPlugin",
+                        [space.w_nil, w_udp, w_str, space.wrap_int(1), space.wrap_int(5)])
+        count, w_address, w_port, w_more = space.unwrap_array(w_result)
+        assert count.value == 5
+        assert w_str.unwrap_string(None) == "world"
+        assert w_address.unwrap_string(None) == "\x7f\x00\x00\x01"
+        assert w_port.value == peer.getsockname()[1]
+        w_result = prim("primitiveSocketReceiveUDPDataBufCount", "SocketPlugin",
+                        [space.w_nil, w_udp, w_str, space.wrap_int(1), space.wrap_int(5)])
+        assert space.unwrap_array(w_result)[0].value == 0
+    finally:
+        peer.close()
+
 def test_socket_destroy():
     handle = prim("primitiveSocketCreate3Semaphores", "SocketPlugin",
                   [space.w_nil, 2, 0, 8000, 8000, 13, 14, 15])
     assert prim("primitiveSocketDestroy", "SocketPlugin",
                 [space.w_nil, handle]).value == -1
+
+def test_reactor_signals_read_semaphore_once():
+    from rsqueakvm.util.reactor import Reactor, READ
+    r, w = os.pipe()
+    try:
+        reactor = Reactor()
+        reactor.register(r, 13, 14, 15)
+        reactor.enable(r, READ)
+        assert reactor.wait(1000) == []
+        os.write(w, "x")
+        assert reactor.wait(1000) == [14]
+        # interest is one-shot, until the reader asks again
+        assert not reactor.is_enabled(r, READ)
+        assert reactor.wait(1000) == []
+        reactor.enable(r, READ)
+        assert reactor.wait(1000) == [14]
+        reactor.unregister(r)
+        reactor.enable(r, READ)
+        assert reactor.wait(1000) == []
+        reactor.close()
+        assert reactor.epfd == -1 and not reactor.is_registered(r)
+    finally:
+        os.close(r)
+        os.close(w)
+
+def test_reactor_remembers_readiness():
+    from rsqueakvm.util.reactor import Reactor, READ, WRITE, POLL_MILLISECONDS
+    r, w = os.pipe()
+    try:
+        reactor = Reactor()
+        reactor.register(r, 13, 14, 15)
+        reactor.register(w, 16, 17, 18)
+        reactor.enable(r, READ)
+        assert reactor.poll(1000) == []
+        os.write(w, "x")
+        # the interrupt checks look at most every few milliseconds
+        assert reactor.poll(1000 + POLL_MILLISECONDS - 1) == []
+        assert reactor.poll(1000 + POLL_MILLISECONDS) == [14]
+        assert reactor.is_ready(r, READ)
+        # until the reader waits again
+        reactor.enable(r, READ)
+        assert not reactor.is_ready(r, READ)
+        reactor.enable(w, WRITE)
+        assert reactor.is_enabled(w, WRITE)
+        assert sorted(reactor.wait(1000)) == [14, 18]
+        assert reactor.is_ready(w, WRITE) and not reactor.is_enabled(w, WRITE)
+        reactor.close()
+    finally:
+        os.close(r)
+        os.close(w)
+
+def test_socket_data_available_from_reactor(monkeypatch):
+    from rpython.rlib import rsocket
+    from rsqueakvm.util.reactor import Reactor, POLL_MILLISECONDS
+    ours, theirs = rsocket.socketpair()
+    handle = socket.W_SocketHandle(rsocket.AF_UNIX, 0, 16, 17, 18, socket=ours)
+    reactor = Reactor()
+    try:
+        handle.register(reactor)
+        def no_wait(timeout):
+            raise AssertionError("waited for the reactor")
+        monkeypatch.setattr(reactor, "wait", no_wait)
+        assert not handle.can_read(reactor)
+        theirs.send("ping")
+        # only the interrupt checks look for new data
+        assert not handle.can_read(reactor)
+        monkeypatch.undo()
+        assert reactor.poll(POLL_MILLISECONDS) == [17]
+        assert handle.can_read(reactor)
+    finally:
+        reactor.close()
+        ours.close()
+        theirs.close()
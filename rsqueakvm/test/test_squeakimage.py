@@ -121,6 +121,83 @@ def test_stream_next_qword_is_unsigned():
     assert max_uint64 == 2**64 - 1
     assert max_uint64 > 0
 
+def test_mmap_stream(tmpdir):
+    imagefile = tmpdir.join("test.image")
+    imagefile.write(SIMPLE_VERSION_HEADER + ints2str(7), mode="wb")
+    stream = squeakimage.MmapStream(imagefile.strpath)
+    assert stream.length() == 8
+    assert stream.peek() == 6502
+    assert stream.next() == 6502
+    assert stream.words_at(0, 2) == [6502, 7]
+    assert stream.pos == stream.count == 4
+    assert stream.next() == 7
+    py.test.raises(IndexError, lambda: stream.next())
+    stream.close()
+
+def test_write_buffer(tmpdir):
+    buf = squeakimage.WriteBuffer()
+    buf.seek(4, 0)
+    buf.write("efgh")
+    buf.seek(0, 0)
+    buf.write("abc")
+    assert buf.tell() == 3
+    assert buf.length() == 8
+    buf.chunk_size = 3
+    imagefile = tmpdir.join("test.image")
+    imagefile.write("old contents", mode="wb")
+    buf.write_to(imagefile.strpath)
+    assert imagefile.read(mode="rb") == "abc\x00efgh"
+    assert not tmpdir.join("test.image.part").check()
+
+def test_reader_phase_timings():
+    from .util import image_path
+    timer = squeakimage.PhaseTimer(profile=True)
+    reader = squeakimage.ImageReader(create_space(),
+            squeakimage.Stream(filename=image_path("mini.image")), timer=timer)
+    reader.read_all()
+    names = [phase[0] for phase in timer.phases]
+    assert names == ["read header", "read body", "init g objects",
+                     "init w objects", "fillin w objects",
+                     "populate special objects", "fillin weak w objects"]
+    assert all(phase[1] >= 0 for phase in timer.phases)
+    assert timer.phases[1][3] == len(reader.chunklist)
+    assert 0 < sum(timer.object_kinds.values()) <= len(reader.chunklist)
+    assert timer.object_kinds["W_PointersObject"] == sum(timer.strategies.values())
+
+def test_lazy_image_reading():
+    from .util import image_path, open_reader
+    class CountingStream(squeakimage.MmapStream):
+        reads = {}
+        def words_at(self, pos, n):
+            self.reads[pos] = self.reads.get(pos, 0) + 1
+            return squeakimage.MmapStream.words_at(self, pos, n)
+    eager = open_reader(create_space(), "mini.image")
+    eager.read_all()
+    lazy = squeakimage.ImageReader(create_space(),
+            CountingStream(image_path("mini.image")), lazy=True)
+    lazy.read_all()
+    # every body is decoded at most once
+    assert CountingStream.reads
+    assert max(CountingStream.reads.values()) == 1
+    assert len(lazy.chunklist) == len(eager.chunklist)
+    for lazy_chunk, eager_chunk in zip(lazy.chunklist, eager.chunklist):
+        # bodies are dropped again after loading
+        assert lazy_chunk.data is None or lazy_chunk.pinned
+        w_lazy = lazy_chunk.g_object.w_object
+        w_eager = eager_chunk.g_object.w_object
+        assert w_lazy.__class__ is w_eager.__class__
+        assert w_lazy.size() == w_eager.size()
+        if isinstance(w_eager, model.W_BytesObject):
+            assert w_lazy.getbytes() == w_eager.getbytes()
+        elif isinstance(w_eager, model.W_WordsObject):
+            assert w_lazy.words == w_eager.words
+        elif isinstance(w_eager, model.W_CompiledMethod):
+            assert w_lazy.bytes == w_eager.bytes
+            assert len(w_lazy.literals) == len(w_eager.literals)
+        elif isinstance(w_eager, model.W_PointersObject):
+            w_class = w_lazy.getclass(None)
+            assert w_class.size() == w_eager.getclass(None).size()
+
 def test_simple_joinbits():
     assert 0x01010101 == joinbits(([1] * 4), [8,8,8,8])
     assert 0xFfFfFfFf == joinbits([255] * 4, [8,8,8,8])
@@ -198,3 +198,49 @@ def test_Float_store_SmallInt_to_List():
     a.store(space, 1, space.wrap_int(2))
     assert isinstance(a.strategy, storage.ListStrategy)
     check_arr(a, [1.2, 2, w_nil, w_nil, w_nil])
+
+# ====== Bulk operations
+
+def test_copy_range_same_strategy(monkeypatch):
+    a = int_arr(5)
+    b = int_arr(5)
+    b.store(space, 1, space.wrap_int(13))
+    b.store(space, 2, space.wrap_int(14))
+    def fetch(self, w_self, n0):
+        raise AssertionError("elements should not be boxed")
+    monkeypatch.setattr(storage.SmallIntegerOrNilStrategy, "fetch", fetch)
+    a.strategy.copy_range_from(a, 1, 4, b, 0)
+    monkeypatch.undo()
+    assert isinstance(a.strategy, storage.SmallIntegerOrNilStrategy)
+    check_arr(a, [12, 12, 13, 14, w_nil])
+
+def test_copy_range_switches_strategy_once():
+    a = arr(4)
+    b = float_arr(4)
+    b.store(space, 1, space.wrap_float(2.5))
+    a.strategy.copy_range_from(a, 0, 4, b, 0)
+    assert isinstance(a.strategy, storage.FloatOrNilStrategy)
+    check_arr(a, [1.2, 2.5, w_nil, w_nil])
+
+def test_copy_range_generalizes():
+    a = int_arr(3)
+    b = list_arr(3)
+    a.strategy.copy_range_from(a, 1, 3, b, 0)
+    assert isinstance(a.strategy, storage.ListStrategy)
+    assert a.fetch(space, 0).value == 12
+    assert a.fetch(space, 1) is b.fetch(space, 0)
+    assert a.fetch(space, 2).is_nil(space)
+
+def test_fill_range():
+    a = int_arr(5)
+    a.strategy.fill_range(a, 2, 4, space.wrap_int(7))
+    check_arr(a, [12, w_nil, 7, 7, w_nil])
+    a.strategy.fill_range(a, 0, 5, w_nil)
+    check_arr(a, [w_nil] * 5)
+
+def test_clone_keeps_strategy():
+    a = float_arr(3)
+    a.store(space, 2, space.wrap_float(3.5))
+    b = a.clone(space)
+    assert isinstance(b.strategy, storage.FloatOrNilStrategy)
+    check_arr(b, [1.2, w_nil, 3.5])
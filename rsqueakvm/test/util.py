@@ -100,6 +100,10 @@ class TestImage():
     def __init__(self, space):
         if space.w_Array.strategy:
             self.special_objects = space.wrap_list([i for i in space.objtable.values() if i])
+        self.space = space
+
+    def special(self, index):
+        return self.special_objects.at0(self.space, index)
 
 # This interpreter allows fine grained control of the interpretation
 # by manually stepping through the bytecodes, if _loop is set to False.
@@ -308,6 +312,7 @@ class BootstrappedObjSpace(objspace.ObjSpace):
         s.version = util.version.Version()
         s._w_self = w_class
         s.subclass_s = {}
+        s.lookup_dependencies = {}
         s._s_superclass = None
         s.store_w_superclass(w_superclass)
         s.name = name
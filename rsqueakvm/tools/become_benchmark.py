@@ -0,0 +1,45 @@
+"""Benchmark for becomeForward: on a large heap.
+
+Each VM first allocates the given number of extra objects, so that a walk
+over the heap is expensive, and then forwards pairs of fresh objects one at a
+time. The milliseconds for all forwards and for a following full garbage
+collection (which is where pending forwarders are cleaned up) are reported
+for each VM, e.g. to compare a VM before and after a change to become.
+
+Usage: python tools/become_benchmark.py <image> <objects> <becomes> <vm> [<vm> ...]
+"""
+import os, subprocess, sys
+
+CODE = """| ballast holders become gc |
+ballast := (1 to: %d) collect: [:i | Array with: i with: i printString].
+holders := (1 to: %d) collect: [:i | Array with: (Array new: 2)].
+become := Time millisecondsToRun: [
+    holders do: [:each |
+        (Array with: each first) elementsForwardIdentityTo: (Array with: (Array new: 3))]].
+gc := Time millisecondsToRun: [Smalltalk garbageCollect].
+(holders allSatisfy: [:each | each first size = 3])
+    ifFalse: [self error: 'become failed'].
+become printString, ' ', gc printString, ' ', ballast size printString"""
+
+
+def run(vm, image, code):
+    output = subprocess.check_output(
+        [vm, "-r", code, image],
+        env=dict(os.environ, SDL_VIDEODRIVER="dummy"))
+    lines = [l for l in output.splitlines() if l.strip()]
+    become, gc, _ = lines[-1].strip("'").split()
+    return int(become), int(gc)
+
+
+def main(image, objects, becomes, vms):
+    for vm in vms:
+        become, gc = run(vm, image, CODE % (objects, becomes))
+        print "%s;%d objects;%d becomes;%d ms become;%d ms gc" % (
+            vm, objects, becomes, become, gc)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 5:
+        print __doc__
+        sys.exit(1)
+    main(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), sys.argv[4:])
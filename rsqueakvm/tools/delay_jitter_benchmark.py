@@ -0,0 +1,50 @@
+"""Benchmark for how late Delays wake up, with and without --interrupt-timer.
+
+Runs a translated VM on the given image. A background process keeps the
+VM busy, either with a tight loop (which is jitted into one long trace) or
+with send-heavy code, while the foreground process repeatedly waits on a
+short Delay. For each run the microseconds between the requested and the
+actual wakeup are reported (mean and maximum over all waits).
+
+Usage: python tools/delay_jitter_benchmark.py <vm> <image> [timer-usecs] [waits]
+"""
+import os, subprocess, sys
+
+WORKLOADS = [
+    ("tight loop", "[| x | x := 0. [true] whileTrue: [x := x + 1 \\\\ 1000]]"),
+    ("sends", "[[true] whileTrue: [22 benchFib]]"),
+]
+
+CODE = """| busy jitter |
+busy := %s forkAt: Processor userBackgroundPriority.
+jitter := (1 to: %d) collect: [:i | | start |
+    start := Time utcMicrosecondClock.
+    (Delay forMilliseconds: 5) wait.
+    Time utcMicrosecondClock - start - 5000].
+busy terminate.
+((jitter inject: 0 into: [:a :b | a + b]) // jitter size) printString, ' ',
+    (jitter inject: 0 into: [:a :b | a max: b]) printString"""
+
+
+def run(vm, image, flags, code):
+    output = subprocess.check_output(
+        [vm] + flags + ["-P", "-r", code, image],
+        env=dict(os.environ, SDL_VIDEODRIVER="dummy"))
+    lines = [l for l in output.splitlines() if l.strip()]
+    mean, maximum = lines[-1].strip("'").split()
+    return int(mean), int(maximum)
+
+
+def main(vm, image, timer=1000, waits=200):
+    for name, flags in [("counter", []),
+                        ("timer", ["--interrupt-timer", str(timer)])]:
+        for workload, busy in WORKLOADS:
+            mean, maximum = run(vm, image, flags, CODE % (busy, waits))
+            print "%s;%s;mean %d us;max %d us" % (name, workload, mean, maximum)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print __doc__
+        sys.exit(1)
+    main(sys.argv[1], sys.argv[2], *[int(arg) for arg in sys.argv[3:5]])
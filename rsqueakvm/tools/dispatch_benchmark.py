@@ -0,0 +1,85 @@
+"""Micro-benchmark for the bytecode dispatch of Interpreter.step.
+
+Translates two small functions to C: one dispatches with the linear scan over
+BYTECODE_RANGES that step used to do, the other with the per-bytecode
+equality checks of BYTECODE_DISPATCH, which the translator merges into a
+switch. Both run over the same pseudo-random bytecode stream, weighted
+towards sends and jumps like real code. This is what the untranslated
+interpreter and the blackhole interpreter pay for each bytecode.
+
+Usage: python tools/dispatch_benchmark.py [iterations]
+"""
+import sys, time
+
+from rpython.rlib import unroll
+from rpython.translator.interactive import Translation
+from rsqueakvm.interpreter_bytecodes import BYTECODE_RANGES, BYTECODE_DISPATCH
+
+UNROLLING_RANGES = unroll.unrolling_iterable(BYTECODE_RANGES)
+UNROLLING_DISPATCH = unroll.unrolling_iterable(BYTECODE_DISPATCH)
+
+
+def next_bytecode(seed):
+    seed = (seed * 1103515245 + 12345) & 0x7fffffff
+    bc = seed >> 16 & 0xff
+    if bc & 1:
+        # every other bytecode is a send or a jump, which are at the end of
+        # the ranges and thus the most expensive for the linear scan
+        bc = 144 + (bc >> 1) % 112
+    return seed, bc
+
+
+def ranges_dispatch(n):
+    seed = 42
+    result = 0
+    for i in range(n):
+        seed, bytecode = next_bytecode(seed)
+        for entry in UNROLLING_RANGES:
+            if len(entry) == 2:
+                if bytecode == entry[0]:
+                    result += entry[0]
+                    break
+            else:
+                if entry[0] <= bytecode <= entry[1]:
+                    result += entry[0]
+                    break
+    return result
+
+
+def table_dispatch(n):
+    seed = 42
+    result = 0
+    for i in range(n):
+        seed, bytecode = next_bytecode(seed)
+        for bc, _ in UNROLLING_DISPATCH:
+            if bytecode == bc:
+                result += bc
+                break
+    return result
+
+
+def compile(func):
+    t = Translation(func, [int], gc="none", backend="c")
+    return t.compile_c()
+
+
+def measure(name, func, n):
+    start = time.time()
+    result = func(n)
+    duration = time.time() - start
+    print "%s;%f (%d)" % (name, duration, result)
+    return duration
+
+
+def main(argv):
+    n = int(argv[0]) if argv else 100000000
+    ranges = compile(ranges_dispatch)
+    table = compile(table_dispatch)
+    old = measure("ranges_dispatch", ranges, n)
+    new = measure("table_dispatch", table, n)
+    print "speedup;%.2f" % (old / new)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
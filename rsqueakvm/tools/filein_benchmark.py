@@ -0,0 +1,68 @@
+"""Benchmark for filing in a large package.
+
+Writes a file-in with one class and the given number of methods, and lets
+each VM file it in. This adds the methods one by one to the same method
+dictionary, which grows as it goes. The milliseconds for the file-in, as
+measured inside the image, are reported for each VM, e.g. to compare a VM
+before and after a change to the method caches.
+
+Usage: python tools/filein_benchmark.py <image> <methods> <vm> [<vm> ...]
+"""
+import os, shutil, subprocess, sys, tempfile
+
+CLASS = """Object subclass: #FileInBenchmark
+	instanceVariableNames: 'a b'
+	classVariableNames: ''
+	poolDictionaries: ''
+	category: 'FileInBenchmark'!
+
+!FileInBenchmark methodsFor: 'benchmark'!
+"""
+
+METHOD = """method%d: x
+	| y |
+	y := a ifNil: [x] ifNotNil: [a + x].
+	^ b := y * %d!
+"""
+
+CODE = "Time millisecondsToRun: [FileStream fileIn: '%s']"
+
+
+def write_filein(path, methods):
+    with open(path, "w") as f:
+        f.write(CLASS)
+        for i in range(methods):
+            f.write(METHOD % (i, i))
+        f.write(" !\n")
+
+
+def run(vm, image, code):
+    output = subprocess.check_output(
+        [vm, "-r", code, image],
+        env=dict(os.environ, SDL_VIDEODRIVER="dummy"))
+    lines = [l for l in output.splitlines() if l.strip()]
+    return int(lines[-1])
+
+
+def main(image, methods, vms):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filein = os.path.join(tmpdir, "FileInBenchmark.st")
+        write_filein(filein, methods)
+        for vm in vms:
+            # every VM files in on a fresh copy of the image
+            copy = os.path.join(tmpdir, "bench.image")
+            shutil.copy(image, copy)
+            changes = os.path.splitext(image)[0] + ".changes"
+            if os.path.exists(changes):
+                shutil.copy(changes, os.path.join(tmpdir, "bench.changes"))
+            print "%s;%d methods;%d ms" % (vm, methods, run(vm, copy, CODE % filein))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print __doc__
+        sys.exit(1)
+    main(sys.argv[1], int(sys.argv[2]), sys.argv[3:])
@@ -0,0 +1,86 @@
+"""Benchmark for receiving from a loopback socket and reading from a file.
+
+A server thread in this script sends the given number of megabytes to a
+TCP socket on 127.0.0.1, which the image receives into a 64 KB ByteArray.
+Then the image reads a file of the same size with the same buffer. The
+milliseconds for both, as measured inside the image, and the resulting
+throughput are reported for each VM, e.g. to compare a VM before and after
+a change to the receive and read primitives.
+
+Usage: python tools/io_throughput_benchmark.py <image> <megabytes> <vm> [<vm> ...]
+"""
+import os, socket, subprocess, sys, tempfile, threading
+
+SOCKET_CODE = """| socket buffer total |
+socket := Socket newTCP.
+socket connectTo: (NetNameResolver addressFromString: '127.0.0.1') port: %d.
+socket waitForConnectionFor: 10.
+buffer := ByteArray new: 65536.
+total := 0.
+(Time millisecondsToRun: [
+    [total < %d] whileTrue: [
+        total := total + (socket receiveDataInto: buffer)]]) printString"""
+
+FILE_CODE = """| file buffer |
+buffer := ByteArray new: 65536.
+file := (StandardFileStream readOnlyFileNamed: '%s') binary.
+(Time millisecondsToRun: [
+    [file atEnd] whileFalse: [
+        file readInto: buffer startingAt: 1 count: buffer size]]) printString"""
+
+CHUNK = "x" * 65536
+
+
+def serve(server, nbytes):
+    connection, _ = server.accept()
+    try:
+        sent = 0
+        while sent < nbytes:
+            sent += connection.send(CHUNK[:min(len(CHUNK), nbytes - sent)])
+    finally:
+        connection.close()
+
+
+def run(vm, image, code):
+    output = subprocess.check_output(
+        [vm, "-r", code, image],
+        env=dict(os.environ, SDL_VIDEODRIVER="dummy"))
+    lines = [l for l in output.splitlines() if l.strip()]
+    return int(lines[-1].strip("'"))
+
+
+def report(vm, kind, nbytes, ms):
+    rate = nbytes / 1024.0 / 1024.0 / max(ms, 1) * 1000
+    print "%s;%s;%d bytes;%d ms;%.1f MB/s" % (vm, kind, nbytes, ms, rate)
+
+
+def main(image, megabytes, vms):
+    nbytes = megabytes * 1024 * 1024
+    fd, path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for _ in range(0, nbytes, len(CHUNK)):
+                f.write(CHUNK)
+        for vm in vms:
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.bind(("127.0.0.1", 0))
+            server.listen(1)
+            port = server.getsockname()[1]
+            thread = threading.Thread(target=serve, args=(server, nbytes))
+            thread.start()
+            try:
+                ms = run(vm, image, SOCKET_CODE % (port, nbytes))
+            finally:
+                thread.join()
+                server.close()
+            report(vm, "socket", nbytes, ms)
+            report(vm, "file", nbytes, run(vm, image, FILE_CODE % path))
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print __doc__
+        sys.exit(1)
+    main(sys.argv[1], int(sys.argv[2]), sys.argv[3:])
@@ -0,0 +1,58 @@
+"""Benchmark for image snapshots with and without --background-snapshot.
+
+Runs a translated VM on a copy of the given image. Before taking a snapshot,
+the image is made larger by allocating ballast objects. Two numbers are
+reported for each mode:
+
+  resume  - milliseconds until the snapshot primitive returns to Smalltalk,
+            measured inside the image
+  total   - wall clock seconds for the run, minus those of the same run
+            without a snapshot. The VM waits for a background snapshot
+            before it exits, so this includes writing the file.
+
+Usage: python tools/snapshot_benchmark.py <vm> <image> [ballast] [runs]
+"""
+import os, shutil, subprocess, sys, tempfile, time
+
+ALLOCATE = "Smalltalk at: #SnapshotBallast put: ((1 to: %d) collect: [:i | Array new: 16 withAll: i])."
+SNAPSHOT = "Time millisecondsToRun: [Smalltalk snapshotPrimitive]"
+NOTHING = "Time millisecondsToRun: []"
+
+
+def run(vm, image, flags, code):
+    start = time.time()
+    output = subprocess.check_output(
+        [vm] + flags + ["-r", code, image],
+        env=dict(os.environ, SDL_VIDEODRIVER="dummy"))
+    elapsed = time.time() - start
+    lines = [l for l in output.splitlines() if l.strip()]
+    return int(lines[-1]), elapsed
+
+
+def main(vm, image, ballast=1000000, runs=5):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        ballast_code = ALLOCATE % ballast
+        for name, flags in [("synchronous", []),
+                            ("background", ["--background-snapshot"])]:
+            resume, total = [], []
+            for i in range(runs):
+                copy = os.path.join(tmpdir, "bench.image")
+                shutil.copyfile(image, copy)
+                _, baseline = run(vm, copy, flags, ballast_code + NOTHING)
+                ms, elapsed = run(vm, copy, flags, ballast_code + SNAPSHOT)
+                resume.append(ms)
+                total.append(elapsed - baseline)
+            print "%s;resume;%d ms (min %d, max %d)" % (
+                name, sum(resume) / len(resume), min(resume), max(resume))
+            print "%s;total;%.3f s (min %.3f, max %.3f)" % (
+                name, sum(total) / len(total), min(total), max(total))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print __doc__
+        sys.exit(1)
+    main(sys.argv[1], sys.argv[2], *[int(arg) for arg in sys.argv[3:5]])
@@ -0,0 +1,93 @@
+"""Benchmark for serving HTTP-style requests from an image over loopback.
+
+The image listens on a TCP port with a backlog and answers each request
+with a small response. A client in this script sends the given number of
+requests one after the other, each on a new connection, and reports the
+requests per second for each VM.
+
+Usage: python tools/socket_server_benchmark.py <image> <requests> <vm> [<vm> ...]
+"""
+import os, socket, subprocess, sys, time
+
+SERVER_CODE = """| server served response |
+response := 'HTTP/1.0 200 OK', String crlf, 'Content-Length: 2', String crlf, String crlf, 'ok'.
+server := Socket newTCP.
+server setOption: 'SO_REUSEADDR' value: true.
+server listenOn: %d backlogSize: 16.
+served := 0.
+[served < %d] whileTrue: [ | client buffer |
+    client := server waitForAcceptFor: 10.
+    client ifNotNil: [
+        client setOption: 'TCP_NODELAY' value: true.
+        buffer := String new: 4096.
+        client waitForDataFor: 10.
+        client receiveDataInto: buffer.
+        client sendData: response.
+        client closeAndDestroy.
+        served := served + 1]].
+server closeAndDestroy.
+served printString"""
+
+REQUEST = "GET / HTTP/1.0\r\nHost: localhost\r\n\r\n"
+
+
+def free_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def request(port):
+    connection = socket.create_connection(("127.0.0.1", port))
+    try:
+        connection.sendall(REQUEST)
+        response = ""
+        while True:
+            data = connection.recv(4096)
+            if not data:
+                return response
+            response += data
+    finally:
+        connection.close()
+
+
+def run(vm, image, requests):
+    port = free_port()
+    server = subprocess.Popen(
+        [vm, "-r", SERVER_CODE % (port, requests), image],
+        stdout=subprocess.PIPE,
+        env=dict(os.environ, SDL_VIDEODRIVER="dummy"))
+    try:
+        # the first request waits until the image listens
+        deadline = time.time() + 60
+        while True:
+            try:
+                request(port)
+                break
+            except socket.error:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+        start = time.time()
+        for _ in range(requests - 1):
+            assert request(port).endswith("ok")
+        seconds = time.time() - start
+    finally:
+        server.communicate()
+    return seconds
+
+
+def main(image, requests, vms):
+    for vm in vms:
+        seconds = run(vm, image, requests)
+        print "%s;%d requests;%.3f s;%.1f requests/s" % (
+            vm, requests - 1, seconds, (requests - 1) / max(seconds, 0.001))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print __doc__
+        sys.exit(1)
+    main(sys.argv[1], int(sys.argv[2]), sys.argv[3:])
@@ -0,0 +1,105 @@
+from rpython.translator.tool.cbuild import ExternalCompilationInfo
+from rpython.rtyper.lltypesystem import lltype, rffi
+from rpython.rlib.rarithmetic import intmask
+
+# epoll(7) for the reactor on Linux. The watched descriptors live in the
+# kernel, so waiting costs nothing per idle socket. Events are passed in and
+# out as poll(2) flags, descriptors are armed one-shot like in the reactor.
+
+eci = ExternalCompilationInfo(
+    post_include_bits=["""
+#ifndef __rsqueak_epoll_h
+#define __rsqueak_epoll_h
+
+#define DLLEXPORT __attribute__((__visibility__("default")))
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+        DLLEXPORT int RSqueakEpollCreate();
+        DLLEXPORT int RSqueakEpollArm(int epfd, int fd, int events);
+        DLLEXPORT int RSqueakEpollWait(int epfd, int *fds, int *events, int max, int timeout);
+#ifdef __cplusplus
+}
+#endif
+
+#endif"""],
+    separate_module_sources=["""
+#include <errno.h>
+#include <poll.h>
+#include <sys/epoll.h>
+
+int RSqueakEpollCreate() {
+        return epoll_create1(EPOLL_CLOEXEC);
+}
+
+/* Watch fd for the poll events until the next one of them, or stop watching
+   it if events is 0 */
+int RSqueakEpollArm(int epfd, int fd, int events) {
+        struct epoll_event ev;
+        int res;
+        if (events == 0) {
+                res = epoll_ctl(epfd, EPOLL_CTL_DEL, fd, &ev);
+                return (res < 0 && (errno == ENOENT || errno == EBADF)) ? 0 : res;
+        }
+        ev.events = EPOLLONESHOT;
+        if (events & POLLIN) ev.events |= EPOLLIN;
+        if (events & POLLOUT) ev.events |= EPOLLOUT;
+        ev.data.fd = fd;
+        res = epoll_ctl(epfd, EPOLL_CTL_MOD, fd, &ev);
+        if (res < 0 && errno == ENOENT) {
+                res = epoll_ctl(epfd, EPOLL_CTL_ADD, fd, &ev);
+        }
+        return res;
+}
+
+/* Wait at most timeout milliseconds, answer the number of ready descriptors
+   or -1 */
+int RSqueakEpollWait(int epfd, int *fds, int *events, int max, int timeout) {
+        struct epoll_event ready[64];
+        int i, count;
+        if (max > 64) max = 64;
+        count = epoll_wait(epfd, ready, max, timeout);
+        for (i = 0; i < count; i++) {
+                int revents = 0;
+                if (ready[i].events & EPOLLIN) revents |= POLLIN;
+                if (ready[i].events & EPOLLOUT) revents |= POLLOUT;
+                if (ready[i].events & EPOLLERR) revents |= POLLERR;
+                if (ready[i].events & EPOLLHUP) revents |= POLLHUP;
+                fds[i] = ready[i].data.fd;
+                events[i] = revents;
+        }
+        return count;
+}
+"""]
+)
+
+MAX_EVENTS = 64
+
+__ll_create = rffi.llexternal('RSqueakEpollCreate', [], rffi.INT,
+                              compilation_info=eci)
+__ll_arm = rffi.llexternal('RSqueakEpollArm', [rffi.INT, rffi.INT, rffi.INT],
+                           rffi.INT, compilation_info=eci)
+__ll_wait = rffi.llexternal('RSqueakEpollWait',
+                            [rffi.INT, rffi.INTP, rffi.INTP, rffi.INT, rffi.INT],
+                            rffi.INT, compilation_info=eci)
+
+def create():
+    return intmask(__ll_create())
+
+def arm(epfd, fd, events):
+    return intmask(__ll_arm(epfd, fd, events))
+
+def wait(epfd, timeout):
+    """Answer a list of (fd, poll events), empty on errors like EINTR."""
+    result = []
+    fds = lltype.malloc(rffi.INTP.TO, MAX_EVENTS, flavor='raw')
+    events = lltype.malloc(rffi.INTP.TO, MAX_EVENTS, flavor='raw')
+    try:
+        count = intmask(__ll_wait(epfd, fds, events, MAX_EVENTS, timeout))
+        for i in range(count):
+            result.append((intmask(fds[i]), intmask(events[i])))
+    finally:
+        lltype.free(fds, flavor='raw')
+        lltype.free(events, flavor='raw')
+    return result
@@ -0,0 +1,137 @@
+import time
+
+from rpython.memory.gc import env
+from rpython.rlib import jit, rgc
+from rpython.rlib.rarithmetic import intmask
+
+from rsqueakvm.util.platform_calls import get_memory_usage
+
+# incminimark's nursery size when it cannot guess the cache size
+DEFAULT_NURSERY_SIZE = 896 * 1024
+
+# How often the interrupt checks look at the memory usage
+LOW_SPACE_CHECK_MILLISECONDS = 250
+
+
+class GcStatistics(object):
+    """Memory and garbage collection figures for the VM parameters.
+
+    The collections that the image asks for (the primitives 130 and 131) are
+    counted and timed here, together with the memory used after the last
+    one. The RPython GC does not report the collections it does on its own.
+    Its nursery size and thresholds come from the PYPY_GC_* environment
+    variables at startup, only the maximum heap size can be changed later.
+
+    With a maximum heap size, the image can ask to be warned when the bytes
+    left fall below a threshold (primitives 124 and 125). The memory usage is
+    then checked after each collection and regularly from the interrupt
+    checks, where a full collection is tried first. Like in the Squeak VMs,
+    the warning is given once, the image has to set the threshold again."""
+
+    def __init__(self):
+        self.full_gcs = 0
+        self.full_gc_usecs = 0
+        self.incremental_gcs = 0
+        self.incremental_gc_usecs = 0
+        self.last_gc_usecs = 0
+        self.last_gc_clock = 0
+        self.memory_after_gc = 0
+        self.nursery_size = 0
+        self.max_heap_size = 0
+        self.low_space_threshold = 0
+        self.low_space = False
+        self.last_low_space_check = 0
+
+    def startup(self):
+        """Read the GC settings like the GC itself did at startup. This reads
+        the environment and /proc, so it is left to the entry point and the
+        figures stay 0 for interpreters built by tests."""
+        self.nursery_size = env.read_from_env('PYPY_GC_NURSERY')
+        if self.nursery_size <= 0:
+            self.nursery_size = env.estimate_best_nursery_size()
+            if self.nursery_size <= 0:
+                self.nursery_size = DEFAULT_NURSERY_SIZE
+        self.max_heap_size = intmask(env.read_uint_from_env('PYPY_GC_MAX'))
+
+    def collect(self, full, clock):
+        """Collect garbage, the nursery only unless full is set. Clock is
+        the millisecond clock of the interpreter, to remember when the
+        collection finished."""
+        start = time.time()
+        if full:
+            rgc.collect()
+        else:
+            rgc.collect(0)
+        usecs = int((time.time() - start) * 1000000)
+        if full:
+            self.full_gcs += 1
+            self.full_gc_usecs += usecs
+        else:
+            self.incremental_gcs += 1
+            self.incremental_gc_usecs += usecs
+        self.last_gc_usecs = usecs
+        self.last_gc_clock = clock
+        self.memory_after_gc = max(0, self.memory_usage())
+        if self.is_low_on_space(self.memory_after_gc):
+            self.low_space = True
+            self.low_space_threshold = 0
+
+    def memory_usage(self):
+        """The memory currently used by the VM process, or -1 if unknown."""
+        return get_memory_usage()
+
+    def bytes_left(self):
+        """The bytes that can still be allocated before reaching the maximum
+        heap size or, without one, the physical memory."""
+        limit = self.max_heap_size
+        if limit <= 0:
+            limit = int(env.get_total_memory())
+        usage = self.memory_usage()
+        if usage < 0:
+            # there was an error getting the result
+            return 2**29
+        return max(0, limit - usage)
+
+    def old_space_size(self):
+        return max(0, self.memory_usage() - self.nursery_size)
+
+    def set_max_heap_size(self, nbytes):
+        """Limit the heap to nbytes, or lift the limit if nbytes is 0. The GC
+        does a major collection at the latest when reaching the limit, and
+        fails allocations beyond it."""
+        self.max_heap_size = nbytes
+        rgc.set_max_heap_size(nbytes)
+
+    def is_low_on_space(self, usage):
+        """Whether usage, the memory used by the process, leaves less than
+        the threshold below the maximum heap size. The GC applies the limit
+        to its own heap, but does not report the size of that heap. So the
+        process size stands in for it, which also counts the nursery, machine
+        code and memory outside the GC heap. The limit is approximate, and
+        the warning comes too early rather than too late."""
+        return (self.max_heap_size > 0 and self.low_space_threshold > 0 and
+                usage >= 0 and
+                self.max_heap_size - usage < self.low_space_threshold)
+
+    @jit.dont_look_inside
+    def check_low_space(self, clock):
+        """Called from the interrupt checks with the millisecond clock.
+        Answer whether the low space semaphore should be signalled."""
+        if self.low_space_threshold > 0 and self.max_heap_size > 0:
+            elapsed = clock - self.last_low_space_check
+            # the first check is done right away
+            if (self.last_low_space_check == 0 or elapsed < 0 or
+                    elapsed >= LOW_SPACE_CHECK_MILLISECONDS):
+                self.last_low_space_check = clock
+                if self.is_low_on_space(self.memory_usage()):
+                    # only warn if collecting garbage does not help
+                    self.collect(True, clock)
+        low_space = self.low_space
+        self.low_space = False
+        return low_space
+
+    def allocation_failed(self):
+        """An allocation ran into the maximum heap size."""
+        if self.low_space_threshold > 0:
+            self.low_space = True
+            self.low_space_threshold = 0
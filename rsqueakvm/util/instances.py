@@ -0,0 +1,85 @@
+from rsqueakvm import model
+from rpython.rlib import jit
+
+
+class InstanceList(object):
+    """The instances of one class (or all objects), in the order in which
+    they were found. Positions are only computed when someone iterates with
+    next_after, so that nextInstance is a dict lookup instead of a search
+    through the list."""
+    _attrs_ = ["objects_w", "positions"]
+
+    def __init__(self):
+        self.objects_w = []
+        self.positions = None
+
+    def append(self, w_obj):
+        if self.positions is not None:
+            self.positions[w_obj] = len(self.objects_w)
+        self.objects_w.append(w_obj)
+
+    def size(self):
+        return len(self.objects_w)
+
+    def first(self):
+        if len(self.objects_w) == 0:
+            return None
+        return self.objects_w[0]
+
+    def next_after(self, w_obj):
+        """Answer the object after w_obj, the first object if w_obj is not in
+        the list, or None at the end."""
+        if self.positions is None:
+            self.positions = {}
+            for i in range(len(self.objects_w)):
+                self.positions[self.objects_w[i]] = i
+        index = self.positions.get(w_obj, -1) + 1
+        if index < len(self.objects_w):
+            return self.objects_w[index]
+        return None
+
+
+@jit.dont_look_inside
+def find_instances(space, w_root, w_class=None, some_instance=False):
+    """Answer the InstanceList of w_class (or of all objects, if w_class is
+    None) reachable from w_root, in a single trace of the heap. With
+    some_instance, stop after the first match."""
+    instances = InstanceList()
+    seen_w = {}
+    pending = [w_root]
+    while pending:
+        w_obj = pending.pop()
+        if isinstance(w_obj, model.W_PointersObject):
+            # only the target of a lazy become is an instance
+            w_obj = w_obj.forwarded()
+        if w_obj and not seen_w.get(w_obj, False):
+            seen_w[w_obj] = True
+            if _is_instance(space, w_obj, w_class):
+                instances.append(w_obj)
+                if some_instance:
+                    return instances
+            pending.extend(_trace_pointers(space, w_obj))
+    return instances
+
+
+def _is_instance(space, w_obj, w_class):
+    if not w_obj.has_class():
+        return False
+    w_cls = w_obj.getclass(space)
+    if w_cls is None:
+        return False
+    # XXX: should not return SmallFloat64 on Spur64...
+    if (w_cls.is_same_object(space.w_SmallInteger) or
+            (space.is_spur.is_set() and
+             w_cls.is_same_object(space.w_Character))):
+        return False
+    return w_class is None or w_cls.is_same_object(w_class)
+
+
+def _trace_pointers(space, w_obj):
+    p_w = [w_obj.getclass(space)]
+    if isinstance(w_obj, model.W_CompiledMethod):
+        p_w.extend(w_obj.literals)
+    elif isinstance(w_obj, model.W_PointersObject):
+        p_w.extend(w_obj.fetch_all(space))
+    return p_w
@@ -22,15 +22,20 @@ eci = ExternalCompilationInfo(
 #include <psapi.h>
 #define DLLEXPORT __declspec(dllexport)
 #else
+#include <stdio.h>
+#include <unistd.h>
 #include <sys/time.h>
 #include <sys/resource.h>
+#ifdef __APPLE__
+#include <mach/mach.h>
+#endif
 #define DLLEXPORT __attribute__((__visibility__("default")))
 #endif
 
 #ifdef __cplusplus
 extern "C" {
 #endif
-        DLLEXPORT int RSqueakGetMemoryUsage();
+        DLLEXPORT long RSqueakGetMemoryUsage();
 #ifdef __cplusplus
 }
 #endif
@@ -39,26 +44,50 @@ extern "C" {
     include_dirs=[this_dir],
     link_files=libraries,
     separate_module_sources=["""
-int RSqueakGetMemoryUsage() {
+/* The memory currently used by the process, or -1 */
+long RSqueakGetMemoryUsage() {
 #ifdef _WIN32
         PROCESS_MEMORY_COUNTERS_EX memCountr;
         if (GetProcessMemoryInfo(GetCurrentProcess(), &memCountr, sizeof(memCountr))) {
-            return (int)(memCountr.PrivateUsage);
+            return (long)(memCountr.PrivateUsage);
         } else {
             return -1;
         }
-#else
-        struct rusage usage;
-        if (!getrusage(RUSAGE_SELF, &usage)) {
-            return (int)(usage.ru_maxrss * 1024);
+#elif defined(__APPLE__)
+        struct mach_task_basic_info info;
+        mach_msg_type_number_t count = MACH_TASK_BASIC_INFO_COUNT;
+        if (task_info(mach_task_self(), MACH_TASK_BASIC_INFO,
+                      (task_info_t)&info, &count) == KERN_SUCCESS) {
+            return (long)info.resident_size;
         } else {
             return -1;
         }
+#else
+        long pages = -1;
+        FILE *statm = fopen("/proc/self/statm", "r");
+        if (statm) {
+            /* the second field is the resident set size in pages */
+            if (fscanf(statm, "%*s %ld", &pages) != 1) {
+                pages = -1;
+            }
+            fclose(statm);
+        }
+        if (pages >= 0) {
+            return pages * sysconf(_SC_PAGESIZE);
+        } else {
+            /* no procfs, fall back to the peak usage */
+            struct rusage usage;
+            if (!getrusage(RUSAGE_SELF, &usage)) {
+                return (long)(usage.ru_maxrss * 1024);
+            } else {
+                return -1;
+            }
+        }
 #endif
 }"""]
 )
 
-__ll_memory_usage = rffi.llexternal('RSqueakGetMemoryUsage', [], rffi.INT,
+__ll_memory_usage = rffi.llexternal('RSqueakGetMemoryUsage', [], rffi.LONG,
                                     compilation_info=eci)
 def get_memory_usage():
     res = __ll_memory_usage()
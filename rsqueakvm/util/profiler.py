@@ -0,0 +1,59 @@
+from rsqueakvm import objspace
+from rsqueakvm.util import signals
+
+# What the VM was doing when a sample was taken
+SAMPLE_INTERPRETED = 0
+SAMPLE_JITTED = 1
+SAMPLE_PRIMITIVE = 2
+
+DEFAULT_INTERVAL_MICROSECONDS = 1000
+MAX_SAMPLES = 1 << 18
+
+
+class SamplingProfiler(object):
+    """Statistical profiler for the primitives 250-253.
+
+    While active, a SIGPROF interval timer sets the signal flag of the VM.
+    The interpreter reads the flag where it checks for interrupts and after
+    primitive calls, and records the active CompiledMethod. When profiling
+    is off, the checks are folded away in traces, because `active` is a
+    quasi-immutable flag."""
+    _immutable_fields_ = ["active"]
+
+    def __init__(self, interval=DEFAULT_INTERVAL_MICROSECONDS):
+        self.active = objspace.ConstantFlag()
+        self.interval = interval
+        self.clear()
+
+    def clear(self):
+        self.methods_w = []
+        self.kinds = []
+        self.counts = [0, 0, 0]
+        self.dropped = 0
+
+    def is_active(self):
+        return self.active.is_set()
+
+    def start(self):
+        if self.active.is_set():
+            return
+        signals.start_interval_timer(signals.ITIMER_PROF, signals.SIGPROF,
+                                     self.interval)
+        self.active.activate()
+
+    def stop(self):
+        if not self.active.is_set():
+            return
+        self.active.deactivate()
+        signals.stop_interval_timer(signals.ITIMER_PROF, signals.SIGPROF)
+
+    def record(self, w_method, kind):
+        if len(self.methods_w) >= MAX_SAMPLES:
+            self.dropped += 1
+            return
+        self.methods_w.append(w_method)
+        self.kinds.append(kind)
+        self.counts[kind] += 1
+
+    def sample_count(self):
+        return len(self.methods_w)
@@ -0,0 +1,156 @@
+import os
+import time
+
+from rpython.rlib import jit, rpoll
+
+from rsqueakvm.util.system import IS_LINUX
+
+if IS_LINUX:
+    from rsqueakvm.util import epoll
+
+READ = rpoll.POLLIN
+WRITE = rpoll.POLLOUT
+_ERROR = rpoll.POLLERR | rpoll.POLLHUP | rpoll.POLLNVAL
+
+# How often the interrupt checks look for ready descriptors
+POLL_MILLISECONDS = 5
+
+
+class Reactor(object):
+    """Lets the VM sleep while it is idle, until a registered file descriptor
+    becomes ready or a timeout passes, and tells the interrupt checks about
+    descriptors that became ready while the image runs.
+
+    Each descriptor has three external semaphore indices, as passed to the
+    socket primitives: one for its state, one for reading and one for
+    writing. Like the aio functions of the Squeak VMs, interest in reading
+    or writing is one-shot. Once it fired, the owner has to enable it again,
+    typically when a read or write would block. Until then, the descriptor
+    counts as ready, so the owner does not have to ask the system.
+
+    On Linux, the descriptors are watched with epoll, elsewhere with poll."""
+
+    def __init__(self):
+        self.semaphores = {}  # fd -> (semaphore, read semaphore, write semaphore)
+        self.interest = {}    # fd -> poll events
+        self.ready = {}       # fd -> poll events that fired since enabled
+        self.epfd = -1
+        self.last_poll = 0
+
+    def register(self, fd, sema, read_sema, write_sema):
+        self.semaphores[fd] = (sema, read_sema, write_sema)
+        if fd in self.ready:
+            del self.ready[fd]
+
+    def unregister(self, fd):
+        if fd in self.semaphores:
+            del self.semaphores[fd]
+        if fd in self.interest:
+            del self.interest[fd]
+            self._arm(fd, 0)
+        if fd in self.ready:
+            del self.ready[fd]
+
+    def enable(self, fd, events):
+        if fd in self.semaphores:
+            self.ready[fd] = self.ready.get(fd, 0) & ~events
+            interest = self.interest.get(fd, 0)
+            if interest | events != interest:
+                self.interest[fd] = interest | events
+                self._arm(fd, interest | events)
+
+    def is_registered(self, fd):
+        return fd in self.semaphores
+
+    def is_enabled(self, fd, events):
+        return self.interest.get(fd, 0) & events != 0
+
+    def is_ready(self, fd, events):
+        return self.ready.get(fd, 0) & events != 0
+
+    @jit.dont_look_inside
+    def poll(self, clock):
+        """Called from the interrupt checks with the millisecond clock.
+        Answer the indices of the external semaphores to signal."""
+        if len(self.interest) == 0:
+            return []
+        elapsed = clock - self.last_poll
+        if 0 <= elapsed < POLL_MILLISECONDS:
+            return []
+        self.last_poll = clock
+        return self.wait(0)
+
+    def wait(self, timeout):
+        """Wait at most timeout microseconds. Answer the indices of the
+        external semaphores to signal."""
+        ready_semaphores = []
+        if len(self.interest) == 0:
+            if timeout > 0:
+                time.sleep(timeout / 1000000.0)
+            return ready_semaphores
+        for fd, revents in self._wait((timeout + 999) // 1000):
+            if fd not in self.semaphores:
+                continue
+            events = self.interest.get(fd, 0)
+            sema, read_sema, write_sema = self.semaphores[fd]
+            if revents & _ERROR:
+                # the descriptor is closed or broken, report it once
+                if fd in self.interest:
+                    del self.interest[fd]
+                self.ready[fd] = self.ready.get(fd, 0) | events
+                if revents & rpoll.POLLNVAL:
+                    del self.semaphores[fd]
+                _add_semaphore(ready_semaphores, sema)
+                if events & READ:
+                    _add_semaphore(ready_semaphores, read_sema)
+                if events & WRITE:
+                    _add_semaphore(ready_semaphores, write_sema)
+                continue
+            remaining = events
+            if revents & READ:
+                remaining &= ~READ
+                _add_semaphore(ready_semaphores, read_sema)
+            if revents & WRITE:
+                remaining &= ~WRITE
+                _add_semaphore(ready_semaphores, write_sema)
+            self.ready[fd] = self.ready.get(fd, 0) | (events & ~remaining)
+            if remaining == 0:
+                if fd in self.interest:
+                    del self.interest[fd]
+            else:
+                self.interest[fd] = remaining
+                self._arm(fd, remaining)
+        return ready_semaphores
+
+    def close(self):
+        """Stop watching all descriptors. The reactor can be used again
+        afterwards, as if it was new."""
+        self.semaphores.clear()
+        self.interest.clear()
+        self.ready.clear()
+        if IS_LINUX and self.epfd >= 0:
+            os.close(self.epfd)
+            self.epfd = -1
+
+    def _arm(self, fd, events):
+        if IS_LINUX:
+            if self.epfd < 0:
+                if events == 0:
+                    return
+                # created lazily, the reactor may be built before the VM runs
+                self.epfd = epoll.create()
+            epoll.arm(self.epfd, fd, events)
+
+    def _wait(self, timeout):
+        if IS_LINUX and self.epfd >= 0:
+            return epoll.wait(self.epfd, timeout)
+        try:
+            return rpoll.poll(self.interest, timeout)
+        except rpoll.PollError:
+            # e.g. EINTR from an interval timer, the caller just checks again
+            return []
+
+
+def _add_semaphore(semaphores, index):
+    if index > 0 and index not in semaphores:
+        semaphores.append(index)
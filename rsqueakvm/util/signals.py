@@ -0,0 +1,56 @@
+from rpython.rlib import rsignal
+from rpython.rtyper.lltypesystem import lltype, rffi
+
+# Interval timers deliver their signals through the flag mechanism of
+# rsignal: the handler only marks the signal as pending, and the interpreter
+# polls for it at its interrupt checks.
+
+HAS_ITIMER = hasattr(rsignal, "c_setitimer")
+if HAS_ITIMER:
+    SIGALRM = rsignal.SIGALRM
+    SIGPROF = rsignal.SIGPROF
+    ITIMER_REAL = rsignal.ITIMER_REAL
+    ITIMER_PROF = rsignal.ITIMER_PROF
+else:
+    SIGALRM = SIGPROF = ITIMER_REAL = ITIMER_PROF = -1
+
+
+def _set_timeval(timeval, microseconds):
+    rffi.setintfield(timeval, 'c_tv_sec', microseconds // 1000000)
+    rffi.setintfield(timeval, 'c_tv_usec', microseconds % 1000000)
+
+def _set_interval_timer(which, microseconds):
+    with lltype.scoped_alloc(rsignal.itimervalP.TO, 1) as timer:
+        _set_timeval(timer[0].c_it_value, microseconds)
+        _set_timeval(timer[0].c_it_interval, microseconds)
+        rsignal.c_setitimer(which, timer, lltype.nullptr(rsignal.itimervalP.TO))
+
+def start_interval_timer(which, signum, microseconds):
+    if not HAS_ITIMER:
+        return False
+    rsignal.pypysig_setflag(signum)
+    # do not make blocking system calls fail with EINTR
+    rsignal.c_siginterrupt(signum, 0)
+    _set_interval_timer(which, microseconds)
+    return True
+
+def stop_interval_timer(which, signum):
+    if not HAS_ITIMER:
+        return
+    _set_interval_timer(which, 0)
+    rsignal.pypysig_ignore(signum)
+
+def signal_pending():
+    # The same check PyPy uses for its periodic actions: a single read of
+    # a counter the signal handler sets to -1.
+    return rsignal.pypysig_getaddr_occurred().c_value < 0
+
+def clear_signal_pending():
+    rsignal.pypysig_getaddr_occurred().c_value = 0
+
+def poll_signal():
+    """Answer the number of a pending signal, -1 if there is none."""
+    return rffi.cast(lltype.Signed, rsignal.pypysig_poll())
+
+def pushback_signal(signum):
+    rsignal.pypysig_pushback(signum)
@@ -1,4 +1,5 @@
-from rpython.rlib import streamio, objectmodel
+import os
+from rpython.rlib import streamio, objectmodel, rmmap
 from rpython.rlib.rstruct.runpack import runpack as rlib_runpack
 from rsqueakvm.util import system
 
@@ -72,9 +73,9 @@ class Stream(object):
         return bytes
 
     def peek(self):
-        if self.pos >= len(self.data):
+        if self.pos >= self.length():
             raise IndexError
-        data_peek = self.data[self.pos:self.pos + self.word_size]
+        data_peek = self.peek_bytes(self.word_size)
         if self.use_long_read:
             assert system.IS_64BIT, "do not support reading 64 bit slots in 32 bit build"
             if self.big_endian:
@@ -104,6 +105,16 @@ class Stream(object):
         qword = self.bytes2qword_with_correct_endianness(bytes)
         return qword
 
+    def words_at(self, pos, n):
+        """ Answer n words starting at the byte position pos without moving
+        this stream. Used to decode object bodies lazily. """
+        oldpos, oldcount = self.pos, self.count
+        self.pos = pos
+        try:
+            return [self.next() for _ in range(n)]
+        finally:
+            self.pos, self.count = oldpos, oldcount
+
     def reset(self):
         self.big_endian = True
         self.pos = 0
@@ -115,13 +126,13 @@ class Stream(object):
 
     def skipbytes(self, jump):
         assert jump > 0
-        assert (self.pos + jump) <= len(self.data)
+        assert (self.pos + jump) <= self.length()
         self.pos += jump
         self.count += jump
 
     def skipwords(self, jump):
         self.skipbytes(jump * self.word_size)
-        assert (self.pos + jump) <= len(self.data)
+        assert (self.pos + jump) <= self.length()
         self.pos += jump
         self.count += jump
 
@@ -138,3 +149,81 @@ class Stream(object):
     def be_32bit(self):
         self.word_size = 4
         self.use_long_read = False
+
+
+class MmapStream(Stream):
+    """ Input stream on a read-only memory mapping of a file.
+    The data is paged in by the OS on demand instead of being copied
+    into the heap upfront.
+    Constructor can raise OSError. """
+
+    def __init__(self, filename):
+        fd = os.open(filename, os.O_RDONLY, 0)
+        try:
+            size = os.fstat(fd).st_size
+            self.map = rmmap.mmap(fd, size, access=rmmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        self.size = size
+        self.reset()
+
+    def peek_bytes(self, n):
+        n = min(n, self.size - self.pos)
+        if n <= 0:
+            return ""
+        self.map.check_valid()
+        return self.map.getslice(self.pos, n)
+
+    def length(self):
+        return self.size
+
+    def close(self):
+        self.map.close()
+
+
+class WriteBuffer(object):
+    """ Seekable in-memory output stream. Callers can seek around and write
+    small pieces, the file itself is written with a few large writes at the
+    end. The file is first written next to the target and then renamed, so
+    an interrupted write does not leave a truncated file behind. """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self):
+        self.data = []
+        self.pos = 0
+
+    def write(self, string):
+        end = self.pos + len(string)
+        if end > len(self.data):
+            self.data.extend(['\x00'] * (end - len(self.data)))
+        pos = self.pos
+        for i in range(len(string)):
+            self.data[pos + i] = string[i]
+        self.pos = end
+
+    def seek(self, pos, whence=0):
+        assert whence == 0
+        self.pos = pos
+
+    def tell(self):
+        return self.pos
+
+    def length(self):
+        return len(self.data)
+
+    def write_to(self, filename):
+        tmpname = filename + ".part"
+        f = streamio.open_file_as_stream(tmpname, mode="wb", buffering=0)
+        try:
+            size = len(self.data)
+            start = 0
+            while start < size:
+                end = min(start + self.chunk_size, size)
+                f.write("".join(self.data[start:end]))
+                start = end
+        finally:
+            f.close()
+        if system.IS_WINDOWS and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmpname, filename)
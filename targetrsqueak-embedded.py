@@ -34,6 +34,7 @@ interp, s_frame = setup()
 def entry_point(argv):
     if len(argv) > 1:
         print "This RSqueak VM has an embedded image and ignores all cli-parameters."
+    interp.gc_stats.startup()
     try:
         interp.loop(s_frame.w_self())
     except interpreter.ReturnFromTopLevel, e:
@@ -83,8 +83,24 @@ def _usage(argv):
                                  image is not responding well.
             -i|--no-interrupts - Disable timer interrupt.
                                  Disables non-cooperative scheduling.
+            --interrupt-timer <usecs>
+                               - Check for interrupts every <usecs> microseconds
+                                 of wall clock time, using an interval timer,
+                                 instead of after a number of sends.
+            --memory-limit <MB>
+                               - Limit the heap to <MB> megabytes. The image
+                                 gets its low space warning when coming near
+                                 the limit. Also VM parameter 73 (in bytes).
             -S|--no-storage    - Disable specialized storage strategies.
                                  Always use generic ListStrategy. Probably slower.
+            --mmap-image       - Map the image file into memory instead of
+                                 reading it, and decode object bodies only
+                                 when they are needed while loading. Lowers
+                                 peak memory for large images.
+            --background-snapshot
+                               - Write snapshots from a forked process, so
+                                 the image continues right away instead of
+                                 waiting for the file to be written.
             --hacks            - Enable Spy hacks. Set display color depth to 8
             --use-plugins      - Directs named primitives to go to the native
                                  Squeak plugins, which must be in the dynamic
@@ -102,6 +118,12 @@ def _usage(argv):
             -L|--storage-log-aggregate
                              - Output an aggregated storage log at the end of
                                execution.
+            --reader-timings - Print the time spent in each phase of loading
+                               the image.
+            --startup-profile
+                             - Print time, memory and object counts for each
+                               startup phase, and the kinds of objects and
+                               storage strategies that were loaded.
 
           Global: (This section is for compatibility with Squeak.ini)
             --ImageFile <path>   - path to the image file
@@ -176,8 +198,13 @@ class Config(object):
         self.headless = True
         self.poll = False
         self.interrupts = True
+        self.interrupt_timer = 0
+        self.memory_limit = 0
         self.trace = False
         self.trace_important = False
+        self.mmap_image = False
+        self.reader_timings = False
+        self.startup_profile = False
         self.extra_arguments_idx = len(argv)
 
     def parse_args(self, argv, skip_bad=False):
@@ -221,12 +248,24 @@ class Config(object):
             elif arg in ["--reader-jit-args"]:
                 jitarg, idx = get_parameter(argv, idx, arg)
                 squeakimage.set_reader_user_param(jitarg)
+            elif arg in ["--reader-timings"]:
+                self.reader_timings = True
+            elif arg in ["--startup-profile"]:
+                self.startup_profile = True
             elif arg in ["-p", "--poll"]:
                 self.poll = True
             elif arg in ["-i", "--no-interrupts"]:
                 self.interrupts = False
+            elif arg in ["--interrupt-timer"]:
+                self.interrupt_timer, idx = get_int_parameter(argv, idx, arg)
+            elif arg in ["--memory-limit"]:
+                self.memory_limit, idx = get_int_parameter(argv, idx, arg)
             elif arg in ["-S", "--no-storage"]:
                 self.space.strategy_factory.no_specialized_storage.activate()
+            elif arg in ["--mmap-image"]:
+                self.mmap_image = True
+            elif arg in ["--background-snapshot"]:
+                self.space.background_snapshot.activate()
             elif arg in ["--hacks"]:
                 self.space.run_spy_hacks.activate()
             elif arg in ["--use-plugins"]:
@@ -380,20 +419,32 @@ def entry_point(argv):
             print_error(e.msg)
             return 1
 
+    timer = squeakimage.PhaseTimer(cfg.reader_timings, profile=cfg.startup_profile)
     try:
-        stream = squeakimage.Stream(filename=cfg.path)
+        if cfg.mmap_image:
+            stream = squeakimage.MmapStream(cfg.path)
+        else:
+            stream = squeakimage.Stream(filename=cfg.path)
     except OSError as e:
         print_error("%s -- %s (LoadError)" % (os.strerror(e.errno), cfg.path))
         return 1
+    timer.phase("read stream")
 
     # Load & prepare image and environment
-    image = squeakimage.ImageReader(space, stream).create_image()
+    image = squeakimage.ImageReader(space, stream, lazy=cfg.mmap_image,
+                                    timer=timer).create_image()
     interp = interpreter.Interpreter(space, image,
                 trace=cfg.trace, trace_important=cfg.trace_important,
-                evented=not cfg.poll, interrupts=cfg.interrupts)
+                evented=not cfg.poll, interrupts=cfg.interrupts,
+                interrupt_timer=cfg.interrupt_timer)
+    interp.gc_stats.startup()
+    if cfg.memory_limit > 0:
+        interp.gc_stats.set_max_heap_size(cfg.memory_limit * 1024 * 1024)
     space.runtime_setup(cfg.exepath, argv, cfg.path, cfg.extra_arguments_idx)
+    timer.phase("setup interpreter")
 
     interp.populate_remaining_special_objects()
+    timer.phase("populate remaining special objects")
     print_error("") # Line break after image-loading characters
 
     # Create context to be executed
@@ -404,6 +455,7 @@ def entry_point(argv):
             w_receiver = space.wrap_int(cfg.number)
         if cfg.code:
             cfg.selector = compile_code(interp, w_receiver, cfg.code)
+            timer.phase("compile code")
         s_frame = create_context(interp, w_receiver, cfg.selector, cfg.stringarg)
         if cfg.headless:
             space.headless.activate()
@@ -414,8 +466,14 @@ def entry_point(argv):
     else:
         context = active_context(space)
 
+    timer.report()
+    timer = None
     cfg = None # make sure we free this
+    interp.start_interrupt_timer()
     w_result = execute_context(interp, context)
+    interp.stop_interrupt_timer()
+    interp.reactor.close()
+    interp.wait_for_snapshot()
     print result_string(w_result)
     return 0
 